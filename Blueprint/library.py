@@ -1,21 +1,43 @@
 from flask import (
     Blueprint,
+    Response,
     render_template,
     redirect,
     url_for,
     request,
     current_app,
+    jsonify,
+    stream_template,
+    stream_with_context,
 )
-import google.generativeai as genai
+import csv
+import io
+from werkzeug.utils import secure_filename
 from database import db
+from middleware import admission
 from models.musicpiece import MusicPiece
 from models.user import User
-from models.userlibrary import UserLibrary
+from services import (
+    aggregates,
+    descriptions,
+    libraries,
+    library_io,
+    library_writes,
+    llm,
+    recommender,
+    recordings,
+    shares,
+)
 import traceback
 
 # Define Blueprint for the library
 library = Blueprint("library", __name__, url_prefix="/library")
 
+BUSY_DESCRIPTION = (
+    "MySTRO is busy right now. A description of this piece will be written "
+    "on a later visit."
+)
+
 
 # Route to display user's music library
 @library.route("/", methods=["GET"])
@@ -37,16 +59,25 @@ def all_pieces():
             user_name=user_name,
         )
 
-    user_pieces = [entry.music_piece for entry in user.library]
+    user_pieces = libraries.pieces(user.id)
 
     return render_template(
         "library.html",
         pieces=user_pieces,
         username_missing=False,
         user_name=user_name,
+        recommendations=recommender.recommend_for(user.id, 5),
+        share_url=shares.share_url(user.id),
+        videos=recordings.for_pieces(user_pieces),
     )
 
 
+# Public, read-only snapshot of a user's library for share links
+@library.route("/share/<share_token>", methods=["GET"])
+def shared_library(share_token):
+    return shares.serve(share_token)
+
+
 # Route to add new music piece to the user's library
 @library.route("/add_piece", methods=["GET", "POST"])
 def add_piece():
@@ -59,60 +90,136 @@ def add_piece():
     popular = request.form.get("popular") == "true"
     recommended = request.form.get("recommended") == "true"
 
-    # Find the user, or create new one if not found
-    user = User.query.filter_by(username=user_name).first()
-    if not user:
-        user = User(username=user_name)
-        db.session.add(user)
-        db.session.commit()
-
-    # Find the music piece, or create new one if not found
-    music_piece = MusicPiece.query.filter_by(
-        composer=composer, title=title, subtitle=subtitle
-    ).first()
-    if not music_piece:
-        music_piece = MusicPiece(
-            composer=composer,
-            title=title,
-            subtitle=subtitle,
-            genre=genre,
-            popular=popular,
-            recommended=recommended,
-        )
-        db.session.add(music_piece)
-        db.session.commit()
-
-    # Check if music piece is already in user's library, and add it if not
-    existing_entry = UserLibrary.query.filter_by(
-        user_id=user.id, music_piece_id=music_piece.id
-    ).first()
-    if not existing_entry:
-        user_library_entry = UserLibrary(
-            user_id=user.id, music_piece_id=music_piece.id
-        )
-        db.session.add(user_library_entry)
-        db.session.commit()
-    else:
-        print(
-            f"Music piece '{title}' by '{composer}' is already in the library."
-        )
+    # Save the user, piece and library entry as needed. Edits from
+    # concurrent requests are committed together; this returns once ours is.
+    library_writes.add_piece(
+        user_name,
+        composer,
+        title,
+        subtitle,
+        genre,
+        popular,
+        recommended,
+        openopus_id=request.form.get("composer_id", type=int),
+    )
 
     # Redirect to user's library
     return redirect(url_for("library.all_pieces", user_name=user_name))
 
 
-# Function to delete music pieces not referenced by any user library
-def delete_orphaned_music_pieces():
-    orphaned_pieces = (
-        db.session.query(MusicPiece)
-        .outerjoin(UserLibrary, MusicPiece.id == UserLibrary.music_piece_id)
-        .filter(UserLibrary.music_piece_id == None)
-        .all()
+# Route to import pieces into a user's library from a CSV or JSON upload
+@library.route("/import", methods=["POST"])
+def import_library():
+    user_name = request.form.get("user_name")
+    upload = request.files.get("file")
+    if not user_name or not upload:
+        return jsonify({"error": "user_name and file are required"}), 400
+
+    format = library_io.detect_format(
+        upload.filename, request.form.get("format")
+    )
+    if format not in library_io.FORMATS:
+        return jsonify({"error": f"Unknown format: {format}"}), 400
+
+    try:
+        rows = library_io.read_rows(
+            io.TextIOWrapper(upload.stream, encoding="utf-8"), format
+        )
+        counts = library_io.import_library(user_name, rows)
+    except (ValueError, csv.Error) as e:
+        # JSONDecodeError and UnicodeDecodeError are ValueErrors
+        return jsonify({"error": f"Could not read file: {e}"}), 400
+    return jsonify(counts)
+
+
+# Route to download a user's library as CSV or JSON
+@library.route("/export", methods=["GET"])
+def export_library():
+    user_name = request.args.get("user_name")
+    if not user_name:
+        return "User not found", 404
+
+    format = request.args.get("format", "csv")
+    if format not in library_io.FORMATS:
+        return f"Unknown format: {format}", 400
+
+    # Rows are read from the database as the response is sent
+    chunks = library_io.export_library(user_name, format)
+    filename = secure_filename(f"{user_name}-library.{format}")
+    return Response(
+        stream_with_context(chunks),
+        mimetype=library_io.MIMETYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# Route to report the most saved pieces, composers and genres
+@library.route("/stats", methods=["GET"])
+def library_stats():
+    try:
+        limit = min(100, max(1, int(request.args.get("limit", 10))))
+    except ValueError:
+        limit = 10
+    return jsonify(
+        {
+            "pieces": [
+                {
+                    "id": piece.id,
+                    "title": piece.title,
+                    "composer": piece.composer,
+                    "saves": saves,
+                }
+                for piece, saves in aggregates.trending(limit)
+            ],
+            "composers": [
+                {"composer": composer.name, "saves": saves}
+                for composer, saves in aggregates.top_composers(limit)
+            ],
+            "genres": [
+                {"genre": genre, "saves": saves}
+                for genre, saves in aggregates.genre_totals()
+            ],
+        }
     )
 
-    for piece in orphaned_pieces:
-        db.session.delete(piece)
-    db.session.commit()
+
+# Route to suggest pieces similar to those in a user's library
+@library.route("/recommendations", methods=["GET"])
+def recommendations():
+    user = User.query.filter_by(username=request.args.get("user_name")).first()
+    if not user:
+        return "User not found", 404
+    try:
+        limit = min(100, max(1, int(request.args.get("limit", 10))))
+    except ValueError:
+        limit = 10
+    return jsonify(
+        [
+            {
+                "id": piece.id,
+                "title": piece.title,
+                "composer": piece.composer,
+                "score": round(score, 4),
+            }
+            for piece, score in recommender.recommend_for(user.id, limit)
+        ]
+    )
+
+
+# Route to list the pieces most often saved alongside a piece
+@library.route("/<int:piece_id>/also_saved", methods=["GET"])
+def also_saved(piece_id):
+    return jsonify(
+        [
+            {
+                "id": piece.id,
+                "title": piece.title,
+                "composer": piece.composer,
+                "users": users,
+            }
+            for piece, users in aggregates.also_saved(piece_id)
+        ]
+    )
 
 
 # Route to view or remove a single music piece from a user's library
@@ -127,66 +234,62 @@ def single_piece(piece_id):
     if not user:
         return "User not found", 404
 
-    user_library_entry = UserLibrary.query.filter_by(
-        user_id=user.id, music_piece_id=piece_id
-    ).first()
+    in_library = libraries.contains(user.id, piece_id)
 
     if (
         request.method == "POST"
         and request.form.get("submit_button") == "delete"
     ):
-        if user_library_entry:
-            db.session.delete(user_library_entry)
-            db.session.commit()
-            delete_orphaned_music_pieces()
+        if in_library:
+            library_writes.remove_piece(user.id, piece_id)
         return redirect(url_for("library.all_pieces", user_name=user_name))
 
+    if not in_library:
+        return "Piece not found", 404
+
+    piece = db.session.get(MusicPiece, piece_id)
+    context = {
+        "piece": piece,
+        "user_name": user_name,
+        "saves": aggregates.piece_saves(piece.id),
+        "also_saved": aggregates.also_saved(piece.id),
+    }
+
+    # Over budget, only a stored description is shown
+    if admission.degraded():
+        ai_description = descriptions.stored(piece.id) or BUSY_DESCRIPTION
+        return render_template(
+            "library_piece.html", ai_description=ai_description, **context
+        )
+
+    # In streaming mode the page is sent straight away and the description
+    # follows as Gemini writes it
+    if llm.streaming():
+        return stream_template(
+            "library_piece.html",
+            ai_description_stream=stream_piece_description(piece),
+            **context,
+        )
+
     # Generate AI description for the piece
-    piece = user_library_entry.music_piece
     print(f"Generating description for piece: {piece.title}")
     ai_description = generate_piece_description(piece)
     print(f"Generated description: {ai_description}")
 
     return render_template(
-        "library_piece.html",
-        piece=piece,
-        ai_description=ai_description,
-        user_name=user_name,
+        "library_piece.html", ai_description=ai_description, **context
     )
 
 
 def generate_piece_description(piece):
     try:
-        print("Starting description generation...")
-
         # Access the API key
         api_key = current_app.config["GOOGLE_API_KEY"]
         if not api_key:
             print("No Google API key found in config")
             return "Unable to generate description: API key not configured"
 
-        # Configure Gemini AI
-        genai.configure(api_key=api_key)
-        print("Configured Gemini AI")
-
-        model = genai.GenerativeModel("gemini-pro")
-        print("Created model instance")
-
-        prompt = (
-            f"Generate a brief, engaging description (2-3 sentences) of the following classical music piece:\n"
-            f"Title: {piece.title}\n"
-            f"Composer: {piece.composer}\n"
-            f"Genre: {piece.genre}\n"
-            f"Additional info: {'This is a popular piece. ' if piece.popular else ''}"
-            f"{'This piece is highly recommended by critics. ' if piece.recommended else ''}\n"
-            "Focus on what makes this piece special and its historical or musical significance."
-        )
-        print(f"Using prompt: {prompt}")
-
-        response = model.generate_content(prompt)
-        description = response.text
-        print(f"Successfully generated description: {description}")
-        return description
+        return descriptions.describe(piece)
 
     except Exception as e:
         print(f"Error type: {type(e)}")
@@ -196,6 +299,17 @@ def generate_piece_description(piece):
         return f"Unable to generate description. Error: {str(e)}"
 
 
+def stream_piece_description(piece):
+    if not current_app.config["GOOGLE_API_KEY"]:
+        print("No Google API key found in config")
+        return iter(["Unable to generate description: API key not configured"])
+
+    return llm.guarded(
+        descriptions.stream_description(piece),
+        "Unable to generate description. Error: {error}",
+    )
+
+
 # Route to display the library form and handle composer and genre selection
 @library.route("/form", methods=["GET", "POST"])
 def library_form():
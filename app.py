@@ -1,16 +1,53 @@
 import click
-from flask import Flask, render_template, request
+from flask import Flask, jsonify, render_template, request, stream_template
 import requests
 from database import db as database
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
 import Blueprint as blueprints
-from cli import create_all, drop_all, populate
+from cli import (
+    build_assets,
+    build_recommendations,
+    create_all,
+    describe_pieces,
+    drop_all,
+    export_library,
+    import_library,
+    llm_usage_report,
+    memory_report,
+    migrate_composers,
+    populate,
+    rebuild_aggregates,
+    refresh_catalogue,
+    reshard,
+    resolve_recordings,
+    seed,
+    warm_catalogue,
+)
 from flask_session import Session
-
-
-def create_app(testing=False):
+from werkzeug.middleware.proxy_fix import ProxyFix
+from services import (
+    catalogue,
+    composer_names,
+    invalidation,
+    libraries,
+    library_writes,
+    llm,
+    llm_usage,
+    metrics,
+    openopus,
+    recordings,
+    search as search_service,
+    upstream,
+    warming,
+    weather,
+)
+from async_routes import register_async_routes
+from middleware import admission, assets, compression, memory
+
+
+def create_app(testing=False, async_mode=False):
     # Initialize Flask application
     app = Flask(
         __name__, template_folder="src/templates", static_folder="src/static"
@@ -26,37 +63,99 @@ def create_app(testing=False):
                 "SQLALCHEMY_TRACK_MODIFICATIONS": False,
                 "WEATHER_API_KEY": "test_key",
                 "GOOGLE_API_KEY": "test_key",
+                "CHANGE_LOG_URI": "sqlite://",
+                "ASYNC_MODE": async_mode,
             }
         )
         database.init_app(app)
         app.register_blueprint(blueprints.library)
+        admission.init_app(app)
+        memory.init_app(app)
+        assets.init_app(app)
+        compression.init_app(app)
+        invalidation.init_app(app)
+        libraries.init_app(app)
+        library_writes.init_app(app)
+        llm_usage.init_app(app)
+        recordings.init_app(app)
+        warming.init_app(app)
         register_routes(app)
         return app
 
     # Set up production configuration
     load_dotenv()
+    # Proxies in front of the app (the Procfile sets 1, for the platform's
+    # router). Behind them, the client's address is the hop they added to
+    # X-Forwarded-For.
+    trusted_proxies = int(os.getenv("TRUSTED_PROXIES", "0"))
     app.config.update(
         {
             "SQLALCHEMY_DATABASE_URI": "sqlite:///mystro.db",
             "SQLALCHEMY_TRACK_MODIFICATIONS": False,
             "WEATHER_API_KEY": os.getenv("WEATHER_API_KEY"),
             "GOOGLE_API_KEY": os.getenv("GOOGLE_API_KEY"),
+            "YOUTUBE_API_KEY": os.getenv("YOUTUBE_API_KEY"),
             "SESSION_TYPE": "filesystem",
+            "ASYNC_MODE": async_mode
+            or os.getenv("ASYNC_MODE", "false").lower() == "true",
+            "MINIFY_HTML": os.getenv("MINIFY_HTML", "false").lower() == "true",
+            "LLM_BACKEND": os.getenv("LLM_BACKEND", "gemini"),
+            "STREAM_LLM": os.getenv("STREAM_LLM", "false").lower() == "true",
+            "LIBRARY_SHARDS": int(os.getenv("LIBRARY_SHARDS", "1")),
+            "MEMORY_PROFILE": os.getenv("MEMORY_PROFILE", "false").lower()
+            == "true",
+            "CATALOGUE_WARM_INTERVAL": float(
+                os.getenv("CATALOGUE_WARM_INTERVAL", "0")
+            ),
+            # Without trusted proxies, every client may share the address
+            # of one, so one slot per address would serve one client at once
+            "ADMISSION_PER_USER": 1 if trusted_proxies else None,
         }
     )
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
 
     genai.configure(api_key=app.config["GOOGLE_API_KEY"])
     Session(app)
     database.init_app(app)
     app.register_blueprint(blueprints.library)
+    admission.init_app(app)
+    # After admission, so a request queued for a slot doesn't hold up the
+    # profiler
+    memory.init_app(app)
+    assets.init_app(app)
+    compression.init_app(app)
+    invalidation.init_app(app)
+    libraries.init_app(app)
+    library_writes.init_app(app)
+    llm_usage.init_app(app)
+    recordings.init_app(app)
+    warming.init_app(app)
 
     # Register CLI commands
     with app.app_context():
         app.cli.add_command(create_all)
         app.cli.add_command(drop_all)
         app.cli.add_command(populate)
+        app.cli.add_command(seed)
+        app.cli.add_command(rebuild_aggregates)
+        app.cli.add_command(reshard)
+        app.cli.add_command(migrate_composers)
+        app.cli.add_command(build_recommendations)
+        app.cli.add_command(describe_pieces)
+        app.cli.add_command(resolve_recordings)
+        app.cli.add_command(llm_usage_report)
+        app.cli.add_command(memory_report)
+        app.cli.add_command(import_library)
+        app.cli.add_command(export_library)
+        app.cli.add_command(refresh_catalogue)
+        app.cli.add_command(warm_catalogue)
+        app.cli.add_command(build_assets)
         click.echo("CLI commands registered")
 
+        # Searches are served from the saved catalogue where possible
+        catalogue.load()
+
     register_routes(app)
     return app
 
@@ -67,47 +166,68 @@ def register_routes(app):
     def hello_world():
         return render_template("about.html")
 
+    @app.route("/search/works")
+    def search_works():
+        # One page of search results, filtered on the server
+        collect = (
+            search_service.collect_indexed
+            if admission.degraded()
+            else search_service.collect
+        )
+        results, _ = collect(
+            request.args.getlist("composer_id"), request.args.getlist("genres")
+        )
+        return jsonify(
+            search_service.page(
+                results,
+                **search_service.page_args(request.args),
+                saved=search_service.saved_keys(request.args.get("user_name")),
+            )
+        )
+
+    @app.route("/metrics")
+    def metrics_report():
+        return jsonify(metrics.snapshot())
+
+    # Async mode serves the upstream-bound routes with async views instead
+    if app.config.get("ASYNC_MODE"):
+        register_async_routes(app)
+        return
+
     @app.route("/form", methods=["GET", "POST"])
     def form():
         composers = []
         error = None
 
         try:
-            composers_url = (
-                "https://api.openopus.org/composer/list/name/all.json"
-            )
-            response = requests.get(composers_url)
+            response = upstream.get("openopus", openopus.all_composers_url())
             response.raise_for_status()  # Raise exception for bad status codes
 
             data = response.json()
             composers = data.get("composers", [])
+            composer_names.remember(composers)
         except (requests.RequestException, ValueError) as e:
             error = "Failed to fetch composers"
             print(f"Error fetching composers: {e}")
 
-        genres = [
-            "Keyboard",
-            "Orchestral",
-            "Chamber",
-            "Stage",
-            "Choral",
-            "Opera",
-            "Vocal",
-        ]
         return render_template(
-            "form.html", composers=composers, genres=genres, error=error
+            "form.html",
+            composers=composers,
+            genres=openopus.GENRES,
+            error=error,
         )
 
     @app.route("/weather-mood")
     def weather_mood():
-        # Fetch weather data and generate classical music suggestion
-        weather_url = (
-            "http://api.weatherapi.com/v1/current.json"
-            f"?key={app.config['WEATHER_API_KEY']}&q=London&aqi=no"
-        )
+        # Over budget, show the last weather and suggestion instead
+        if admission.degraded():
+            return render_template("weather_mood.html", **weather.latest())
 
+        # Fetch weather data and generate classical music suggestion
         try:
-            weather_response = requests.get(weather_url)
+            weather_response = upstream.get(
+                "weatherapi", weather.current_weather_url()
+            )
             weather_data = (
                 weather_response.json()
                 if weather_response.status_code == 200
@@ -115,36 +235,31 @@ def register_routes(app):
             )
 
             if weather_data:
-                composers_url = (
-                    "https://api.openopus.org/composer/list/pop.json"
-                )
-                composers_response = requests.get(composers_url)
                 composers = []
 
-                if composers_response.status_code == 200:
-                    response_data = composers_response.json()
-                    composers_list = response_data.get("composers", [])
-                    composers = composers_list[:5]
-
-                weather_current = weather_data.get("current", {})
-                weather_condition = weather_current.get("condition", {})
-                weather_desc = weather_condition.get("text", "")
-                temp = weather_current.get("temp_c", 0)
-
-                composer_names = [
-                    composer.get("complete_name") for composer in composers
-                ]
-                model = genai.GenerativeModel("gemini-pro")
-
-                prompt = (
-                    f"Given that it's {weather_desc} and {temp}°C in London today, "
-                    "suggest a classical music piece that would complement this weather. "
-                    f"Consider selecting from works by these composers: {', '.join(composer_names)}. "
-                    "Explain briefly why this piece fits the current weather and mood. Keep your response concise but engaging."
-                )
-
-                response = model.generate_content(prompt)
-                suggestion = response.text
+                # The suggestion still works without the composer hint
+                try:
+                    composers_response = upstream.get(
+                        "openopus", openopus.popular_composers_url()
+                    )
+                    if composers_response.status_code == 200:
+                        response_data = composers_response.json()
+                        composers_list = response_data.get("composers", [])
+                        composers = composers_list[:5]
+                except requests.RequestException as e:
+                    print(f"Error fetching popular composers: {e}")
+
+                # In streaming mode the suggestion follows the rest of the page
+                if llm.streaming():
+                    return stream_template(
+                        "weather_mood.html",
+                        weather=weather_data,
+                        suggestion_stream=llm.guarded(
+                            weather.stream_suggestion(weather_data, composers)
+                        ),
+                    )
+
+                suggestion = weather.suggest(weather_data, composers)
             else:
                 suggestion = None
 
@@ -169,58 +284,16 @@ def register_routes(app):
         if not selected_genres:
             return "No genres selected. Please try again."
 
-        all_works = []
-
-        for composer_id in selected_composer_ids:
-            composer_url = (
-                "https://api.openopus.org/composer/list/"
-                f"ids/{composer_id}.json"
-            )
-            composer_response = requests.get(composer_url)
-            composer_name = "Unknown Composer"
-
-            if composer_response.status_code == 200:
-                composer_data = composer_response.json()
-                composer_name = composer_data.get("composers", [{}])[0].get(
-                    "complete_name", "Unknown Composer"
-                )
-
-            works_url = (
-                "https://api.openopus.org/work/list/composer/"
-                f"{composer_id}/genre/all.json"
-            )
-            response = requests.get(works_url)
-
-            if response.status_code == 200:
-                data = response.json()
-                composer_works = data.get("works", [])
-                filtered_works = [
-                    {
-                        "title": work.get("title", ""),
-                        "genre": work.get("genre", ""),
-                        "subtitle": work.get("subtitle", ""),
-                        "popular": work.get("popular") == "1",
-                        "recommended": work.get("recommended") == "1",
-                        "composer_name": composer_name,
-                        "composer_id": composer_id,
-                    }
-                    for work in composer_works
-                    if work.get("genre") in selected_genres
-                ]
-                all_works.extend(filtered_works)
-            else:
-                return render_template("noresults.html")
-
-        unique_composers = sorted(
-            list(set(work["composer_name"] for work in all_works))
+        # Over budget, search only the composers already in the catalogue
+        collect = (
+            search_service.collect_indexed
+            if admission.degraded()
+            else search_service.collect
         )
-
-        return render_template(
-            "results.html",
-            name=name,
-            works=all_works,
-            composers=unique_composers,
+        results, failed_composers = collect(
+            selected_composer_ids, selected_genres
         )
+        return search_service.render_results(name, results, failed_composers)
 
 
 # Only create production app if running directly
@@ -0,0 +1,197 @@
+import asyncio
+import ssl
+import certifi
+import httpx
+from flask import Response, current_app, render_template, request
+from flask.globals import request_ctx
+from middleware import admission
+from services import (
+    catalogue,
+    composer_names,
+    llm,
+    openopus,
+    search as search_service,
+    upstream,
+    weather,
+)
+
+# Async versions of the routes that spend their time waiting on OpenOpus,
+# WeatherAPI and Gemini. Upstream calls made by one request run
+# concurrently instead of one after another.
+
+# Loading the CA bundle is slow, so build the TLS context once per process
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+
+# Create the async HTTP client used by a single request
+def http_client():
+    connect_timeout, read_timeout = upstream.timeout()
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        verify=SSL_CONTEXT,
+    )
+
+
+# Stream a template from an async view. stream_template() can't be used
+# here, as it enters the request context inside the view's event loop;
+# instead a copy of the context is entered as the response is sent.
+def stream_page(template_name, **context):
+    app = current_app._get_current_object()
+    ctx = request_ctx.copy()
+
+    def generate():
+        with ctx:
+            app.update_template_context(context)
+            template = app.jinja_env.get_template(template_name)
+            yield from template.generate(context)
+
+    return Response(generate())
+
+
+def register_async_routes(app):
+    @app.route("/form", methods=["GET", "POST"])
+    async def form():
+        composers = []
+        error = None
+
+        try:
+            async with http_client() as client:
+                response = await upstream.get_async(
+                    client, "openopus", openopus.all_composers_url()
+                )
+            response.raise_for_status()  # Raise exception for bad status codes
+
+            data = response.json()
+            composers = data.get("composers", [])
+            composer_names.remember(composers)
+        except upstream.ASYNC_ERRORS as e:
+            error = "Failed to fetch composers"
+            print(f"Error fetching composers: {e}")
+
+        return render_template(
+            "form.html",
+            composers=composers,
+            genres=openopus.GENRES,
+            error=error,
+        )
+
+    @app.route("/weather-mood")
+    async def weather_mood():
+        # Over budget, show the last weather and suggestion instead
+        if admission.degraded():
+            return render_template("weather_mood.html", **weather.latest())
+
+        # Fetch weather data and popular composers at the same time
+        try:
+            async with http_client() as client:
+                weather_response, composers_response = await asyncio.gather(
+                    upstream.get_async(
+                        client, "weatherapi", weather.current_weather_url()
+                    ),
+                    upstream.get_async(
+                        client, "openopus", openopus.popular_composers_url()
+                    ),
+                    return_exceptions=True,
+                )
+            if isinstance(weather_response, Exception):
+                raise weather_response
+            weather_data = (
+                weather_response.json()
+                if weather_response.status_code == 200
+                else None
+            )
+
+            if weather_data:
+                composers = []
+
+                # The suggestion still works without the composer hint
+                if isinstance(composers_response, Exception):
+                    print(
+                        f"Error fetching popular composers: {composers_response}"
+                    )
+                elif composers_response.status_code == 200:
+                    response_data = composers_response.json()
+                    composers_list = response_data.get("composers", [])
+                    composers = composers_list[:5]
+
+                # In streaming mode the suggestion follows the rest of the page
+                if llm.streaming():
+                    return stream_page(
+                        "weather_mood.html",
+                        weather=weather_data,
+                        suggestion_stream=llm.guarded(
+                            weather.stream_suggestion(weather_data, composers)
+                        ),
+                    )
+
+                suggestion = await weather.suggest_async(
+                    weather_data, composers
+                )
+            else:
+                suggestion = None
+
+        except Exception as e:
+            print(f"Error: {e}")
+            weather_data = None
+            suggestion = None
+
+        return render_template(
+            "weather_mood.html", weather=weather_data, suggestion=suggestion
+        )
+
+    @app.route("/search", methods=["POST"])
+    async def search():
+        # Handle search functionality
+        selected_composer_ids = request.form.getlist("composer_id")
+        name = request.form.get("name")
+        selected_genres = request.form.getlist("genres")
+
+        if not selected_composer_ids:
+            return "No composer selected. Please try again."
+        if not selected_genres:
+            return "No genres selected. Please try again."
+
+        # Over budget, search only the composers already in the catalogue
+        if admission.degraded():
+            results, failed_composers = search_service.collect_indexed(
+                selected_composer_ids, selected_genres
+            )
+            return search_service.render_results(
+                name, results, failed_composers
+            )
+
+        # Fetch the composer names and every composer's works concurrently
+        async with http_client() as client:
+            names, *responses = await asyncio.gather(
+                composer_names.resolve_async(client, selected_composer_ids),
+                *(
+                    catalogue.works_for_async(
+                        client, composer_id, selected_genres
+                    )
+                    for composer_id in selected_composer_ids
+                ),
+                return_exceptions=True,
+            )
+
+        if isinstance(names, Exception):
+            raise names
+
+        results = []
+        failed_composers = []
+
+        # A composer that can't be fetched is reported, not fatal
+        for composer_id, works in zip(selected_composer_ids, responses):
+            composer_name = names[composer_id]
+            if isinstance(works, upstream.ASYNC_ERRORS):
+                print(
+                    f"Error fetching works for composer {composer_id}: {works}"
+                )
+                failed_composers.append(
+                    openopus.failed_composer_label(composer_id, composer_name)
+                )
+            elif isinstance(works, Exception):
+                raise works
+            else:
+                results.append((composer_id, composer_name, works))
+
+        return search_service.render_results(name, results, failed_composers)
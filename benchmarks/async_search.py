@@ -0,0 +1,96 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+
+# Compare /search in sync and async mode against a slow OpenOpus stand-in.
+#
+#   python benchmarks/async_search.py --composers 5 --concurrency 1 10 50
+#
+# Every upstream call takes --latency seconds, so the sync views pay it
+# twice per composer while the async views overlap all of them.
+
+
+class SlowUpstream(BaseHTTPRequestHandler):
+    latency = 0.1
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if "/work/list/" in self.path:
+            body = (
+                b'{"works": [{"title": "Symphony", "genre": "Orchestral",'
+                b' "popular": "1", "recommended": "0"}]}'
+            )
+        else:
+            body = b'{"composers": [{"complete_name": "Composer"}]}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops bursts of concurrent connections
+    request_queue_size = 1024
+
+
+def start_upstream(latency):
+    SlowUpstream.latency = latency
+    server = UpstreamServer(("127.0.0.1", 0), SlowUpstream)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Run `concurrency` searches at once and return (wall time, mean latency)
+def run(app, composers, concurrency):
+    form_data = {
+        "composer_id": [str(i) for i in range(composers)],
+        "name": "bench",
+        "genres": ["Orchestral"],
+    }
+
+    def one_search(_):
+        started = time.perf_counter()
+        response = app.test_client().post("/search", data=form_data)
+        assert response.status_code == 200
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one_search, range(concurrency)))
+    return time.perf_counter() - started, sum(latencies) / len(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--composers", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 10, 50]
+    )
+    args = parser.parse_args()
+
+    upstream = start_upstream(args.latency)
+    base_url = f"http://127.0.0.1:{upstream.server_port}"
+
+    print(f"{'mode':>6} {'concurrent':>10} {'wall s':>8} {'mean s':>8}")
+    for mode in ("sync", "async"):
+        app = create_app(testing=True, async_mode=mode == "async")
+        app.config["OPENOPUS_API_URL"] = base_url
+        for concurrency in args.concurrency:
+            wall, mean = run(app, args.composers, concurrency)
+            print(f"{mode:>6} {concurrency:>10} {wall:>8.2f} {mean:>8.2f}")
+
+    upstream.shutdown()
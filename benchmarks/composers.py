@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.musicpiece import piece_key
+from services import openopus, seed
+
+# Size of the index used to deduplicate pieces, and the time to find an
+# existing piece, with composer names on every piece and a unique index on
+# (composer, title, subtitle), against composer ids and a unique index on
+# the hashed natural key.
+#
+#   python benchmarks/composers.py --pieces 10000 100000 1000000
+
+LOOKUPS = 20_000
+
+
+def synthetic_pieces(count):
+    return [
+        (
+            seed.COMPOSERS[rank % len(seed.COMPOSERS)],
+            f"{seed.FORMS[rank % len(seed.FORMS)]} No. {rank // 96 + 1}",
+            f"Op. {rank + 1} in {'ABCDEFG'[rank % 7]} minor",
+            openopus.GENRES[rank % len(openopus.GENRES)],
+        )
+        for rank in range(count)
+    ]
+
+
+def pages(connection):
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    return connection.execute("PRAGMA page_count").fetchone()[0] * page_size
+
+
+# (table bytes, index bytes) after loading the pieces and adding the index
+def load(connection, create, insert, rows, index):
+    connection.executescript(create)
+    connection.executemany(insert, rows)
+    connection.commit()
+    table = pages(connection)
+    connection.execute(index)
+    connection.commit()
+    return table, pages(connection) - table
+
+
+def time_lookups(lookup, keys):
+    started = time.perf_counter()
+    for key in keys:
+        lookup(*key)
+    return (time.perf_counter() - started) / len(keys)
+
+
+def old_schema(pieces):
+    connection = sqlite3.connect(":memory:")
+    sizes = load(
+        connection,
+        "CREATE TABLE music_pieces (id INTEGER PRIMARY KEY, "
+        "composer VARCHAR(80), title VARCHAR(80), subtitle VARCHAR(80), "
+        "genre VARCHAR(80))",
+        "INSERT INTO music_pieces (composer, title, subtitle, genre) "
+        "VALUES (?, ?, ?, ?)",
+        pieces,
+        "CREATE UNIQUE INDEX unique_music_piece "
+        "ON music_pieces (composer, title, subtitle)",
+    )
+
+    def lookup(composer, title, subtitle):
+        return connection.execute(
+            "SELECT id FROM music_pieces "
+            "WHERE composer = ? AND title = ? AND subtitle = ?",
+            (composer, title, subtitle),
+        ).fetchone()
+
+    return sizes, lookup
+
+
+def new_schema(pieces):
+    connection = sqlite3.connect(":memory:")
+    composer_ids = {name: id for id, name in enumerate(seed.COMPOSERS, 1)}
+    sizes = load(
+        connection,
+        "CREATE TABLE composers (id INTEGER PRIMARY KEY, name VARCHAR(80));"
+        "CREATE TABLE music_pieces (id INTEGER PRIMARY KEY, "
+        "composer_id INTEGER, title VARCHAR(80), subtitle VARCHAR(80), "
+        "genre VARCHAR(80), natural_key BIGINT)",
+        "INSERT INTO music_pieces "
+        "(composer_id, title, subtitle, genre, natural_key) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                composer_ids[composer],
+                title,
+                subtitle,
+                genre,
+                piece_key(composer, title, subtitle),
+            )
+            for composer, title, subtitle, genre in pieces
+        ],
+        "CREATE UNIQUE INDEX unique_music_piece "
+        "ON music_pieces (natural_key)",
+    )
+
+    # The key is hashed per lookup, as add_piece and imports do
+    def lookup(composer, title, subtitle):
+        return connection.execute(
+            "SELECT id FROM music_pieces WHERE natural_key = ?",
+            (piece_key(composer, title, subtitle),),
+        ).fetchone()
+
+    return sizes, lookup
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pieces", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'pieces':>9} {'schema':>7} {'table MB':>9} {'index MB':>9} "
+        f"{'lookup us':>10}"
+    )
+    for count in args.pieces:
+        pieces = synthetic_pieces(count)
+        keys = [
+            piece[:3]
+            for piece in random.Random(0).choices(
+                pieces, k=min(LOOKUPS, count)
+            )
+        ]
+        for name, schema in (("names", old_schema), ("keys", new_schema)):
+            (table, index), lookup = schema(pieces)
+            print(
+                f"{count:>9} {name:>7} {table / 1e6:>9.1f} "
+                f"{index / 1e6:>9.1f} "
+                f"{time_lookups(lookup, keys) * 1e6:>10.2f}"
+            )
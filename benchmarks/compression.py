@@ -0,0 +1,107 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests_mock
+from app import create_app
+from services import catalogue, composer_names, openopus
+
+# Bytes on the wire and CPU per request for the search form and a page of
+# search results, uncompressed, gzip, Brotli and Brotli after minifying,
+# with the compressed body cache cold (every request compresses) and warm.
+#
+#   python benchmarks/compression.py --composers 1500 --works 2000
+
+ALL_URL = "https://api.openopus.org/composer/list/name/all.json"
+
+MODES = [
+    ("identity", "identity", False),
+    ("gzip", "gzip", False),
+    ("br", "br", False),
+    ("minify+br", "br", True),
+]
+
+
+def synthetic_composers(count):
+    return [
+        {
+            "id": str(i),
+            "name": f"Composer {i}",
+            "complete_name": f"Composer Number {i}",
+            "epoch": "Romantic",
+        }
+        for i in range(count)
+    ]
+
+
+def fill_catalogue(app, works):
+    with app.app_context():
+        composer_names.remember(
+            [{"id": "1", "complete_name": "Composer Number 1"}]
+        )
+        catalogue.get_index().add(
+            "1",
+            (
+                catalogue.compact_work(
+                    {
+                        "title": f"Work No. {i}",
+                        "genre": openopus.GENRES[i % len(openopus.GENRES)],
+                        "popular": "1" if i % 4 == 0 else "0",
+                    }
+                )
+                for i in range(works)
+            ),
+        )
+
+
+# CPU seconds and response bytes per request, averaged over the repeats
+def measure(app, path, encoding, warm, repeats):
+    client = app.test_client()
+    cache = app.extensions["compression_cache"]
+    headers = {"Accept-Encoding": encoding}
+    client.get(path, headers=headers)
+    size = 0
+    started = time.process_time()
+    for _ in range(repeats):
+        if not warm:
+            cache.entries.clear()
+            cache.size = 0
+        size = len(client.get(path, headers=headers).data)
+    return (time.process_time() - started) / repeats, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--composers", type=int, default=1500)
+    parser.add_argument("--works", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    paths = {
+        "/form": "/form",
+        "/search/works": "/search/works?composer_id=1&limit=200"
+        + "".join(f"&genres={genre}" for genre in openopus.GENRES),
+    }
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            ALL_URL, json={"composers": synthetic_composers(args.composers)}
+        )
+        print(
+            f"{'':>14} {'mode':>10} {'bytes':>9} {'cold ms':>8} "
+            f"{'warm ms':>8}"
+        )
+        for label, path in paths.items():
+            for mode, encoding, minify in MODES:
+                app = create_app(testing=True)
+                app.config["MINIFY_HTML"] = minify
+                fill_catalogue(app, args.works)
+                cold, size = measure(app, path, encoding, False, args.repeats)
+                warm, _ = measure(app, path, encoding, True, args.repeats)
+                print(
+                    f"{label:>14} {mode:>10} {size:>9} {cold * 1e3:>8.2f} "
+                    f"{warm * 1e3:>8.2f}"
+                )
@@ -0,0 +1,101 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import catalogue, openopus
+
+# Compare filtering OpenOpus work dicts with a list scan (what /search used
+# to do) against the precomputed genre index, for memory and lookup time.
+#
+#   python benchmarks/genre_index.py --works 1000000 --composers 2000
+
+
+def synthetic_works(count, composers):
+    random.seed(0)
+    subtitles = ["", "", "", "Op. 1", "BWV 1", "K. 1"]
+    by_composer = {str(i): [] for i in range(composers)}
+    for i in range(count):
+        by_composer[str(i % composers)].append(
+            {
+                "title": f"Work No. {i % 500}",
+                "subtitle": random.choice(subtitles),
+                "genre": random.choice(openopus.GENRES),
+                "popular": random.choice(["0", "0", "0", "1"]),
+                "recommended": random.choice(["0", "0", "1"]),
+            }
+        )
+    return by_composer
+
+
+# Build with the tracer on and report the bytes still held afterwards
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def copy_dicts(by_composer):
+    return {
+        composer_id: [dict(work) for work in works]
+        for composer_id, works in by_composer.items()
+    }
+
+
+def build_index(by_composer):
+    index = catalogue.WorksIndex()
+    for composer_id, works in by_composer.items():
+        index.add(composer_id, map(catalogue.compact_work, works))
+    return index
+
+
+def time_lookups(lookup, composer_ids, genres, repeats):
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for composer_id in composer_ids:
+            lookup(composer_id, genres)
+    return (time.perf_counter() - started) / (repeats * len(composer_ids))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--works", type=int, default=1_000_000)
+    parser.add_argument("--composers", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    source = synthetic_works(args.works, args.composers)
+    dicts, dict_bytes = measure(lambda: copy_dicts(source))
+    index, index_bytes = measure(lambda: build_index(source))
+
+    genres = ["Keyboard", "Chamber"]
+    composer_ids = random.sample(list(source), min(50, args.composers))
+
+    def scan(composer_id, genres):
+        return [
+            work for work in dicts[composer_id] if work.get("genre") in genres
+        ]
+
+    def lookup(composer_id, genres):
+        return index.composers[composer_id].in_genres(genres)
+
+    scan_time = time_lookups(scan, composer_ids, genres, args.repeats)
+    index_time = time_lookups(lookup, composer_ids, genres, args.repeats)
+
+    # Bytes per work is the same number as megabytes per million works
+    print(f"{args.works} works by {args.composers} composers")
+    print(f"{'':>12} {'MB/M works':>12} {'us/lookup':>10}")
+    print(
+        f"{'dict scan':>12} {dict_bytes / args.works:>12.1f} "
+        f"{scan_time * 1e6:>10.1f}"
+    )
+    print(
+        f"{'index':>12} {index_bytes / args.works:>12.1f} "
+        f"{index_time * 1e6:>10.1f}"
+    )
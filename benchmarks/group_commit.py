@@ -0,0 +1,119 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db
+from middleware import compression
+from services import invalidation, library_writes, recordings
+
+# Library edits per second from concurrent writers, each committing its
+# own edit against group commit, on a SQLite file like production's.
+#
+#   python benchmarks/group_commit.py --writers 1 8 32 --edits 50
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def bench_app(directory, group_commit):
+    app = Flask(
+        "app",
+        root_path=ROOT,
+        template_folder="src/templates",
+        static_folder="src/static",
+    )
+    app.config.update(
+        {
+            "SQLALCHEMY_DATABASE_URI": (
+                f"sqlite:///{os.path.join(directory, 'bench.db')}"
+            ),
+            "SHARE_PATH": os.path.join(directory, "shares"),
+            "CHANGE_LOG_URI": (
+                f"sqlite:///{os.path.join(directory, 'changes.db')}"
+            ),
+            "GROUP_COMMIT": group_commit,
+        }
+    )
+    db.init_app(app)
+    compression.init_app(app)
+    invalidation.init_app(app)
+    library_writes.init_app(app)
+    recordings.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+# Run the writers at once, returning edits committed per second, the
+# 95th percentile latency and the number of edits that failed, which with
+# SQLite's default 5 second busy timeout means "database is locked"
+def run(app, writers, edits):
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(writers)
+
+    def writer(number):
+        with app.app_context():
+            barrier.wait()
+            for edit in range(edits):
+                started = time.perf_counter()
+                try:
+                    library_writes.add_piece(
+                        f"user{number}",
+                        "Bach",
+                        f"Invention {number}.{edit}",
+                        genre="Keyboard",
+                    )
+                except OperationalError:
+                    with lock:
+                        failures.append(edit)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            db.session.remove()
+
+    threads = [
+        threading.Thread(target=writer, args=(number,))
+        for number in range(writers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        latencies[int(len(latencies) * 0.95)],
+        len(failures),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--edits", type=int, default=50)
+    args = parser.parse_args()
+
+    print(
+        f"{'writers':>8} {'mode':>8} {'edits/s':>9} {'p95 ms':>8} "
+        f"{'failed':>7}"
+    )
+    for writers in args.writers:
+        for mode, group_commit in (("single", False), ("group", True)):
+            with tempfile.TemporaryDirectory() as directory:
+                app = bench_app(directory, group_commit)
+                rate, p95, failed = run(app, writers, args.edits)
+            print(
+                f"{writers:>8} {mode:>8} {rate:>9.0f} {p95 * 1000:>8.1f} "
+                f"{failed:>7}"
+            )
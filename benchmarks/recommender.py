@@ -0,0 +1,83 @@
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import accumulate
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import recommender, seed
+
+# Neighbour table build time and recommendation latency as the numbers of
+# users and pieces grow, on libraries generated like `flask seed`'s.
+#
+#   python benchmarks/recommender.py --users 1000 10000 50000 --per-user 50
+
+
+def synthetic_links(users, pieces, per_user, skew=1.1):
+    rng = random.Random(0)
+    piece_ids = range(1, pieces + 1)
+    cum_weights = list(
+        accumulate(1 / (rank + 1) ** skew for rank in range(pieces))
+    )
+    links = [
+        link
+        for batch in seed.library_links(
+            rng, users, 1, piece_ids, cum_weights, per_user
+        )
+        for link in batch
+    ]
+    links = np.array(links, dtype=np.int64)
+    return links[:, 0], links[:, 1]
+
+
+def time_queries(table, user_ids, piece_ids, repeats):
+    libraries = [
+        piece_ids[user_ids == user]
+        for user in np.random.default_rng(0).choice(
+            np.unique(user_ids), repeats
+        )
+    ]
+    started = time.perf_counter()
+    for library in libraries:
+        table.recommend(library, 10)
+    return (time.perf_counter() - started) / repeats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--users", type=int, nargs="+", default=[1000, 10000, 50000]
+    )
+    parser.add_argument("--pieces-per-user", type=float, default=2.0)
+    parser.add_argument("--per-user", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print(
+        f"{'users':>8} {'pieces':>8} {'links':>9} {'build s':>8} "
+        f"{'refresh s':>9} {'query ms':>9}"
+    )
+    for users in args.users:
+        pieces = int(users * args.pieces_per_user)
+        user_ids, piece_ids = synthetic_links(users, pieces, args.per_user)
+
+        started = time.perf_counter()
+        table, _ = recommender.build_table(user_ids, piece_ids)
+        build = time.perf_counter() - started
+
+        # One more save for 1% of users, then an incremental refresh
+        extra = np.unique(user_ids)[::100]
+        user_ids = np.concatenate([user_ids, extra])
+        piece_ids = np.concatenate([piece_ids, np.full(len(extra), pieces)])
+        started = time.perf_counter()
+        recommender.build_table(user_ids, piece_ids, previous=table)
+        refresh = time.perf_counter() - started
+
+        query = time_queries(table, user_ids, piece_ids, args.queries)
+        print(
+            f"{users:>8} {len(table.pieces):>8} {len(user_ids):>9} "
+            f"{build:>8.2f} {refresh:>9.2f} {query * 1e3:>9.3f}"
+        )
@@ -0,0 +1,103 @@
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+# Measure how throughput scales with the number of gunicorn workers.
+#
+#   python benchmarks/wsgi_workers.py --workers 1 2 4 --path /
+#
+# Each run boots gunicorn with gunicorn.conf.py, waits for it to answer,
+# then hammers one path from several client processes for a fixed time.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Client process: send requests over one keep-alive connection until the
+# deadline and report how many succeeded
+def client(port, path, deadline, results):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    completed = 0
+    while time.time() < deadline:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            completed += 1
+    connection.close()
+    results.put(completed)
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def run(workers, threads, clients, path, duration, port):
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_ACCESS_LOG="/dev/null",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "wsgi:app"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(port)
+        results = multiprocessing.Queue()
+        deadline = time.time() + duration
+        processes = [
+            multiprocessing.Process(
+                target=client, args=(port, path, deadline, results)
+            )
+            for _ in range(clients)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        total = sum(results.get() for _ in processes)
+        return total / duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'threads':>8} {'req/s':>10}")
+    for count in args.workers:
+        rate = run(
+            count,
+            args.threads,
+            args.clients,
+            args.path,
+            args.duration,
+            args.port,
+        )
+        print(f"{count:>8} {args.threads:>8} {rate:>10.1f}")
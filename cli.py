@@ -1,7 +1,26 @@
+import time
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 from database import db as database
 from models.musicpiece import MusicPiece
+from middleware import assets, memory
+from services import (
+    aggregates,
+    catalogue,
+    composers,
+    descriptions,
+    libraries,
+    library_io,
+    llm_usage,
+    openopus,
+    recommender,
+    recordings,
+    shares,
+    upstream,
+    warming,
+)
+from services import seed as seeding
 
 
 # Create all tables in the database
@@ -9,6 +28,7 @@ from models.musicpiece import MusicPiece
 @with_appcontext
 def create_all():
     database.create_all()
+    libraries.create_all()
 
 
 # Drop all tables in the database
@@ -16,6 +36,7 @@ def create_all():
 @with_appcontext
 def drop_all():
     database.drop_all()
+    libraries.drop_all()
 
 
 # Populate database with initial data
@@ -48,3 +69,358 @@ def populate():
     for piece in initial_music_pieces:
         database.session.add(piece)
     database.session.commit()
+
+
+# Fill the database with synthetic users, pieces and libraries
+@click.command(
+    "seed", help="Add synthetic users, pieces and libraries for testing"
+)
+@click.option("--users", default=10_000, show_default=True)
+@click.option("--pieces", default=50_000, show_default=True)
+@click.option(
+    "--links",
+    default=500_000,
+    show_default=True,
+    help="Approximate number of library entries",
+)
+@click.option(
+    "--skew",
+    default=1.1,
+    show_default=True,
+    help="Zipf exponent of piece popularity",
+)
+@click.option("--seed", "random_seed", default=0, show_default=True)
+@with_appcontext
+def seed(users, pieces, links, skew, random_seed):
+    stats = seeding.seed(users, pieces, links, skew, random_seed)
+    click.echo(
+        f"Added {stats['users']} users, {stats['pieces']} pieces and "
+        f"{stats['links']} library entries in {stats['seconds']}s"
+    )
+
+    # Seeded entries bypass the incremental updates
+    started = time.perf_counter()
+    aggregates.rebuild()
+    click.echo(
+        f"Rebuilt library aggregates in "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+
+
+# Recompute the library aggregates from scratch
+@click.command(
+    "rebuild_aggregates",
+    help="Recompute save counts and co-occurrence from user libraries",
+)
+@with_appcontext
+def rebuild_aggregates():
+    aggregates.rebuild()
+    click.echo("Library aggregates rebuilt")
+
+
+# Move user libraries into a different number of shard files
+@click.command(
+    "reshard",
+    help="Copy user libraries into SHARDS shard files (1 for the main "
+    "database) and rebuild their aggregates",
+)
+@click.argument("shards", type=click.IntRange(min=1))
+@with_appcontext
+def reshard(shards):
+    started = time.perf_counter()
+    try:
+        stats = libraries.reshard(shards)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    aggregates.rebuild(libraries.stores(shards))
+    click.echo(
+        f"Copied {stats['entries']} library entries into {shards} "
+        f"store(s) in {time.perf_counter() - started:.2f}s. "
+        f"Set LIBRARY_SHARDS={shards} to use them."
+    )
+
+
+# Move a database made before the composers table onto composer ids
+@click.command(
+    "migrate_composers",
+    help="Move composer names on music pieces into the composers table",
+)
+@with_appcontext
+def migrate_composers():
+    stats = composers.migrate()
+    if stats is None:
+        click.echo("Database already uses the composers table")
+        return
+    click.echo(
+        f"Migrated {stats['pieces']} pieces by {stats['composers']} "
+        f"composers, merging {stats['merged']} duplicates"
+    )
+    if stats["stats"]:
+        click.echo("Rebuilt composer totals by composer id")
+
+
+# Rebuild the neighbour table behind library recommendations
+@click.command(
+    "build_recommendations",
+    help="Rebuild the piece similarity table used for recommendations",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Recompute every piece, not just those whose saves changed",
+)
+@with_appcontext
+def build_recommendations(full):
+    stats = recommender.refresh(full=full)
+    click.echo(
+        f"Recomputed {stats['recomputed']} of {stats['pieces']} pieces "
+        f"in {stats['seconds']}s"
+    )
+
+
+# Generate and store descriptions for pieces that don't have one yet
+@click.command(
+    "describe_pieces",
+    help="Generate Gemini descriptions for undescribed pieces in batches",
+)
+@click.option(
+    "--batch-size",
+    default=descriptions.BATCH_SIZE,
+    show_default=True,
+    help="Pieces described per prompt",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=None,
+    help="Prompts in flight at once (default LLM_CONCURRENCY)",
+)
+@click.option(
+    "--limit", type=int, default=None, help="Most pieces to describe"
+)
+@with_appcontext
+def describe_pieces(batch_size, concurrency, limit):
+    started = time.perf_counter()
+    pieces = descriptions.undescribed_pieces(limit)
+    counts = descriptions.backfill(pieces, batch_size, concurrency)
+    click.echo(
+        f"Described {counts['batched'] + counts['single']} of "
+        f"{len(pieces)} pieces ({counts['batched']} batched, "
+        f"{counts['single']} single, {counts['failed']} failed) in "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+
+
+# Find YouTube recordings for library pieces that don't have one yet
+@click.command(
+    "resolve_recordings",
+    help="Find YouTube videos for unresolved library pieces in batches",
+)
+@click.option("--limit", type=int, default=None, help="Most pieces to resolve")
+@with_appcontext
+def resolve_recordings(limit):
+    if not recordings.enabled():
+        click.echo("Set YOUTUBE_API_KEY to resolve recordings")
+        return
+
+    started = time.perf_counter()
+    pieces = recordings.unresolved_pieces(limit)
+    found = recordings.resolve(pieces)
+    click.echo(
+        f"Found videos for {sum(1 for video in found.values() if video)} "
+        f"of {len(pieces)} pieces ({len(pieces) - len(found)} failed) in "
+        f"{time.perf_counter() - started:.2f}s"
+    )
+
+
+# Report Gemini calls, tokens, latency and estimated cost per call site
+@click.command(
+    "llm_usage", help="Report Gemini usage and estimated cost per call site"
+)
+@click.option(
+    "--days", default=7, show_default=True, help="Days to report, to today"
+)
+@with_appcontext
+def llm_usage_report(days):
+    sites = llm_usage.report(days)
+    if not sites:
+        click.echo(f"No Gemini calls in the last {days} days")
+        return
+
+    click.echo(
+        f"{'site':<20}{'calls':>8}{'errors':>8}{'rejected':>10}"
+        f"{'cache hit':>11}{'tokens in':>11}{'tokens out':>12}"
+        f"{'mean ms':>9}{'cost $':>10}"
+    )
+    for site, row in sites.items():
+        hit_rate = row["cache_hit_rate"]
+        click.echo(
+            f"{site:<20}{row['calls']:>8}{row['errors']:>8}"
+            f"{row['rejected']:>10}"
+            f"{'-' if hit_rate is None else f'{hit_rate:.0%}':>11}"
+            f"{row['prompt_tokens']:>11}{row['response_tokens']:>12}"
+            f"{row['mean_ms'] or '-':>9}{row['cost_usd']:>10.4f}"
+        )
+
+
+# Print the memory reports written by workers running with MEMORY_PROFILE
+@click.command(
+    "memory_report",
+    help="Show peak and retained memory per route, and the call sites "
+    "behind it, from profiling workers",
+)
+@with_appcontext
+def memory_report():
+    reports = memory.saved_reports()
+    if not reports:
+        click.echo(
+            f"No memory reports in {memory.report_path()}. "
+            "Run the app with MEMORY_PROFILE=true first."
+        )
+        return
+
+    for report in reports:
+        click.echo(
+            f"Worker {report['pid']}: {report['traced'] / 1024:.0f} KiB traced"
+        )
+        click.echo(
+            f"{'route':<32}{'requests':>10}{'peak KiB':>10}"
+            f"{'mean KiB':>10}{'kept KiB':>10}  growing"
+        )
+        for endpoint, route in report["routes"].items():
+            click.echo(
+                f"{endpoint:<32}{route['requests']:>10}"
+                f"{route['peak_max'] / 1024:>10.0f}"
+                f"{route['peak_mean'] / 1024:>10.0f}"
+                f"{route['retained_total'] / 1024:>10.0f}"
+                f"  {'yes' if route['growing'] else ''}"
+            )
+        for endpoint, route in report["routes"].items():
+            if not route["top_sites"]:
+                continue
+            click.echo(f"\nMemory kept by {endpoint}:")
+            for site in route["top_sites"]:
+                growing = site["site"] in route["growing_sites"]
+                click.echo(
+                    f"  {site['bytes'] / 1024:>10.1f} KiB  {site['site']}"
+                    f"{'  (growing)' if growing else ''}"
+                )
+        click.echo()
+
+
+# Import pieces from a CSV or JSON file into a user's library
+@click.command("import_library", help="Import pieces from a CSV or JSON file")
+@click.argument("user_name")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option("--format", type=click.Choice(library_io.FORMATS))
+@click.option("--chunk-size", default=library_io.CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_library(user_name, file, format, chunk_size):
+    format = library_io.detect_format(file.name, format)
+    counts = library_io.import_library(
+        user_name, library_io.read_rows(file, format), chunk_size
+    )
+    click.echo(
+        f"Imported {counts['rows']} rows: {counts['pieces_added']} new "
+        f"pieces, {counts['links_added']} added to {user_name}'s library, "
+        f"{counts['skipped']} skipped"
+    )
+
+
+# Export a user's library as CSV or JSON
+@click.command("export_library", help="Export a user's library")
+@click.argument("user_name")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", type=click.Choice(library_io.FORMATS))
+@with_appcontext
+def export_library(user_name, output, format):
+    format = library_io.detect_format(output.name, format)
+    for chunk in library_io.export_library(user_name, format):
+        output.write(chunk)
+
+
+# Rebuild the local works catalogue from OpenOpus and save it to disk
+@click.command(
+    "refresh_catalogue",
+    help="Fetch composers' works from OpenOpus into the local catalogue",
+)
+@click.option(
+    "--composer-id",
+    "composer_ids",
+    multiple=True,
+    help="Composer to refresh (default: OpenOpus's popular composers)",
+)
+@with_appcontext
+def refresh_catalogue(composer_ids):
+    catalogue.load()
+
+    if not composer_ids:
+        response = upstream.get("openopus", openopus.popular_composers_url())
+        response.raise_for_status()
+        composer_ids = [
+            str(composer["id"])
+            for composer in response.json().get("composers", [])
+        ]
+
+    for composer_id in composer_ids:
+        try:
+            entry = catalogue.refresh_composer(composer_id)
+            click.echo(f"Composer {composer_id}: {len(entry.works)} works")
+        except upstream.ERRORS as e:
+            click.echo(f"Composer {composer_id}: failed ({e})")
+
+    catalogue.save()
+    stats = catalogue.get_index().stats(include_memory=True)
+    click.echo(
+        f"Catalogue holds {stats['works']} works by "
+        f"{stats['composers']} composers, "
+        f"{stats['mb_per_million_works']} MB per million works"
+    )
+
+
+# Fetch works for the most searched composers before anyone searches
+@click.command(
+    "warm_catalogue",
+    help="Fetch works for library and popular composers into the catalogue",
+)
+@click.option(
+    "--budget",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Most composers to fetch (default CATALOGUE_WARM_BUDGET)",
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Most fetches a second (default CATALOGUE_WARM_RATE)",
+)
+@with_appcontext
+def warm_catalogue(budget, rate):
+    started = time.perf_counter()
+    catalogue.load()
+    warmed = warming.warm(budget, rate)
+    catalogue.save()
+    stats = catalogue.get_index().stats()
+    click.echo(
+        f"Warmed {len(warmed)} composers in "
+        f"{time.perf_counter() - started:.2f}s; the catalogue holds "
+        f"{stats['works']} works by {stats['composers']} composers"
+    )
+
+
+# Write fingerprinted, precompressed copies of the static files
+@click.command(
+    "build_assets",
+    help="Fingerprint and precompress the static files for serving",
+)
+@with_appcontext
+def build_assets():
+    manifest = assets.build(current_app.static_folder)
+    assets.load(current_app)
+    # Shared library snapshots link to the old fingerprinted files
+    shares.clear()
+    click.echo(
+        f"Built {len(manifest['files'])} assets, "
+        f"{len(manifest['encodings'])} with precompressed copies"
+    )
@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+
+# Gunicorn configuration for the production app in wsgi.py. Every setting
+# can be overridden with an environment variable or a command line flag.
+
+
+def env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# Worker processes and threads per worker. Requests mostly wait on
+# upstream APIs, so a few threads per worker keep the CPUs busy.
+workers = env_int("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1)
+threads = env_int("GUNICORN_THREADS", 4)
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Load the app once in the master so workers share it copy-on-write
+preload_app = env_bool("GUNICORN_PRELOAD", True)
+
+# Recycle workers gracefully after a number of requests. The jitter stops
+# every worker from restarting at the same time.
+max_requests = env_int("GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", 100)
+timeout = env_int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = env_int("GUNICORN_KEEPALIVE", 5)
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+# Runs in the master once the app is loaded and before workers are forked
+def when_ready(server):
+    if server.cfg.preload_app:
+        import wsgi
+
+        wsgi.prepare_master(wsgi.app)
+
+
+# Runs in each worker after it has loaded the app
+def post_worker_init(worker):
+    import wsgi
+
+    wsgi.warm_up(worker.wsgi)
+    worker.log.info(f"Worker {worker.pid} warmed up")
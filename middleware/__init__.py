@@ -0,0 +1 @@
+from . import assets, compression
@@ -0,0 +1,177 @@
+import threading
+from collections import Counter
+from flask import current_app, g, request
+from services import metrics
+
+# Admission control for the routes that hold a worker thread for seconds
+# while they wait on upstream APIs and Gemini. Each group of expensive
+# routes gets a fixed number of slots, so threads are always left for the
+# cheap routes. A request that finds its group full waits in a short queue
+# for a slot; when the queue is full too, or the wait runs out, the request
+# is served degraded instead: the view skips its upstream calls and answers
+# from what is already cached. One user may only hold (or wait for)
+# ADMISSION_PER_USER slots in a group, so a single heavy client is degraded
+# before it can starve everyone else. Users are told apart by the address
+# the connection came from, which a client can't pick for itself; behind
+# a proxy, set TRUSTED_PROXIES so ProxyFix supplies the client's address.
+# Until it is known to be the client's, ADMISSION_PER_USER defaults to the
+# group's limit, as every request may seem to come from the proxy.
+
+# Slots for each group of expensive routes, per worker process
+DEFAULT_LIMITS = {"weather": 2, "search": 2, "piece": 2}
+
+# The group each expensive endpoint belongs to. An endpoint prefixed with
+# a method only puts requests made with that method in the group: deleting
+# a piece is cheap and shouldn't wait behind its description.
+DEFAULT_ROUTES = {
+    "weather_mood": "weather",
+    "search": "search",
+    "search_works": "search",
+    "GET library.single_piece": "piece",
+}
+
+
+class RouteGroup:
+    def __init__(self, limit, queue_depth, per_user):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.per_user = per_user
+        self.active = 0
+        self.waiting = 0
+        # Slots held or waited for by each user
+        self.users = Counter()
+        self.condition = threading.Condition()
+        self.counts = {
+            "admitted": 0,
+            "queued": 0,
+            "degraded": 0,
+            "user_limited": 0,
+        }
+
+    # Take a slot, waiting up to timeout seconds for one. Returns False if
+    # the request should be served degraded instead.
+    def acquire(self, user, timeout):
+        with self.condition:
+            if self.users[user] >= self.per_user:
+                self.counts["user_limited"] += 1
+                return self.shed(user)
+
+            self.users[user] += 1
+            if self.active >= self.limit:
+                if self.waiting >= self.queue_depth:
+                    return self.shed(user, held=True)
+                self.waiting += 1
+                self.counts["queued"] += 1
+                admitted = self.condition.wait_for(
+                    lambda: self.active < self.limit, timeout
+                )
+                self.waiting -= 1
+                if not admitted:
+                    return self.shed(user, held=True)
+
+            self.active += 1
+            self.counts["admitted"] += 1
+            return True
+
+    # Called with the condition held
+    def shed(self, user, held=False):
+        if held:
+            self.forget(user)
+        self.counts["degraded"] += 1
+        return False
+
+    def forget(self, user):
+        self.users[user] -= 1
+        if not self.users[user]:
+            del self.users[user]
+
+    def release(self, user):
+        with self.condition:
+            self.active -= 1
+            self.forget(user)
+            self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "waiting": self.waiting,
+                **self.counts,
+            }
+
+
+# Built on first use, so tests can change the limits after create_app()
+def groups():
+    built = current_app.extensions.get("admission_groups")
+    if built is None:
+        config = current_app.config
+        built = current_app.extensions.setdefault(
+            "admission_groups",
+            {
+                name: RouteGroup(
+                    limit,
+                    config["ADMISSION_QUEUE_DEPTH"],
+                    config["ADMISSION_PER_USER"] or limit,
+                )
+                for name, limit in config["ADMISSION_LIMITS"].items()
+            },
+        )
+    return built
+
+
+# The user a request counts against: the client's address. Not
+# `user_name` or X-Forwarded-For, which a client could change on every
+# request to get a fresh allowance.
+def current_user():
+    return request.remote_addr
+
+
+# True if the current request is over budget and should skip expensive work
+def degraded():
+    return g.get("admission_degraded", False)
+
+
+def route_group():
+    routes = current_app.config["ADMISSION_ROUTES"]
+    return routes.get(f"{request.method} {request.endpoint}") or routes.get(
+        request.endpoint
+    )
+
+
+def admit():
+    group = route_group()
+    if group is None:
+        return
+
+    user = current_user()
+    if groups()[group].acquire(
+        user, current_app.config["ADMISSION_QUEUE_TIMEOUT"]
+    ):
+        g.admission_slot = (group, user)
+    else:
+        g.admission_degraded = True
+
+
+def release(exception=None):
+    slot = g.pop("admission_slot", None)
+    if slot is not None:
+        group, user = slot
+        groups()[group].release(user)
+
+
+def admission_metrics():
+    return {name: group.snapshot() for name, group in groups().items()}
+
+
+def init_app(app):
+    app.config.setdefault("ADMISSION_LIMITS", DEFAULT_LIMITS)
+    app.config.setdefault("ADMISSION_ROUTES", DEFAULT_ROUTES)
+    app.config.setdefault("ADMISSION_QUEUE_DEPTH", 4)
+    app.config.setdefault("ADMISSION_QUEUE_TIMEOUT", 1.0)
+    app.config.setdefault("ADMISSION_PER_USER", None)
+    app.before_request(admit)
+    app.teardown_request(release)
+
+
+metrics.register("admission", admission_metrics)
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import current_app, request, send_from_directory
+from .compression import DEFAULT_MIMETYPES
+
+try:
+    import brotli
+except ImportError:  # Without Brotli only .gz siblings are written
+    brotli = None
+
+# Fingerprinted static assets. `flask build_assets` copies every file under
+# the static folder to build/ with a hash of its content in the name (and
+# .br/.gz siblings for text files), and writes a manifest. With a manifest
+# loaded, url_for("static", filename=...) links to the fingerprinted copy,
+# which is served precompressed and cached by browsers for a year: its
+# name changes whenever its content does.
+
+BUILD_DIR = "build"
+MANIFEST = "manifest.json"
+HASH_LENGTH = 10
+ONE_YEAR = 365 * 24 * 60 * 60
+
+# Encodings in order of preference, with the suffix of their sibling file
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+PRECOMPRESS_MIMETYPES = DEFAULT_MIMETYPES | {
+    "image/vnd.microsoft.icon",
+    "image/x-icon",
+}
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def precompress(data):
+    compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed["br"] = brotli.compress(data, quality=11)
+    return compressed
+
+
+def fingerprinted_name(filename, data):
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    stem, extension = os.path.splitext(filename)
+    return f"{BUILD_DIR}/{stem}.{digest}{extension}"
+
+
+# Write fingerprinted and precompressed copies of the static files and
+# return the manifest describing them
+def build(static_folder):
+    output = os.path.join(static_folder, BUILD_DIR)
+    shutil.rmtree(output, ignore_errors=True)
+    os.makedirs(output)
+    files = {}
+    encodings = {}
+
+    for root, dirs, names in os.walk(static_folder):
+        # Skip the previous build's output
+        dirs[:] = sorted(
+            name for name in dirs if os.path.join(root, name) != output
+        )
+        for name in sorted(names):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder)
+            filename = filename.replace(os.sep, "/")
+            with open(source, "rb") as file:
+                data = file.read()
+
+            hashed = fingerprinted_name(filename, data)
+            target = os.path.join(static_folder, hashed)
+            write_file(target, data)
+            files[filename] = hashed
+
+            mimetype, _ = mimetypes.guess_type(filename)
+            if mimetype not in PRECOMPRESS_MIMETYPES:
+                continue
+            compressed = precompress(data)
+            for encoding, suffix in ENCODINGS:
+                body = compressed.get(encoding)
+                # Only keep a sibling that is actually smaller
+                if body is not None and len(body) < len(data):
+                    write_file(target + suffix, body)
+                    encodings.setdefault(hashed, []).append(encoding)
+
+    manifest = {"files": files, "encodings": encodings}
+    with open(os.path.join(output, MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+# Load the app's manifest, if assets have been built
+def load(app):
+    path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+    manifest = {"files": {}, "encodings": {}}
+    if os.path.exists(path):
+        with open(path) as file:
+            manifest = json.load(file)
+    manifest["fingerprinted"] = set(manifest["files"].values())
+    app.extensions["assets"] = manifest
+    return manifest
+
+
+# Point url_for("static", ...) at an asset's fingerprinted copy
+def fingerprint_url(endpoint, values):
+    if endpoint != "static" or "filename" not in values:
+        return
+    hashed = current_app.extensions["assets"]["files"].get(values["filename"])
+    if hashed is not None:
+        values["filename"] = hashed
+
+
+def serve_static(filename):
+    manifest = current_app.extensions["assets"]
+    available = manifest["encodings"].get(filename, [])
+    encoding = next(
+        (
+            (encoding, suffix)
+            for encoding, suffix in ENCODINGS
+            if encoding in available and request.accept_encodings[encoding]
+        ),
+        None,
+    )
+
+    if encoding is None:
+        response = current_app.send_static_file(filename)
+    else:
+        response = send_from_directory(
+            current_app.static_folder,
+            filename + encoding[1],
+            mimetype=mimetypes.guess_type(filename)[0],
+        )
+        response.headers["Content-Encoding"] = encoding[0]
+
+    if available:
+        response.vary.add("Accept-Encoding")
+    if filename in manifest["fingerprinted"]:
+        response.cache_control.public = True
+        response.cache_control.max_age = ONE_YEAR
+        response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    load(app)
+    app.url_defaults(fingerprint_url)
+    app.view_functions["static"] = serve_static
@@ -0,0 +1,178 @@
+import gzip
+import re
+import threading
+from collections import OrderedDict
+from flask import current_app, request
+from services import metrics
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+# Compress responses for clients that accept it, with an optional
+# whitespace-minifying pass over HTML first. Compressed bodies are cached
+# by ETag and encoding, so a page that renders the same every time (like
+# the search form with its full composer list) is only compressed once.
+
+DEFAULT_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+
+# Runs of whitespace inside these elements are significant
+PRESERVED_ELEMENTS = re.compile(
+    r"(<(pre|textarea)\b.*?</\2>)", re.IGNORECASE | re.DOTALL
+)
+WHITESPACE_RUNS = re.compile(r"\s{2,}")
+
+
+class CompressedCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# A run of whitespace becomes one newline if it had one, else one space,
+# so inline scripts still parse
+def collapse(match):
+    return "\n" if "\n" in match.group() else " "
+
+
+# Collapse indentation and repeated spaces, leaving <pre> and <textarea>
+# content alone
+def minify_html(html):
+    parts = PRESERVED_ELEMENTS.split(html)
+    minified = []
+    # split() returns text, element, tag name, text, element, tag name...
+    for index, part in enumerate(parts):
+        if index % 3 == 0:
+            minified.append(WHITESPACE_RUNS.sub(collapse, part))
+        elif index % 3 == 1:
+            minified.append(part)
+    return "".join(minified).strip()
+
+
+def compress(body, encoding):
+    config = current_app.config
+    if encoding == "br":
+        return brotli.compress(body, quality=config["COMPRESS_BR_LEVEL"])
+    return gzip.compress(
+        body, compresslevel=config["COMPRESS_GZIP_LEVEL"], mtime=0
+    )
+
+
+# The best encoding the client accepts, or None
+def negotiate():
+    accepted = request.accept_encodings
+    for encoding in current_app.config["COMPRESS_ALGORITHMS"]:
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted[encoding] > 0:
+            return encoding
+    return None
+
+
+def compressible(response):
+    config = current_app.config
+    return (
+        200 <= response.status_code < 300
+        and response.status_code != 204
+        and not response.direct_passthrough
+        and not response.is_streamed
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in config["COMPRESS_MIMETYPES"]
+    )
+
+
+def process_response(response):
+    if not compressible(response):
+        return response
+
+    config = current_app.config
+    if config["MINIFY_HTML"] and response.mimetype == "text/html":
+        response.set_data(minify_html(response.get_data(as_text=True)))
+
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    encoding = negotiate()
+    if encoding is None or len(body) < config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    etag, _ = response.get_etag()
+    if etag is None:
+        response.add_etag()
+        etag, _ = response.get_etag()
+
+    cache = current_app.extensions["compression_cache"]
+    key = (etag, encoding)
+    compressed = cache.get(key)
+    if compressed is None:
+        compressed = compress(body, encoding)
+        cache.put(key, compressed)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    response.set_etag(f"{etag}-{encoding}")
+    return response.make_conditional(request)
+
+
+def compression_metrics():
+    return current_app.extensions["compression_cache"].snapshot()
+
+
+def init_app(app):
+    app.config.setdefault("COMPRESS_MIMETYPES", DEFAULT_MIMETYPES)
+    app.config.setdefault("COMPRESS_MIN_SIZE", 500)
+    app.config.setdefault("COMPRESS_ALGORITHMS", ["br", "gzip"])
+    app.config.setdefault("COMPRESS_GZIP_LEVEL", 6)
+    app.config.setdefault("COMPRESS_BR_LEVEL", 5)
+    app.config.setdefault("COMPRESS_CACHE_BYTES", 16 * 1024 * 1024)
+    app.config.setdefault("MINIFY_HTML", False)
+    app.extensions["compression_cache"] = CompressedCache(
+        app.config["COMPRESS_CACHE_BYTES"]
+    )
+    app.after_request(process_response)
+
+
+metrics.register("compression", compression_metrics)
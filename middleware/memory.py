@@ -0,0 +1,259 @@
+import gc
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from flask import current_app, g, request
+from services import metrics
+
+# Opt-in memory profiling, for finding what makes workers grow. With
+# MEMORY_PROFILE set, tracemalloc traces every allocation and each request
+# is measured on its own (requests are served one at a time while
+# profiling, so the numbers belong to the request that caused them):
+#
+# - peak: the most memory the request had allocated at once
+# - retained: what was still allocated once it finished, after a
+#   garbage collection
+#
+# Comparing snapshots takes a fraction of a second, so only every
+# MEMORY_SAMPLE_EVERY-th request of a route is compared with a snapshot
+# from before it, to find the call sites behind what it retained, named by
+# the innermost frame in the app's own code. A route whose last
+# MEMORY_LEAK_STREAK requests each retained at least MEMORY_LEAK_MIN_BYTES,
+# or a call site that retained memory in that many samples in a row, is
+# flagged as growing.
+#
+# Each worker writes its report to MEMORY_REPORT_PATH/<pid>.json at most
+# every MEMORY_REPORT_INTERVAL seconds; `flask memory_report` prints them.
+
+DEFAULT_FRAMES = 10
+DEFAULT_SAMPLE_EVERY = 10
+DEFAULT_LEAK_STREAK = 5
+# Less than this kept per request is taken for caches filling up
+DEFAULT_LEAK_MIN_BYTES = 4096
+DEFAULT_REPORT_INTERVAL = 10
+# Call sites kept per route
+TOP_SITES = 10
+# Call sites whose growth is followed per sample
+TRACKED_SITES = 50
+
+profile_lock = threading.Lock()
+state_lock = threading.Lock()
+
+
+class RouteMemory:
+    def __init__(self, streak, min_bytes):
+        self.requests = 0
+        self.peak_max = 0
+        self.peak_total = 0
+        self.retained_total = 0
+        self.retained = deque(maxlen=streak)
+        self.sites = Counter()
+        # Samples in a row in which each call site retained memory
+        self.streaks = {}
+        self.streak = streak
+        self.min_bytes = min_bytes
+
+    def record(self, peak, retained):
+        self.requests += 1
+        self.peak_max = max(self.peak_max, peak)
+        self.peak_total += peak
+        self.retained_total += retained
+        self.retained.append(retained)
+
+    def record_sites(self, growth):
+        self.sites.update(growth)
+        self.streaks = {
+            site: self.streaks.get(site, 0) + 1
+            for site, size in growth.most_common(TRACKED_SITES)
+            if size > 0
+        }
+
+    def growing(self):
+        return len(self.retained) == self.streak and all(
+            retained >= self.min_bytes for retained in self.retained
+        )
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "peak_max": self.peak_max,
+            "peak_mean": self.peak_total // max(1, self.requests),
+            "retained_total": self.retained_total,
+            "growing": self.growing(),
+            "top_sites": [
+                {"site": site, "bytes": size}
+                for site, size in self.sites.most_common(TOP_SITES)
+                if size > 0
+            ],
+            "growing_sites": sorted(
+                site
+                for site, streak in self.streaks.items()
+                if streak >= self.streak
+            ),
+        }
+
+
+def enabled():
+    return current_app.config["MEMORY_PROFILE"]
+
+
+def routes():
+    return current_app.extensions.setdefault("memory_routes", {})
+
+
+def report_path():
+    return current_app.config.get("MEMORY_REPORT_PATH") or os.path.join(
+        current_app.instance_path, "memory"
+    )
+
+
+# The innermost frame of a traceback in the app's code, outside any
+# installed package, or else the innermost frame
+def call_site(traceback):
+    root = current_app.root_path
+    for frame in reversed(traceback):
+        if frame.filename.startswith(root) and "site-packages" not in (
+            frame.filename
+        ):
+            name = os.path.relpath(frame.filename, root)
+            return f"{name}:{frame.lineno}"
+    frame = traceback[-1]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    )
+
+
+# Bytes retained between two snapshots, by call site
+def site_growth(before, after):
+    growth = Counter()
+    for difference in after.compare_to(before, "traceback"):
+        if difference.size_diff:
+            growth[call_site(difference.traceback)] += difference.size_diff
+    return growth
+
+
+def start():
+    if not enabled():
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(current_app.config["MEMORY_TRACE_FRAMES"])
+    profile_lock.acquire()
+    g.memory_profiling = True
+
+    endpoint = request.endpoint or "unknown"
+    with state_lock:
+        route = routes().get(endpoint)
+        requests = route.requests if route else 0
+    if requests % current_app.config["MEMORY_SAMPLE_EVERY"] == 0:
+        gc.collect()
+        g.memory_snapshot = take_snapshot()
+
+    tracemalloc.reset_peak()
+    g.memory_start = tracemalloc.get_traced_memory()[0]
+
+
+def finish(exception=None):
+    if not g.pop("memory_profiling", False):
+        return
+    try:
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0]
+        start = g.pop("memory_start")
+        before = g.pop("memory_snapshot", None)
+        growth = None
+        if before is not None:
+            growth = site_growth(before, take_snapshot())
+
+        endpoint = request.endpoint or "unknown"
+        with state_lock:
+            route = routes().get(endpoint)
+            if route is None:
+                route = routes().setdefault(
+                    endpoint,
+                    RouteMemory(
+                        current_app.config["MEMORY_LEAK_STREAK"],
+                        current_app.config["MEMORY_LEAK_MIN_BYTES"],
+                    ),
+                )
+            route.record(peak - start, current - start)
+            if growth is not None:
+                route.record_sites(growth)
+        save()
+    finally:
+        profile_lock.release()
+
+
+def report():
+    if not tracemalloc.is_tracing():
+        return {}
+    current, _ = tracemalloc.get_traced_memory()
+    with state_lock:
+        return {
+            "pid": os.getpid(),
+            "traced": current,
+            "routes": {
+                endpoint: route.snapshot()
+                for endpoint, route in sorted(routes().items())
+            },
+        }
+
+
+# Write this worker's report, at most every MEMORY_REPORT_INTERVAL seconds
+def save():
+    now = time.monotonic()
+    saved = current_app.extensions.get("memory_saved", 0)
+    if now - saved < current_app.config["MEMORY_REPORT_INTERVAL"]:
+        return
+    current_app.extensions["memory_saved"] = now
+
+    path = report_path()
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, f"{os.getpid()}.json")
+    temporary = f"{target}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(report(), file)
+    os.replace(temporary, target)
+
+
+# Every worker's last saved report, for `flask memory_report`
+def saved_reports():
+    path = report_path()
+    if not os.path.isdir(path):
+        return []
+    reports = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".json"):
+            with open(os.path.join(path, name)) as file:
+                reports.append(json.load(file))
+    return reports
+
+
+def init_app(app):
+    app.config.setdefault("MEMORY_PROFILE", False)
+    app.config.setdefault("MEMORY_TRACE_FRAMES", DEFAULT_FRAMES)
+    app.config.setdefault("MEMORY_SAMPLE_EVERY", DEFAULT_SAMPLE_EVERY)
+    app.config.setdefault("MEMORY_LEAK_STREAK", DEFAULT_LEAK_STREAK)
+    app.config.setdefault("MEMORY_LEAK_MIN_BYTES", DEFAULT_LEAK_MIN_BYTES)
+    app.config.setdefault("MEMORY_REPORT_INTERVAL", DEFAULT_REPORT_INTERVAL)
+    app.before_request(start)
+    app.teardown_request(finish)
+
+
+def memory_metrics():
+    if not enabled():
+        return {}
+    return report()
+
+
+metrics.register("memory", memory_metrics)
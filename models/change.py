@@ -0,0 +1,29 @@
+from sqlalchemy.orm import DeclarativeBase
+from database import db
+
+
+# The change log lives in its own database, so its table is kept out of
+# db.metadata: `flask create_all` shouldn't add it to the main database
+class ChangeLogBase(DeclarativeBase):
+    pass
+
+
+# Setup of Change Class, one entry in the change log that tells other
+# workers what to drop from their caches (see services/invalidation.py).
+# The id is the log's version number. A missing key means every key of
+# the topic changed.
+class Change(ChangeLogBase):
+    __tablename__ = "changes"
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(40), nullable=False)
+    key = db.Column(db.String(80), nullable=True)
+    created_at = db.Column(db.Float, nullable=False)
+
+    # Ids are never reused, so a version always means the same change
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    # String representation
+    def __repr__(self):
+        return f"<Change {self.id}: {self.topic} {self.key}>"
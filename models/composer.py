@@ -0,0 +1,48 @@
+from sqlalchemy import select
+from database import db
+
+
+# Setup of Composer Class, one row per composer. openopus_id is the
+# composer's id in the OpenOpus API, where the piece came from a search.
+# Composers also come from imports, seeds and the add form without one, so
+# rows are keyed by their own id and openopus_id is a unique alternate key.
+class Composer(db.Model):
+    __tablename__ = "composers"
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True)
+    openopus_id = db.Column(db.Integer, unique=True, nullable=True)
+    name = db.Column(db.String(80), unique=True, nullable=False)
+
+    # The composer with this OpenOpus id or name, added to the session if
+    # new. Composers added to the session but not yet flushed are kept by
+    # name in the session's info, so they are found without a query.
+    @classmethod
+    def named(cls, name, openopus_id=None):
+        pending = db.session.info.setdefault("pending_composers", {})
+        composer = pending.get(name)
+        # Dropped from the session by a rollback
+        if composer is not None and composer not in db.session:
+            composer = None
+
+        with db.session.no_autoflush:
+            if composer is None and openopus_id is not None:
+                composer = db.session.scalar(
+                    select(cls).where(cls.openopus_id == openopus_id)
+                )
+            if composer is None:
+                composer = db.session.scalar(
+                    select(cls).where(cls.name == name)
+                )
+
+        if composer is None:
+            composer = cls(name=name, openopus_id=openopus_id)
+            db.session.add(composer)
+            pending[name] = composer
+        elif composer.openopus_id is None and openopus_id is not None:
+            composer.openopus_id = openopus_id
+        return composer
+
+    # String representation
+    def __repr__(self):
+        return f"<Composer {self.id}: {self.name}>"
@@ -0,0 +1,73 @@
+from database import db
+
+# Aggregates over user libraries, kept up to date as pieces are saved and
+# removed (see services/aggregates.py)
+
+
+# Number of libraries each piece is saved in
+class PieceStats(db.Model):
+    __tablename__ = "piece_stats"
+
+    # Columns
+    music_piece_id = db.Column(
+        db.Integer, db.ForeignKey("music_pieces.id"), primary_key=True
+    )
+    saves = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    music_piece = db.relationship("MusicPiece")
+
+    # String representation
+    def __repr__(self):
+        return f"<PieceStats {self.music_piece_id}: {self.saves} saves>"
+
+
+# Library entries per composer
+class ComposerStats(db.Model):
+    __tablename__ = "composer_stats"
+
+    # Columns
+    composer_id = db.Column(
+        db.Integer, db.ForeignKey("composers.id"), primary_key=True
+    )
+    saves = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    composer = db.relationship("Composer")
+
+    # String representation
+    def __repr__(self):
+        return f"<ComposerStats {self.composer_id}: {self.saves} saves>"
+
+
+# Library entries per genre
+class GenreStats(db.Model):
+    __tablename__ = "genre_stats"
+
+    # Columns
+    genre = db.Column(db.String(80), primary_key=True)
+    saves = db.Column(db.Integer, nullable=False, default=0)
+
+    # String representation
+    def __repr__(self):
+        return f"<GenreStats {self.genre}: {self.saves} saves>"
+
+
+# Number of libraries holding both pieces. Each pair is stored both ways
+# round, so the pieces saved alongside one are a single index range.
+class PieceCooccurrence(db.Model):
+    __tablename__ = "piece_cooccurrence"
+
+    # Columns
+    music_piece_id = db.Column(db.Integer, primary_key=True)
+    other_piece_id = db.Column(db.Integer, primary_key=True)
+    users = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ix_piece_cooccurrence_users", "music_piece_id", "users"),
+    )
+
+    # String representation
+    def __repr__(self):
+        return (
+            f"<PieceCooccurrence {self.music_piece_id}, "
+            f"{self.other_piece_id}: {self.users} users>"
+        )
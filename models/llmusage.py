@@ -0,0 +1,22 @@
+from database import db
+
+
+# Setup of LlmUsage Class, Gemini usage per call site per (UTC) day,
+# written by services/llm_usage.py
+class LlmUsage(db.Model):
+    __tablename__ = "llm_usage"
+
+    # Columns
+    day = db.Column(db.String(10), primary_key=True)
+    site = db.Column(db.String(40), primary_key=True)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    cache_hits = db.Column(db.Integer, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    response_tokens = db.Column(db.Integer, nullable=False, default=0)
+    seconds = db.Column(db.Float, nullable=False, default=0.0)
+
+    # String representation
+    def __repr__(self):
+        return f"<LlmUsage {self.day} {self.site}: {self.calls} calls>"
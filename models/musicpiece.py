@@ -1,4 +1,16 @@
+import hashlib
+from sqlalchemy import event, select
+from sqlalchemy.ext.hybrid import hybrid_property
 from database import db
+from models.composer import Composer
+
+
+# 64-bit hash of a piece's composer, title and subtitle, used to find an
+# existing piece with one integer lookup. A missing subtitle counts as "".
+def piece_key(composer, title, subtitle):
+    text = "\x1f".join((composer, title, subtitle or ""))
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
 
 
 # Setup of MusicPiece Class
@@ -7,20 +19,50 @@ class MusicPiece(db.Model):
 
     # Columns
     id = db.Column(db.Integer, primary_key=True)
-    composer = db.Column(db.String(80), nullable=False)
+    composer_id = db.Column(
+        db.Integer, db.ForeignKey("composers.id"), nullable=False
+    )
     title = db.Column(db.String(80), nullable=False)
     subtitle = db.Column(db.String(80), nullable=True)
     genre = db.Column(db.String(80), nullable=False)
     popular = db.Column(db.Boolean, nullable=False)
     recommended = db.Column(db.Boolean, nullable=False)
+    # piece_key() of the composer's name, title and subtitle, set on save
+    natural_key = db.Column(db.BigInteger, nullable=False)
+
+    composer_record = db.relationship("Composer", lazy="joined")
 
     # Checking for unique entries
     __table_args__ = (
-        db.UniqueConstraint(
-            "composer", "title", "subtitle", name="unique_music_piece"
-        ),
+        db.UniqueConstraint("natural_key", name="unique_music_piece"),
+        db.Index("ix_music_pieces_composer_id", "composer_id"),
     )
 
+    # The composer's name, so pieces can still be made and queried with
+    # composer="..."
+    @hybrid_property
+    def composer(self):
+        return self.composer_record.name if self.composer_record else None
+
+    @composer.inplace.setter
+    def _composer_setter(self, name):
+        self.composer_record = Composer.named(name)
+
+    @composer.inplace.expression
+    @classmethod
+    def _composer_expression(cls):
+        return (
+            select(Composer.name)
+            .where(Composer.id == cls.composer_id)
+            .scalar_subquery()
+        )
+
     # String representation
     def __repr__(self):
         return f"<MusicPiece {self.id}: {self.title} by {self.composer}>"
+
+
+@event.listens_for(MusicPiece, "before_insert")
+@event.listens_for(MusicPiece, "before_update")
+def set_natural_key(mapper, connection, piece):
+    piece.natural_key = piece_key(piece.composer, piece.title, piece.subtitle)
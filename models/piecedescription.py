@@ -0,0 +1,17 @@
+from database import db
+
+
+# Setup of PieceDescription Class, Gemini's description of a music piece
+class PieceDescription(db.Model):
+    __tablename__ = "piece_descriptions"
+
+    # Columns
+    music_piece_id = db.Column(
+        db.Integer, db.ForeignKey("music_pieces.id"), primary_key=True
+    )
+    description = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False)
+
+    # String representation
+    def __repr__(self):
+        return f"<PieceDescription {self.music_piece_id}>"
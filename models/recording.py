@@ -0,0 +1,17 @@
+from database import db
+
+
+# Setup of Recording Class, the YouTube video found for a piece. Keyed by
+# piece_key(), so works on the results page can be looked up before they
+# are saved as pieces. A missing video_id records that nothing was found.
+class Recording(db.Model):
+    __tablename__ = "recordings"
+
+    # Columns
+    natural_key = db.Column(db.BigInteger, primary_key=True)
+    video_id = db.Column(db.String(16), nullable=True)
+    resolved_at = db.Column(db.Float, nullable=False)
+
+    # String representation
+    def __repr__(self):
+        return f"<Recording {self.natural_key} {self.video_id}>"
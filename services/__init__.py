@@ -0,0 +1,24 @@
+from . import (
+    aggregates,
+    breaker,
+    catalogue,
+    composer_names,
+    composers,
+    descriptions,
+    invalidation,
+    libraries,
+    library_io,
+    library_writes,
+    llm,
+    llm_usage,
+    metrics,
+    openopus,
+    recommender,
+    recordings,
+    search,
+    seed,
+    shares,
+    upstream,
+    warming,
+    weather,
+)
@@ -0,0 +1,292 @@
+from collections import Counter
+from flask import current_app
+from sqlalchemy import and_, delete, func, insert, literal, or_, select
+from sqlalchemy.dialects.sqlite import insert as upsert
+from sqlalchemy.orm import aliased
+from database import db
+from models.librarystats import (
+    ComposerStats,
+    GenreStats,
+    PieceCooccurrence,
+    PieceStats,
+)
+from models.composer import Composer
+from models.musicpiece import MusicPiece
+from models.userlibrary import UserLibrary
+from . import libraries
+
+# Save counts per piece, composer and genre, and co-occurrence counts for
+# "users who saved this also saved", maintained as library entries are
+# added and removed so that reading them is an indexed lookup rather than
+# a scan of user_library. Updates are set-based statements run in the
+# caller's transaction: call record_saves() after inserting entries and
+# record_removals() before deleting them.
+#
+# The aggregates are kept next to the libraries they count, so with
+# sharded libraries (see services/libraries.py) each shard counts its own
+# users and the totals read here are summed over the shards.
+#
+# Co-occurrence only counts libraries of up to COOCCURRENCE_LIBRARY_LIMIT
+# pieces. A library of n pieces holds n * (n - 1) pairs, so the largest
+# libraries would dominate both the table and the cost of every save
+# while saying little about any one pair.
+
+DEFAULT_COOCCURRENCE_LIMIT = 50
+
+
+def cooccurrence_limit():
+    return current_app.config.get(
+        "COOCCURRENCE_LIBRARY_LIMIT", DEFAULT_COOCCURRENCE_LIMIT
+    )
+
+
+def library_size(session, user_id):
+    return session.scalar(
+        select(func.count()).where(UserLibrary.user_id == user_id)
+    )
+
+
+# Add `changes`, a dict of key: change, to a count column in a store, then
+# drop the counts that fell to zero
+def change_counts(session, table, key, count, changes):
+    if not changes:
+        return
+    statement = upsert(table).values(
+        [{key: value, count: change} for value, change in changes.items()]
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[key],
+        set_={count: table.c[count] + statement.excluded[count]},
+    )
+    session.execute(statement)
+    session.execute(
+        delete(table).where(
+            table.c[key].in_(list(changes)), table.c[count] <= 0
+        )
+    )
+
+
+# Totals kept per piece, composer and genre, with the MusicPiece column
+# each is grouped by
+PIECE_COUNTS = [
+    (PieceStats, "music_piece_id", MusicPiece.id),
+    (ComposerStats, "composer_id", MusicPiece.composer_id),
+    (GenreStats, "genre", MusicPiece.genre),
+]
+
+
+# The pieces' (id, composer id, genre) from the catalogue
+def piece_details(piece_ids):
+    return db.session.execute(
+        select(*(column for _, _, column in PIECE_COUNTS)).where(
+            MusicPiece.id.in_(piece_ids)
+        )
+    ).all()
+
+
+# Add `saves`, (details, saves) pairs, to the piece, composer and genre
+# totals in a store
+def add_saves(session, saves):
+    for index, (model, key, _) in enumerate(PIECE_COUNTS):
+        changes = Counter()
+        for details, count in saves:
+            changes[details[index]] += count
+        change_counts(session, model.__table__, key, "saves", changes)
+
+
+def change_piece_counts(session, piece_ids, change):
+    add_saves(session, [(row, change) for row in piece_details(piece_ids)])
+
+
+# Change the count of every ordered pair of pieces in a user's library by
+# `change`, limited to pairs touching, or excluding, the given pieces
+def change_pairs(session, user_id, change, touching=None, excluding=None):
+    first = aliased(UserLibrary)
+    second = aliased(UserLibrary)
+    pairs = (
+        select(first.music_piece_id, second.music_piece_id, literal(change))
+        .join(
+            second,
+            and_(
+                second.user_id == first.user_id,
+                second.music_piece_id != first.music_piece_id,
+            ),
+        )
+        .where(first.user_id == user_id)
+    )
+    if touching:
+        pairs = pairs.where(
+            or_(
+                first.music_piece_id.in_(touching),
+                second.music_piece_id.in_(touching),
+            )
+        )
+    if excluding:
+        pairs = pairs.where(
+            first.music_piece_id.not_in(excluding),
+            second.music_piece_id.not_in(excluding),
+        )
+
+    table = PieceCooccurrence.__table__
+    statement = upsert(table).from_select(
+        ["music_piece_id", "other_piece_id", "users"], pairs
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["music_piece_id", "other_piece_id"],
+        set_={"users": table.c.users + statement.excluded.users},
+    )
+    session.execute(statement)
+    session.execute(
+        delete(table).where(
+            table.c.music_piece_id.in_(
+                select(UserLibrary.music_piece_id).where(
+                    UserLibrary.user_id == user_id
+                )
+            ),
+            table.c.users <= 0,
+        )
+    )
+
+
+# Count pieces just added to a user's library
+def record_saves(user_id, piece_ids):
+    piece_ids = list(piece_ids)
+    if not piece_ids:
+        return
+    session = libraries.store_for(user_id)
+    change_piece_counts(session, piece_ids, 1)
+
+    limit = cooccurrence_limit()
+    size = library_size(session, user_id)
+    if size <= limit:
+        change_pairs(session, user_id, 1, touching=piece_ids)
+    elif size - len(piece_ids) <= limit:
+        # The library has outgrown the limit, so its pairs stop counting
+        change_pairs(session, user_id, -1, excluding=piece_ids)
+
+
+# Uncount pieces about to be removed from a user's library
+def record_removals(user_id, piece_ids):
+    piece_ids = list(piece_ids)
+    if not piece_ids:
+        return
+    session = libraries.store_for(user_id)
+    change_piece_counts(session, piece_ids, -1)
+
+    limit = cooccurrence_limit()
+    size = library_size(session, user_id)
+    if size <= limit:
+        change_pairs(session, user_id, -1, touching=piece_ids)
+    elif size - len(piece_ids) <= limit:
+        # The library is back within the limit, so its pairs count again
+        change_pairs(session, user_id, 1, excluding=piece_ids)
+
+
+# Recompute every aggregate from user_library, in each of `stores` (by
+# default wherever the libraries are kept)
+def rebuild(stores=None):
+    for session in stores or libraries.stores():
+        rebuild_store(session)
+    libraries.commit()
+
+
+def rebuild_store(session):
+    for model in (PieceStats, ComposerStats, GenreStats, PieceCooccurrence):
+        session.execute(delete(model))
+
+    # Saves per piece from the store, then by composer and genre from the
+    # catalogue, which a shard doesn't hold
+    saves = dict(
+        session.execute(
+            select(UserLibrary.music_piece_id, func.count()).group_by(
+                UserLibrary.music_piece_id
+            )
+        ).all()
+    )
+    piece_ids = list(saves)
+    details = []
+    for start in range(0, len(piece_ids), libraries.PIECE_BATCH):
+        details.extend(
+            piece_details(piece_ids[start : start + libraries.PIECE_BATCH])
+        )
+    add_saves(session, [(row, saves[row[0]]) for row in details])
+
+    small_libraries = (
+        select(UserLibrary.user_id)
+        .group_by(UserLibrary.user_id)
+        .having(func.count() <= cooccurrence_limit())
+    )
+    first = aliased(UserLibrary)
+    second = aliased(UserLibrary)
+    session.execute(
+        insert(PieceCooccurrence).from_select(
+            ["music_piece_id", "other_piece_id", "users"],
+            select(first.music_piece_id, second.music_piece_id, func.count())
+            .join(
+                second,
+                and_(
+                    second.user_id == first.user_id,
+                    second.music_piece_id != first.music_piece_id,
+                ),
+            )
+            .where(first.user_id.in_(small_libraries))
+            .group_by(first.music_piece_id, second.music_piece_id),
+        )
+    )
+
+
+# The most saved pieces, with their save counts
+def trending(limit=10):
+    counts = libraries.totals(
+        PieceStats.music_piece_id, PieceStats.saves, limit=limit
+    )
+    pieces = libraries.load_pieces(piece_id for piece_id, _ in counts)
+    saves = dict(counts)
+    return [(piece, saves[piece.id]) for piece in pieces]
+
+
+# The composers with the most library entries, with their counts
+def top_composers(limit=10):
+    counts = libraries.totals(
+        ComposerStats.composer_id, ComposerStats.saves, limit=limit
+    )
+    composers = {
+        composer.id: composer
+        for composer in db.session.scalars(
+            select(Composer).where(
+                Composer.id.in_([composer_id for composer_id, _ in counts])
+            )
+        )
+    }
+    return [
+        (composers[composer_id], saves)
+        for composer_id, saves in counts
+        if composer_id in composers
+    ]
+
+
+def genre_totals():
+    return libraries.totals(GenreStats.genre, GenreStats.saves)
+
+
+def piece_saves(piece_id):
+    return sum(
+        stats.saves
+        for stats in (
+            session.get(PieceStats, piece_id) for session in libraries.stores()
+        )
+        if stats
+    )
+
+
+# Pieces most often saved by users who saved this one
+def also_saved(piece_id, limit=5):
+    counts = libraries.totals(
+        PieceCooccurrence.other_piece_id,
+        PieceCooccurrence.users,
+        where=PieceCooccurrence.music_piece_id == piece_id,
+        limit=limit,
+    )
+    pieces = libraries.load_pieces(other_id for other_id, _ in counts)
+    users = dict(counts)
+    return [(piece, users[piece.id]) for piece in pieces]
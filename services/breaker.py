@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import requests
+from flask import current_app
+from . import metrics
+
+# Per-upstream circuit breakers. Each breaker watches a sliding window of
+# recent calls and opens when too many of them fail or are too slow. While
+# open, calls are refused straight away instead of tying up a worker, and
+# after a cool-down a single trial call decides whether to close again.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# Raised instead of calling an upstream whose circuit is open. Subclassing
+# RequestException lets existing request error handling cover it.
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+# The timing of a call made in CircuitBreaker.guard(). A streamed call's
+# latency is the time to its first chunk, as a long answer isn't a slow
+# upstream.
+class Timing:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency = None
+
+    def first_chunk(self):
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+    def elapsed(self):
+        if self.latency is not None:
+            return self.latency
+        return time.monotonic() - self.started
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name,
+        window=20,
+        min_calls=5,
+        failure_rate=0.5,
+        slow_call_seconds=2.0,
+        slow_call_rate=0.8,
+        reset_timeout=30.0,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.reset_timeout = reset_timeout
+        self.calls = deque(maxlen=window)  # (failed, elapsed) per call
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.rejected = 0
+        self.hedged = 0
+        self.lock = threading.Lock()
+
+    # Whether a call may go ahead; half-open lets one trial call through
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self.trial_in_flight = False
+
+            if self.state == HALF_OPEN:
+                if self.trial_in_flight:
+                    self.rejected += 1
+                    return False
+                self.trial_in_flight = True
+
+            return True
+
+    def record(self, failed, elapsed):
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.trial_in_flight = False
+                if failed or elapsed > self.slow_call_seconds:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self.calls.clear()
+                return
+
+            self.calls.append((failed, elapsed))
+            if len(self.calls) < self.min_calls:
+                return
+
+            failures = sum(1 for call_failed, _ in self.calls if call_failed)
+            slow = sum(
+                1
+                for _, call_elapsed in self.calls
+                if call_elapsed > self.slow_call_seconds
+            )
+            if (
+                failures / len(self.calls) >= self.failure_rate
+                or slow / len(self.calls) >= self.slow_call_rate
+            ):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.calls.clear()
+        print(f"Circuit for {self.name} opened")
+
+    def count_hedge(self):
+        with self.lock:
+            self.hedged += 1
+
+    # Observed latency percentile over the window, used to time hedges
+    def latency_percentile(self, percentile):
+        with self.lock:
+            latencies = sorted(elapsed for _, elapsed in self.calls)
+        if len(latencies) < self.min_calls:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * percentile))
+        return latencies[index]
+
+    # Run a callable under the breaker, counting any exception as a failure
+    def call(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record(True, time.monotonic() - started)
+            raise
+        self.record(False, time.monotonic() - started)
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+        started = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            self.record(True, time.monotonic() - started)
+            raise
+        self.record(False, time.monotonic() - started)
+        return result
+
+    # The block is a call under the breaker, for calls that only succeed
+    # once their result has been read, like a stream that may fail part way
+    @contextmanager
+    def guard(self):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+        timing = Timing()
+        try:
+            yield timing
+        except GeneratorExit:
+            # The reader stopped early, not the upstream
+            self.record(False, timing.elapsed())
+            raise
+        except Exception:
+            self.record(True, timing.elapsed())
+            raise
+        self.record(False, timing.elapsed())
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "window_calls": len(self.calls),
+                "window_failures": sum(
+                    1 for call_failed, _ in self.calls if call_failed
+                ),
+                "rejected": self.rejected,
+                "hedged": self.hedged,
+            }
+
+
+# Breakers live on the app, so each app instance (and each test) starts
+# with closed circuits
+breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with breakers_lock:
+        breakers = current_app.extensions.setdefault("breakers", {})
+        if name not in breakers:
+            settings = current_app.config.get("BREAKER_SETTINGS", {})
+            breakers[name] = CircuitBreaker(name, **settings)
+        return breakers[name]
+
+
+def breaker_metrics():
+    with breakers_lock:
+        breakers = dict(current_app.extensions.get("breakers", {}))
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
+
+
+metrics.register("breakers", breaker_metrics)
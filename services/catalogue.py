@@ -0,0 +1,227 @@
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+from itertools import chain
+from operator import itemgetter
+from flask import current_app
+from . import metrics, openopus, upstream
+
+# Local catalogue of OpenOpus works, indexed by composer and genre. Works
+# are stored as tuples with interned strings, and each genre keeps an
+# array of positions into its composer's works, so a search is a lookup
+# per genre and a merge of already sorted positions instead of a scan
+# over every work the composer wrote.
+#
+# The catalogue is filled by `flask refresh_catalogue` (saved to disk and
+# loaded at startup) and by searches for composers it doesn't hold yet.
+
+Work = namedtuple("Work", "title subtitle genre popular recommended")
+
+# Seconds before a composer's works are fetched again
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class ComposerWorks:
+    __slots__ = ("works", "genres", "fetched_at")
+
+    def __init__(self, works, fetched_at):
+        self.works = works
+        self.fetched_at = fetched_at
+        self.genres = {}
+        for position, work in enumerate(works):
+            self.genres.setdefault(work.genre, array("I")).append(position)
+
+    # Works in any of the genres, in the order OpenOpus lists them. Each
+    # work has one genre, so the position arrays are disjoint and sorted;
+    # sorting their concatenation is a C-level merge of the runs.
+    def in_genres(self, genres):
+        arrays = [
+            self.genres[genre] for genre in set(genres) if genre in self.genres
+        ]
+        if not arrays:
+            return []
+        positions = arrays[0] if len(arrays) == 1 else sorted(chain(*arrays))
+        if len(positions) == 1:
+            return [self.works[positions[0]]]
+        return list(itemgetter(*positions)(self.works))
+
+
+class WorksIndex:
+    def __init__(self):
+        self.composers = {}
+        self.lock = threading.Lock()
+
+    def get(self, composer_id, ttl):
+        entry = self.composers.get(composer_id)
+        if entry is None or time.time() - entry.fetched_at > ttl:
+            return None
+        return entry
+
+    def add(self, composer_id, works, fetched_at=None):
+        entry = ComposerWorks(
+            tuple(works), fetched_at if fetched_at else time.time()
+        )
+        with self.lock:
+            self.composers[composer_id] = entry
+        return entry
+
+    def work_count(self):
+        return sum(len(entry.works) for entry in self.composers.values())
+
+    # Approximate memory held by the index, counting shared objects once
+    def memory_bytes(self):
+        seen = set()
+
+        def size(obj):
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+
+        total = size(self.composers)
+        for composer_id, entry in list(self.composers.items()):
+            total += size(composer_id) + size(entry)
+            total += size(entry.works) + size(entry.genres)
+            for genre, positions in entry.genres.items():
+                total += size(genre) + size(positions)
+            for work in entry.works:
+                total += size(work)
+                total += sum(size(field) for field in work)
+        return total
+
+    # Walking the index to size it is slow, so it is only done on request
+    def stats(self, include_memory=False):
+        works = self.work_count()
+        stats = {"composers": len(self.composers), "works": works}
+        if include_memory:
+            memory = self.memory_bytes()
+            stats["memory_bytes"] = memory
+            # Bytes per work is also megabytes per million works
+            stats["mb_per_million_works"] = (
+                round(memory / works, 1) if works else 0.0
+            )
+        return stats
+
+
+# Build a compact Work from an OpenOpus work record
+def compact_work(work):
+    return Work(
+        sys.intern(work.get("title") or ""),
+        sys.intern(work.get("subtitle") or ""),
+        sys.intern(work.get("genre") or ""),
+        work.get("popular") == "1",
+        work.get("recommended") == "1",
+    )
+
+
+def get_index():
+    return current_app.extensions.setdefault("works_index", WorksIndex())
+
+
+def ttl():
+    return current_app.config.get("CATALOGUE_TTL", DEFAULT_TTL)
+
+
+# Index the works in a work/list/composer response
+def index_response(composer_id, response):
+    response.raise_for_status()
+    works = response.json().get("works", [])
+    return get_index().add(composer_id, map(compact_work, works))
+
+
+# Fetch one composer's works from OpenOpus and index them
+def refresh_composer(composer_id):
+    response = upstream.get("openopus", openopus.works_url(composer_id))
+    return index_response(composer_id, response)
+
+
+# A composer's works in the selected genres, fetched if not yet indexed
+def works_for(composer_id, genres):
+    entry = get_index().get(composer_id, ttl())
+    if entry is None:
+        entry = refresh_composer(composer_id)
+    return entry.in_genres(genres)
+
+
+# A composer's works in the selected genres if indexed, however old, or
+# None. Used when the app is too busy to fetch them.
+def indexed_works(composer_id, genres):
+    entry = get_index().composers.get(composer_id)
+    return None if entry is None else entry.in_genres(genres)
+
+
+# Async counterpart of works_for(), for the async routes
+async def works_for_async(client, composer_id, genres):
+    entry = get_index().get(composer_id, ttl())
+    if entry is None:
+        response = await upstream.get_async(
+            client, "openopus", openopus.works_url(composer_id)
+        )
+        entry = index_response(composer_id, response)
+    return entry.in_genres(genres)
+
+
+def catalogue_path():
+    return current_app.config.get(
+        "CATALOGUE_PATH",
+        os.path.join(current_app.instance_path, "catalogue.json"),
+    )
+
+
+def save(path=None):
+    index = get_index()
+    data = {
+        composer_id: {
+            "fetched_at": entry.fetched_at,
+            "works": [list(work) for work in entry.works],
+        }
+        for composer_id, entry in index.composers.items()
+    }
+    path = path or catalogue_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Workers load the file whenever it changes, so never show them half
+    # of it
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(data, file)
+    os.replace(temporary, path)
+
+
+# Load a saved catalogue into the app's index, if one exists
+def load(path=None):
+    path = path or catalogue_path()
+    if not os.path.exists(path):
+        return 0
+
+    with open(path) as file:
+        data = json.load(file)
+
+    index = get_index()
+    for composer_id, entry in data.items():
+        # Keep works fetched since the catalogue was saved
+        indexed = index.composers.get(composer_id)
+        if indexed is not None and indexed.fetched_at >= entry["fetched_at"]:
+            continue
+        works = (
+            Work(
+                sys.intern(title),
+                sys.intern(subtitle),
+                sys.intern(genre),
+                popular,
+                recommended,
+            )
+            for title, subtitle, genre, popular, recommended in entry["works"]
+        )
+        index.add(composer_id, works, entry["fetched_at"])
+    return len(data)
+
+
+def catalogue_metrics():
+    return get_index().stats()
+
+
+metrics.register("catalogue", catalogue_metrics)
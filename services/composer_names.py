@@ -0,0 +1,96 @@
+import threading
+from flask import current_app
+from . import openopus, upstream
+
+# Composer names by OpenOpus id. Names come from the full composer list
+# fetched for the search form, or from one batched composer/list/ids call
+# for every id a search still needs, and are then kept for the life of the
+# app.
+
+names_lock = threading.Lock()
+
+
+def known_names():
+    return current_app.extensions.setdefault("composer_names", {})
+
+
+# Remember the names in a list of OpenOpus composer records
+def remember(composers):
+    with names_lock:
+        names = known_names()
+        for composer in composers:
+            if composer.get("id") is not None and composer.get(
+                "complete_name"
+            ):
+                names[str(composer["id"])] = composer["complete_name"]
+
+
+# Split the ids into those already known and those still to fetch
+def lookup(composer_ids):
+    with names_lock:
+        names = known_names()
+        resolved = {
+            composer_id: names[composer_id]
+            for composer_id in composer_ids
+            if composer_id in names
+        }
+    missing = [
+        composer_id
+        for composer_id in dict.fromkeys(composer_ids)
+        if composer_id not in resolved
+    ]
+    return resolved, missing
+
+
+# Read the names out of a batched composer/list/ids response
+def parse_batch(data, missing):
+    composers = data.get("composers") or []
+
+    # A lone record without an id can only belong to a lone id
+    if len(missing) == 1 and len(composers) == 1:
+        composers = [dict(composers[0], id=composers[0].get("id", missing[0]))]
+
+    remember(composers)
+    return {
+        str(composer["id"]): composer["complete_name"]
+        for composer in composers
+        if composer.get("id") is not None and composer.get("complete_name")
+    }
+
+
+# Fill in UNKNOWN_COMPOSER for anything that couldn't be resolved
+def complete(composer_ids, resolved):
+    return {
+        composer_id: resolved.get(composer_id, openopus.UNKNOWN_COMPOSER)
+        for composer_id in composer_ids
+    }
+
+
+# Map composer ids to names with at most one upstream request
+def resolve(composer_ids):
+    resolved, missing = lookup(composer_ids)
+    if missing:
+        try:
+            response = upstream.get(
+                "openopus", openopus.composers_url(missing)
+            )
+            if response.status_code == 200:
+                resolved.update(parse_batch(response.json(), missing))
+        except upstream.ERRORS as e:
+            print(f"Error fetching composer names: {e}")
+    return complete(composer_ids, resolved)
+
+
+# Async counterpart of resolve(), for the async routes
+async def resolve_async(client, composer_ids):
+    resolved, missing = lookup(composer_ids)
+    if missing:
+        try:
+            response = await upstream.get_async(
+                client, "openopus", openopus.composers_url(missing)
+            )
+            if response.status_code == 200:
+                resolved.update(parse_batch(response.json(), missing))
+        except upstream.ASYNC_ERRORS as e:
+            print(f"Error fetching composer names: {e}")
+    return complete(composer_ids, resolved)
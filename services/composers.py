@@ -0,0 +1,159 @@
+from sqlalchemy import MetaData, inspect, insert, select, text
+from database import db
+from models.composer import Composer
+from models.librarystats import ComposerStats
+from models.musicpiece import MusicPiece, piece_key
+from . import aggregates, invalidation, libraries
+
+# Composers are stored once in the composers table, and pieces refer to
+# them by id. Pieces are deduplicated by natural_key, a 64-bit hash of the
+# composer's name, title and subtitle, so finding an existing piece is one
+# integer index lookup instead of a comparison of three strings.
+#
+# Databases made before the composers table existed keep the composer's
+# name on every piece, and composer_stats keyed by name; `flask
+# migrate_composers` moves them over.
+
+
+# Composer ids by name, adding any composers not yet stored
+def ids_for(names):
+    names = set(names)
+    if not names:
+        return {}
+
+    def stored():
+        return dict(
+            db.session.execute(
+                select(Composer.name, Composer.id).where(
+                    Composer.name.in_(names)
+                )
+            ).all()
+        )
+
+    ids = stored()
+    missing = names - ids.keys()
+    if missing:
+        db.session.execute(
+            insert(Composer).prefix_with("OR IGNORE", dialect="sqlite"),
+            [{"name": name} for name in missing],
+        )
+        ids = stored()
+    return ids
+
+
+def needs_migration(connection):
+    if not inspect(connection).has_table("music_pieces"):
+        return False
+    columns = inspect(connection).get_columns("music_pieces")
+    return "composer_id" not in {column["name"] for column in columns}
+
+
+# Replace composer_stats tables keyed by composer name, in every store,
+# with empty ones keyed by composer id. Returns True if any was replaced.
+def migrate_composer_stats():
+    replaced = False
+    for session in libraries.stores():
+        connection = session.connection()
+        if not inspect(connection).has_table("composer_stats"):
+            continue
+        columns = inspect(connection).get_columns("composer_stats")
+        if "composer_id" in {column["name"] for column in columns}:
+            continue
+        connection.execute(text("DROP TABLE composer_stats"))
+        ComposerStats.__table__.create(connection)
+        replaced = True
+    return replaced
+
+
+# Rebuild music_pieces with composer ids and natural keys, following
+# SQLite's create-copy-drop-rename procedure for changing a table. Pieces
+# whose keys collide (a missing and an empty subtitle) are merged.
+# composer_stats is refilled by composer id.
+def migrate():
+    # Add the composers table and any others the database predates
+    db.create_all()
+    libraries.create_all()
+    stats_replaced = migrate_composer_stats()
+    connection = db.session.connection()
+    if not needs_migration(connection):
+        if not stats_replaced:
+            return None
+        aggregates.rebuild()
+        invalidation.publish([("library", None)])
+        return {"composers": 0, "pieces": 0, "merged": 0, "stats": True}
+
+    rows = connection.execute(
+        text(
+            "SELECT id, composer, title, subtitle, genre, popular, "
+            "recommended FROM music_pieces ORDER BY id"
+        )
+    ).all()
+    ids = ids_for(row.composer for row in rows)
+
+    pieces = {}
+    merged = {}
+    for row in rows:
+        key = piece_key(row.composer, row.title, row.subtitle)
+        if key in pieces:
+            merged[row.id] = pieces[key]["id"]
+            continue
+        pieces[key] = {
+            "id": row.id,
+            "composer_id": ids[row.composer],
+            "title": row.title,
+            "subtitle": row.subtitle,
+            "genre": row.genre,
+            "popular": row.popular,
+            "recommended": row.recommended,
+            "natural_key": key,
+        }
+
+    metadata = MetaData()
+    Composer.__table__.to_metadata(metadata)
+    new_table = MusicPiece.__table__.to_metadata(
+        metadata, name="music_pieces_new"
+    )
+    new_table.create(connection)
+    if pieces:
+        connection.execute(insert(new_table), list(pieces.values()))
+
+    # Point library entries at the piece each duplicate was merged into
+    for duplicate, kept in merged.items():
+        parameters = {"duplicate": duplicate, "kept": kept}
+        connection.execute(
+            text(
+                "UPDATE OR IGNORE user_library SET music_piece_id = :kept "
+                "WHERE music_piece_id = :duplicate"
+            ),
+            parameters,
+        )
+        connection.execute(
+            text("DELETE FROM user_library WHERE music_piece_id = :duplicate"),
+            parameters,
+        )
+        connection.execute(
+            text(
+                "DELETE FROM piece_descriptions "
+                "WHERE music_piece_id = :duplicate"
+            ),
+            parameters,
+        )
+
+    connection.execute(text("DROP TABLE music_pieces"))
+    connection.execute(
+        text("ALTER TABLE music_pieces_new RENAME TO music_pieces")
+    )
+    db.session.commit()
+
+    # The totals may predate the rewrite, or not exist at all: tables the
+    # database lacked were only just created, empty. Save counts of merged
+    # pieces are now counted against the kept piece, and libraries that
+    # held them hold the kept piece instead.
+    aggregates.rebuild()
+    invalidation.publish([("library", None)])
+    return {
+        "composers": len(ids),
+        "pieces": len(pieces),
+        "merged": len(merged),
+        "stats": stats_replaced,
+    }
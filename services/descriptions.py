@@ -0,0 +1,159 @@
+import time
+from itertools import islice
+from sqlalchemy import select
+from database import db
+from models.musicpiece import MusicPiece
+from models.piecedescription import PieceDescription
+from . import llm, llm_usage
+
+# Gemini descriptions of library pieces, stored once generated. A piece's
+# page reads the stored description, and `flask describe_pieces`
+# backfills pieces without one by sending BATCH_SIZE pieces per prompt,
+# several prompts at a time, falling back to one prompt per piece for any
+# piece a batched answer leaves out.
+
+BATCH_SIZE = 10
+SITE = "piece_description"
+BATCH_SITE = "describe_pieces"
+
+BATCH_INSTRUCTIONS = (
+    "For each of the following classical music pieces, write a brief, "
+    "engaging description (2-3 sentences) focusing on what makes the piece "
+    "special and its historical or musical significance."
+)
+
+
+def description_prompt(piece):
+    return (
+        f"Generate a brief, engaging description (2-3 sentences) of the following classical music piece:\n"
+        f"Title: {piece.title}\n"
+        f"Composer: {piece.composer}\n"
+        f"Genre: {piece.genre}\n"
+        f"Additional info: {'This is a popular piece. ' if piece.popular else ''}"
+        f"{'This piece is highly recommended by critics. ' if piece.recommended else ''}\n"
+        "Focus on what makes this piece special and its historical or musical significance."
+    )
+
+
+def batch_description_prompt(pieces):
+    return llm.batch_prompt(
+        BATCH_INSTRUCTIONS,
+        [
+            {
+                "id": piece.id,
+                "title": piece.title,
+                "composer": piece.composer,
+                "genre": piece.genre,
+                "popular": piece.popular,
+                "recommended": piece.recommended,
+            }
+            for piece in pieces
+        ],
+    )
+
+
+def stored(piece_id):
+    entry = db.session.get(PieceDescription, piece_id)
+    return entry.description if entry else None
+
+
+def store(descriptions):
+    for piece_id, text in descriptions.items():
+        db.session.merge(
+            PieceDescription(
+                music_piece_id=piece_id,
+                description=text,
+                created_at=time.time(),
+            )
+        )
+    db.session.commit()
+
+
+# A piece's description, generated and stored on first request
+def describe(piece):
+    text = stored(piece.id)
+    if text is None:
+        text = llm.generate(description_prompt(piece), SITE)
+        store({piece.id: text})
+    else:
+        llm_usage.record_cache_hit(SITE)
+    return text
+
+
+# A piece's description as it streams from Gemini, or from storage. Only
+# a completed stream is stored.
+def stream_description(piece):
+    text = stored(piece.id)
+    if text is not None:
+        llm_usage.record_cache_hit(SITE)
+        yield text
+        return
+
+    chunks = []
+    for chunk in llm.stream(description_prompt(piece), SITE):
+        chunks.append(chunk)
+        yield chunk
+    store({piece.id: "".join(chunks)})
+
+
+def undescribed_pieces(limit=None):
+    query = (
+        select(MusicPiece)
+        .outerjoin(
+            PieceDescription,
+            PieceDescription.music_piece_id == MusicPiece.id,
+        )
+        .where(PieceDescription.music_piece_id.is_(None))
+        .order_by(MusicPiece.id)
+        .limit(limit)
+    )
+    return db.session.scalars(query).all()
+
+
+def chunks(items, size):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+# Describe the pieces a batch per prompt, storing the results. Returns
+# counts of pieces described by batched and single prompts, and failed.
+def backfill(pieces, batch_size=BATCH_SIZE, concurrency=None):
+    counts = {"batched": 0, "single": 0, "failed": 0}
+    batches = list(chunks(pieces, batch_size))
+    answers = llm.generate_many(
+        [batch_description_prompt(batch) for batch in batches],
+        concurrency,
+        BATCH_SITE,
+    )
+
+    descriptions = {}
+    missing = []
+    for batch, answer in zip(batches, answers):
+        texts = (
+            {} if isinstance(answer, Exception) else llm.parse_batch(answer)
+        )
+        for piece in batch:
+            if piece.id in texts:
+                descriptions[piece.id] = texts[piece.id]
+            else:
+                missing.append(piece)
+    counts["batched"] = len(descriptions)
+
+    # Pieces a batch dropped or garbled get a prompt of their own
+    singles = llm.generate_many(
+        [description_prompt(piece) for piece in missing],
+        concurrency,
+        BATCH_SITE,
+    )
+    for piece, answer in zip(missing, singles):
+        if isinstance(answer, Exception):
+            print(f"Error describing piece {piece.id}: {answer}")
+            counts["failed"] += 1
+        else:
+            descriptions[piece.id] = answer
+            counts["single"] += 1
+
+    store(descriptions)
+    llm_usage.save()
+    return counts
@@ -0,0 +1,279 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import (
+    create_engine,
+    delete,
+    event,
+    func,
+    inspect,
+    insert,
+    select,
+)
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import StaticPool
+from models.change import Change, ChangeLogBase
+from . import metrics
+
+# Cache invalidation between worker processes, with no service beyond a
+# SQLite file. Workers keep their own in-process caches, so when one of
+# them changes a library the others must drop what they hold for it.
+# Changes are published as (topic, key) rows to a change log in its own
+# database (CHANGE_LOG_URI), so publishing doesn't wait on the main
+# database's write lock. A row's id is the log's version: each worker
+# remembers the last version it applied and, before a request, at most
+# every CHANGE_POLL_INTERVAL seconds, reads the rows after it with one
+# primary key range query and evicts those keys from the topic's caches.
+# A worker applies its own changes as soon as they are published. The log
+# keeps the last CHANGE_LOG_SIZE rows; a worker that falls further behind
+# than that clears everything instead.
+
+DEFAULT_POLL_INTERVAL = 0.005
+DEFAULT_LOG_SIZE = 10_000
+DEFAULT_CACHE_SIZE = 10_000
+
+# Held while a thread opens the change log, so it's only opened once
+log_lock = threading.Lock()
+
+
+class ChangeLog:
+    def __init__(self, engine):
+        self.engine = engine
+        with engine.connect() as connection:
+            self.version = connection.scalar(select(func.max(Change.id))) or 0
+        self.polled = time.monotonic()
+        self.lock = threading.Lock()
+        self.counts = {"published": 0, "applied": 0, "resets": 0}
+
+    # Append changes to the log and drop rows older than `keep` versions
+    def publish(self, changes, keep):
+        now = time.time()
+        with self.engine.begin() as connection:
+            connection.execute(
+                insert(Change),
+                [
+                    {"topic": topic, "key": key, "created_at": now}
+                    for topic, key in changes
+                ],
+            )
+            latest = connection.scalar(select(func.max(Change.id)))
+            connection.execute(
+                delete(Change).where(Change.id <= latest - keep)
+            )
+        with self.lock:
+            self.counts["published"] += len(changes)
+
+    # The version of the latest change kept for a key of any of the topics,
+    # or 0
+    def latest(self, topics, key):
+        with self.engine.connect() as connection:
+            return (
+                connection.scalar(
+                    select(func.max(Change.id)).where(
+                        Change.topic.in_(topics),
+                        (Change.key == key) | Change.key.is_(None),
+                    )
+                )
+                or 0
+            )
+
+    # The changes after our version, or None if some were dropped from the
+    # log before we read them
+    def read(self):
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(Change.id, Change.topic, Change.key)
+                .where(Change.id > self.version)
+                .order_by(Change.id)
+            ).all()
+        if not rows:
+            return []
+        missed = rows[0].id > self.version + 1
+        self.version = rows[-1].id
+        return None if missed else rows
+
+
+def change_log_uri():
+    return current_app.config.get("CHANGE_LOG_URI") or (
+        "sqlite:///" + os.path.join(current_app.instance_path, "changes.db")
+    )
+
+
+# Create the log's table unless it exists. Another worker may create it
+# between the check and the CREATE, which is fine.
+def create_table(engine):
+    try:
+        ChangeLogBase.metadata.create_all(engine)
+    except OperationalError:
+        if not inspect(engine).has_table(Change.__tablename__):
+            raise
+
+
+def get_log():
+    log = current_app.extensions.get("change_log")
+    if log is not None:
+        return log
+    with log_lock:
+        log = current_app.extensions.get("change_log")
+        if log is not None:
+            return log
+        uri = change_log_uri()
+        if uri in ("sqlite://", "sqlite:///:memory:"):
+            engine = create_engine(
+                uri,
+                poolclass=StaticPool,
+                connect_args={"check_same_thread": False},
+            )
+        else:
+            os.makedirs(current_app.instance_path, exist_ok=True)
+            engine = create_engine(uri)
+
+            # Readers poll constantly, so don't let them block the writer.
+            # The log only matters to running workers, so it needn't be
+            # synced to disk on every commit.
+            @event.listens_for(engine, "connect")
+            def use_wal(connection, record):
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+
+        create_table(engine)
+        log = current_app.extensions["change_log"] = ChangeLog(engine)
+        return log
+
+
+# The app's caches as {name: (topic, cache)}
+def caches():
+    return current_app.extensions.setdefault("invalidation_caches", {})
+
+
+# Evict a changed key, or everything if None, from the topic's caches
+def notify(topic, key):
+    for cache_topic, cache in caches().values():
+        if topic is None or cache_topic == topic:
+            cache.evict(key)
+
+
+# Apply changes other workers have published since the last poll. Runs
+# before each request, but reads the log at most every poll interval unless
+# forced.
+def poll(force=False):
+    log = get_log()
+    interval = current_app.config["CHANGE_POLL_INTERVAL"]
+    if not force and time.monotonic() - log.polled < interval:
+        return
+    # Another thread already polling covers this request too
+    if not log.lock.acquire(blocking=force):
+        return
+    try:
+        log.polled = time.monotonic()
+        rows = log.read()
+        if rows is None:
+            notify(None, None)
+            log.counts["resets"] += 1
+            return
+        # Each key once, in the order it changed
+        for topic, key in dict.fromkeys((row.topic, row.key) for row in rows):
+            notify(topic, key)
+        log.counts["applied"] += len(rows)
+    finally:
+        log.lock.release()
+
+
+# Tell every worker, this one first, that these (topic, key) pairs have
+# changed. Call after the change is committed, so a worker that drops its
+# copy can't read the old value again.
+def publish(changes):
+    changes = [
+        (topic, None if key is None else str(key)) for topic, key in changes
+    ]
+    if not changes:
+        return
+    get_log().publish(changes, current_app.config["CHANGE_LOG_SIZE"])
+    poll(force=True)
+
+
+# The log's version when a key of any of the topics last changed, as seen
+# by every worker. 0 if the change has since been dropped from the log.
+def version(topics, key):
+    return get_log().latest(list(topics), str(key))
+
+
+# An in-process LRU cache for one topic's keys. A value read from the
+# database while a change to the topic was being applied isn't stored, as
+# it may be from before the change.
+class Cache:
+    def __init__(self, max_entries=DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key, load):
+        key = str(key)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counts["hits"] += 1
+                return self.entries[key]
+            self.counts["misses"] += 1
+            generation = self.generation
+
+        value = load()
+        with self.lock:
+            if self.generation == generation:
+                self.entries[key] = value
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return value
+
+    # Drop one key, or every key if None
+    def evict(self, key):
+        with self.lock:
+            self.generation += 1
+            if key is None:
+                self.entries.clear()
+            elif self.entries.pop(key, None) is not None:
+                self.counts["evictions"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {**self.counts, "entries": len(self.entries)}
+
+
+# The app's cache called `name`, whose keys are evicted by changes to
+# `topic`
+def cache(name, topic):
+    existing = caches().get(name)
+    if existing is None:
+        # Changes from here on must be applied to it
+        get_log()
+        existing = caches().setdefault(
+            name,
+            (topic, Cache(current_app.config["INVALIDATION_CACHE_SIZE"])),
+        )
+    return existing[1]
+
+
+def init_app(app):
+    app.config.setdefault("CHANGE_POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+    app.config.setdefault("CHANGE_LOG_SIZE", DEFAULT_LOG_SIZE)
+    app.config.setdefault("INVALIDATION_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+    app.before_request(poll)
+
+
+def invalidation_metrics():
+    log = current_app.extensions.get("change_log")
+    report = {
+        "caches": {
+            name: cache.snapshot() for name, (_, cache) in caches().items()
+        }
+    }
+    if log is not None:
+        report.update(log.counts, version=log.version)
+    return report
+
+
+metrics.register("invalidation", invalidation_metrics)
@@ -0,0 +1,310 @@
+import os
+import threading
+import zlib
+from collections import Counter
+from flask import current_app, g
+from sqlalchemy import create_engine, delete, exists, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from database import db
+from models.librarystats import (
+    ComposerStats,
+    GenreStats,
+    PieceCooccurrence,
+    PieceStats,
+)
+from models.musicpiece import MusicPiece
+from models.userlibrary import UserLibrary
+from . import invalidation
+
+# Where user libraries are stored. By default every library lives in the
+# app's database with everything else. With LIBRARY_SHARDS = n > 1 they
+# are split across n SQLite files by a hash of the user id: a shard holds
+# its users' user_library rows and their share of the library aggregates,
+# so edits to libraries on different shards take different write locks.
+# Users, composers and the music_pieces catalogue stay in the app's
+# database. Questions about every library (totals, whether any library
+# holds a piece, recommender builds) are asked of each shard in turn and
+# the answers combined.
+#
+# A "store" below is the session for one place libraries are kept: the
+# app's db.session when unsharded, else one session per shard file.
+#
+# Each worker caches users' piece ids and their pieces' natural keys,
+# evicted through the invalidation log, so code that changes a library
+# must publish ("library", user_id) once the change is committed.
+
+# The tables kept in each shard
+TABLES = [
+    UserLibrary.__table__,
+    PieceStats.__table__,
+    ComposerStats.__table__,
+    GenreStats.__table__,
+    PieceCooccurrence.__table__,
+]
+
+# Piece ids per query when loading pieces by id
+PIECE_BATCH = 500
+
+engines_lock = threading.Lock()
+
+
+def shard_count():
+    return current_app.config["LIBRARY_SHARDS"]
+
+
+def shard_uri(shard, count):
+    template = current_app.config.get("LIBRARY_SHARD_URI") or (
+        "sqlite:///"
+        + os.path.join(
+            current_app.instance_path, "library-{shard}-of-{count}.db"
+        )
+    )
+    return template.format(shard=shard, count=count)
+
+
+# The shard holding a user's library when there are `count` shards
+def shard_for(user_id, count=None):
+    count = count or shard_count()
+    return zlib.crc32(str(user_id).encode()) % count
+
+
+def engine(shard, count):
+    engines = current_app.extensions.setdefault("library_engines", {})
+    key = (count, shard)
+    with engines_lock:
+        if key not in engines:
+            uri = shard_uri(shard, count)
+            if uri in ("sqlite://", "sqlite:///:memory:"):
+                # One shared connection, or each would get an empty database
+                engines[key] = create_engine(
+                    uri,
+                    poolclass=StaticPool,
+                    connect_args={"check_same_thread": False},
+                )
+            else:
+                if uri.startswith("sqlite:///"):
+                    directory = os.path.dirname(uri[len("sqlite:///") :])
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                engines[key] = create_engine(uri)
+        return engines[key]
+
+
+# The session for one shard, kept for the rest of the app context
+def shard_session(shard, count):
+    sessions = g.setdefault("library_sessions", {})
+    key = (count, shard)
+    if key not in sessions:
+        sessions[key] = Session(bind=engine(shard, count))
+    return sessions[key]
+
+
+# Every store, in shard order
+def stores(count=None):
+    count = count or shard_count()
+    if count <= 1:
+        return [db.session]
+    return [shard_session(shard, count) for shard in range(count)]
+
+
+# The store holding a user's library
+def store_for(user_id, count=None):
+    count = count or shard_count()
+    if count <= 1:
+        return db.session
+    return shard_session(shard_for(user_id, count), count)
+
+
+# Group (user_id, ...) rows by the store they belong in
+def partition(rows, count=None):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(store_for(row[0], count), []).append(row)
+    return grouped.items()
+
+
+# Commit the app's database, then each shard used. The catalogue goes
+# first, so a shard never refers to a piece or user that wasn't saved.
+def commit():
+    db.session.commit()
+    for session in g.get("library_sessions", {}).values():
+        session.commit()
+
+
+def rollback():
+    db.session.rollback()
+    for session in g.get("library_sessions", {}).values():
+        session.rollback()
+
+
+def remove(exception=None):
+    for session in g.pop("library_sessions", {}).values():
+        session.close()
+
+
+def create_all(count=None):
+    count = count or shard_count()
+    for shard in range(count if count > 1 else 0):
+        db.metadata.create_all(engine(shard, count), tables=TABLES)
+
+
+def drop_all(count=None):
+    count = count or shard_count()
+    for shard in range(count if count > 1 else 0):
+        db.metadata.drop_all(engine(shard, count), tables=TABLES)
+
+
+def piece_ids(user_id):
+    return invalidation.cache("library_pieces", "library").get(
+        user_id,
+        lambda: tuple(
+            store_for(user_id).scalars(
+                select(UserLibrary.music_piece_id)
+                .where(UserLibrary.user_id == user_id)
+                .order_by(UserLibrary.music_piece_id)
+            )
+        ),
+    )
+
+
+# The natural keys of the pieces in a user's library, so a results page
+# can tell which works the user has saved with a set lookup per work
+def natural_keys(user_id):
+    def load():
+        ids = piece_ids(user_id)
+        keys = set()
+        for start in range(0, len(ids), PIECE_BATCH):
+            keys.update(
+                db.session.scalars(
+                    select(MusicPiece.natural_key).where(
+                        MusicPiece.id.in_(ids[start : start + PIECE_BATCH])
+                    )
+                )
+            )
+        return frozenset(keys)
+
+    return invalidation.cache("library_keys", "library").get(user_id, load)
+
+
+# Catalogue pieces by id, PIECE_BATCH ids a query, in the order given
+def load_pieces(ids):
+    ids = list(ids)
+    found = {}
+    for start in range(0, len(ids), PIECE_BATCH):
+        batch = ids[start : start + PIECE_BATCH]
+        found.update(
+            (piece.id, piece)
+            for piece in db.session.scalars(
+                select(MusicPiece).where(MusicPiece.id.in_(batch))
+            )
+        )
+    return [found[piece_id] for piece_id in ids if piece_id in found]
+
+
+# The pieces in a user's library, by id
+def pieces(user_id):
+    return load_pieces(piece_ids(user_id))
+
+
+def contains(user_id, piece_id):
+    return store_for(user_id).get(UserLibrary, (user_id, piece_id)) is not None
+
+
+# True if any library holds the piece
+def held(piece_id):
+    return any(
+        session.scalar(
+            select(exists().where(UserLibrary.music_piece_id == piece_id))
+        )
+        for session in stores()
+    )
+
+
+# Ids of the users whose libraries hold any of the pieces
+def holders(piece_ids):
+    piece_ids = list(piece_ids)
+    if not piece_ids:
+        return set()
+    return {
+        user_id
+        for session in stores()
+        for user_id in session.scalars(
+            select(UserLibrary.user_id)
+            .where(UserLibrary.music_piece_id.in_(piece_ids))
+            .distinct()
+        )
+    }
+
+
+# Every (user_id, music_piece_id) library entry
+def entries(count=None):
+    for session in stores(count):
+        yield from session.execute(
+            select(UserLibrary.user_id, UserLibrary.music_piece_id)
+        )
+
+
+# (key, total) pairs of a count column summed over every store, largest
+# first. With one store the database sorts and limits; with shards every
+# store's counts are needed to find the largest totals.
+def totals(key, count, where=None, limit=None):
+    statement = select(key, count).order_by(count.desc())
+    if where is not None:
+        statement = statement.where(where)
+    sessions = stores()
+    if len(sessions) == 1:
+        return [
+            tuple(row) for row in sessions[0].execute(statement.limit(limit))
+        ]
+
+    summed = Counter()
+    for session in sessions:
+        for row_key, row_count in session.execute(statement):
+            summed[row_key] += row_count
+    return summed.most_common(limit)
+
+
+# Copy every library entry into a layout of `count` stores (1 meaning the
+# app's database). The target's library tables are emptied first, and its
+# aggregates are left for aggregates.rebuild(stores(count)). The current
+# layout is left as it is, so the app keeps working until LIBRARY_SHARDS
+# is changed to `count`.
+def reshard(count, batch_size=10_000):
+    if count == shard_count():
+        raise ValueError(f"Libraries are already kept in {count} store(s)")
+
+    create_all(count)
+    targets = stores(count)
+    for session in targets:
+        for table in TABLES:
+            session.execute(delete(table))
+
+    copied = 0
+    batch = []
+    for entry in entries():
+        batch.append(tuple(entry))
+        if len(batch) >= batch_size:
+            copied += copy_entries(batch, count)
+            batch = []
+    copied += copy_entries(batch, count)
+    commit()
+    invalidation.publish([("library", None)])
+    return {"entries": copied, "shards": count}
+
+
+def copy_entries(rows, count):
+    for session, batch in partition(rows, count):
+        session.execute(
+            insert(UserLibrary).prefix_with("OR IGNORE", dialect="sqlite"),
+            [
+                {"user_id": user_id, "music_piece_id": piece_id}
+                for user_id, piece_id in batch
+            ],
+        )
+    return len(rows)
+
+
+def init_app(app):
+    app.config.setdefault("LIBRARY_SHARDS", 1)
+    app.teardown_appcontext(remove)
@@ -0,0 +1,221 @@
+import csv
+import io
+import json
+from itertools import islice
+from sqlalchemy import insert, select
+from database import db
+from models.musicpiece import MusicPiece, piece_key
+from models.user import User
+from models.userlibrary import UserLibrary
+from . import aggregates, composers, invalidation, libraries, shares
+
+# Bulk import and export of a user's library as CSV or JSON. Imports work
+# through the rows a chunk at a time, with a few set-based statements per
+# chunk instead of a query and commit per piece. Exports stream rows from
+# the database in batches, so a library of any size is written with
+# constant memory.
+
+FIELDS = ["composer", "title", "subtitle", "genre", "popular", "recommended"]
+FORMATS = ("csv", "json")
+CHUNK_SIZE = 500
+EXPORT_BATCH = 1000
+
+MIMETYPES = {"csv": "text/csv", "json": "application/json"}
+
+TRUE_VALUES = {"1", "true", "yes", "y"}
+
+
+# Pick the format from an explicit choice or the file's extension
+def detect_format(filename, format=None):
+    if format:
+        return format
+    return "json" if filename and filename.endswith(".json") else "csv"
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+# Normalise an imported row, or None if it doesn't name a piece
+def clean_row(row):
+    if not isinstance(row, dict):
+        return None
+    composer = (row.get("composer") or "").strip()
+    title = (row.get("title") or "").strip()
+    if not composer or not title:
+        return None
+    return {
+        "composer": composer,
+        "title": title,
+        "subtitle": (row.get("subtitle") or "").strip(),
+        "genre": (row.get("genre") or "").strip(),
+        "popular": parse_bool(row.get("popular")),
+        "recommended": parse_bool(row.get("recommended")),
+    }
+
+
+# Rows of an uploaded file, read lazily where the format allows
+def read_rows(file, format):
+    if format == "json":
+        rows = json.load(file)
+        if not isinstance(rows, list):
+            raise ValueError("expected a JSON array of pieces")
+        return iter(rows)
+    return csv.DictReader(file)
+
+
+def get_or_create_user(user_name):
+    user = User.query.filter_by(username=user_name).first()
+    if not user:
+        user = User(username=user_name)
+        db.session.add(user)
+        db.session.commit()
+    return user
+
+
+# Ids of the pieces with these natural keys that already exist, by key
+def existing_piece_ids(keys):
+    return dict(
+        db.session.execute(
+            select(MusicPiece.natural_key, MusicPiece.id).where(
+                MusicPiece.natural_key.in_(keys)
+            )
+        ).all()
+    )
+
+
+# Upsert one chunk of pieces and link them to the user
+def import_chunk(user, rows, counts):
+    pieces = {}
+    for row in rows:
+        piece = clean_row(row)
+        if piece is None:
+            counts["skipped"] += 1
+            continue
+        key = piece_key(piece["composer"], piece["title"], piece["subtitle"])
+        pieces.setdefault(key, piece)
+    if not pieces:
+        return
+
+    ids = existing_piece_ids(pieces.keys())
+    new_keys = [key for key in pieces if key not in ids]
+    if new_keys:
+        composer_ids = composers.ids_for(
+            pieces[key]["composer"] for key in new_keys
+        )
+        db.session.execute(
+            insert(MusicPiece).prefix_with("OR IGNORE", dialect="sqlite"),
+            [
+                {
+                    "composer_id": composer_ids[pieces[key]["composer"]],
+                    "title": pieces[key]["title"],
+                    "subtitle": pieces[key]["subtitle"],
+                    "genre": pieces[key]["genre"],
+                    "popular": pieces[key]["popular"],
+                    "recommended": pieces[key]["recommended"],
+                    "natural_key": key,
+                }
+                for key in new_keys
+            ],
+        )
+        existing = len(ids)
+        ids = existing_piece_ids(pieces.keys())
+        counts["pieces_added"] += len(ids) - existing
+
+    piece_ids = {ids[key] for key in pieces}
+    store = libraries.store_for(user.id)
+    linked = set(
+        store.scalars(
+            select(UserLibrary.music_piece_id).where(
+                UserLibrary.user_id == user.id,
+                UserLibrary.music_piece_id.in_(piece_ids),
+            )
+        )
+    )
+    new_links = [
+        {"user_id": user.id, "music_piece_id": piece_id}
+        for piece_id in piece_ids - linked
+    ]
+    if new_links:
+        store.execute(
+            insert(UserLibrary).prefix_with("OR IGNORE", dialect="sqlite"),
+            new_links,
+        )
+        aggregates.record_saves(user.id, piece_ids - linked)
+        counts["links_added"] += len(new_links)
+    libraries.commit()
+
+
+# Import rows into a user's library, creating the user if needed
+def import_library(user_name, rows, chunk_size=CHUNK_SIZE):
+    user = get_or_create_user(user_name)
+    counts = {"rows": 0, "skipped": 0, "pieces_added": 0, "links_added": 0}
+    rows = iter(rows)
+    try:
+        while chunk := list(islice(rows, chunk_size)):
+            counts["rows"] += len(chunk)
+            import_chunk(user, chunk, counts)
+    except Exception:
+        libraries.rollback()
+        raise
+    finally:
+        # Chunks committed before a failure have changed the library too
+        invalidation.publish([("library", user.id)])
+        shares.mark_stale([user.id], published=True)
+    return counts
+
+
+# A user's pieces as dicts, fetched from the catalogue in batches
+def library_rows(user_name):
+    user = User.query.filter_by(username=user_name).first()
+    if user is None:
+        return
+    piece_ids = libraries.piece_ids(user.id)
+    for start in range(0, len(piece_ids), libraries.PIECE_BATCH):
+        statement = (
+            select(*(getattr(MusicPiece, field) for field in FIELDS))
+            .where(
+                MusicPiece.id.in_(
+                    piece_ids[start : start + libraries.PIECE_BATCH]
+                )
+            )
+            .order_by(MusicPiece.id)
+        )
+        for row in db.session.execute(statement):
+            yield dict(zip(FIELDS, row))
+
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDS)
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_json(rows):
+    batch = ["["]
+    separator = "\n"
+    for row in rows:
+        batch.append(separator + json.dumps(row))
+        separator = ",\n"
+        if len(batch) >= EXPORT_BATCH:
+            yield "".join(batch)
+            batch = []
+    batch.append("\n]\n")
+    yield "".join(batch)
+
+
+# Chunks of text making up the export of a user's library
+def export_library(user_name, format):
+    rows = library_rows(user_name)
+    if format == "json":
+        return export_json(rows)
+    return export_csv(rows)
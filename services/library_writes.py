@@ -0,0 +1,297 @@
+import threading
+import time
+from flask import current_app
+from sqlalchemy import select
+from database import db
+from models.composer import Composer
+from models.musicpiece import MusicPiece, piece_key
+from models.user import User
+from models.userlibrary import UserLibrary
+from . import aggregates, invalidation, libraries, metrics, shares
+
+# Group commit for library edits. SQLite has one writer at a time, so
+# requests that each commit their own edit queue on the database lock. Here
+# the edits from concurrent requests are handed to one writer thread per
+# app, which waits GROUP_COMMIT_WINDOW seconds for more to arrive and then
+# applies up to GROUP_COMMIT_MAX of them in a single transaction. If one
+# edit fails, the batch is retried an edit at a time so only it fails. A
+# request waits until the transaction holding its edit has committed, and
+# its shared library snapshot is refreshed (once per user per batch), so
+# the page it redirects to always shows the change.
+
+DEFAULT_WINDOW = 0.002
+DEFAULT_MAX_BATCH = 128
+# Longest a request waits for its edit to be committed
+WAIT_TIMEOUT = 30
+
+
+class Edit:
+    __slots__ = ("apply", "args", "done", "result", "error")
+
+    def __init__(self, apply, args):
+        self.apply = apply
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        if not self.done.wait(WAIT_TIMEOUT):
+            raise TimeoutError("Library edit was not committed in time")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class WriteQueue:
+    def __init__(self, app):
+        self.app = app
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.counts = {
+            "edits": 0,
+            "batches": 0,
+            "failed": 0,
+            "largest_batch": 0,
+        }
+
+    def submit(self, edit):
+        with self.condition:
+            self.pending.append(edit)
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="group-commit", daemon=True
+                )
+                self.thread.start()
+            self.condition.notify()
+
+    # Wait for an edit, then for the window to fill, and take the batch
+    def take(self, window, max_batch):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending)
+            deadline = time.monotonic() + window
+            while len(self.pending) < max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    break
+            batch = self.pending[:max_batch]
+            del self.pending[:max_batch]
+            return batch
+
+    def run(self):
+        with self.app.app_context():
+            config = self.app.config
+            while True:
+                batch = self.take(
+                    config["GROUP_COMMIT_WINDOW"], config["GROUP_COMMIT_MAX"]
+                )
+                try:
+                    commit(batch)
+                except Exception as e:
+                    # Keep the writer alive for the next batch
+                    print(f"Error committing library edits: {e}")
+                finally:
+                    # Done with the database before the requests go on
+                    db.session.remove()
+                    libraries.remove()
+                    release(batch)
+                self.count(batch)
+
+    def count(self, batch):
+        with self.condition:
+            self.counts["edits"] += len(batch)
+            self.counts["batches"] += 1
+            self.counts["failed"] += sum(
+                1 for edit in batch if edit.error is not None
+            )
+            self.counts["largest_batch"] = max(
+                self.counts["largest_batch"], len(batch)
+            )
+
+    def snapshot(self):
+        with self.condition:
+            return {**self.counts, "pending": len(self.pending)}
+
+
+# Apply edits in one transaction. Returns False, with nothing committed,
+# if any of them fails.
+def apply_together(batch):
+    try:
+        for edit in batch:
+            edit.result = edit.apply(*edit.args)
+        libraries.commit()
+        return True
+    except Exception:
+        libraries.rollback()
+        return False
+
+
+def apply_alone(edit):
+    try:
+        edit.result = edit.apply(*edit.args)
+        libraries.commit()
+    except Exception as e:
+        libraries.rollback()
+        edit.result = None
+        edit.error = e
+
+
+# Commit a batch of edits and mark the changed libraries' snapshots stale. If
+# the batch fails, its edits are retried one transaction each, so only the
+# bad edit fails.
+def commit(batch):
+    if not apply_together(batch):
+        for edit in batch:
+            apply_alone(edit)
+
+    # Each edit returns the id of the user whose library changed, if any
+    changed = {
+        edit.result
+        for edit in batch
+        if edit.error is None and edit.result is not None
+    }
+    invalidation.publish(("library", user_id) for user_id in sorted(changed))
+    shares.mark_stale(sorted(changed), published=True)
+
+
+def release(batch):
+    for edit in batch:
+        edit.done.set()
+
+
+def get_queue():
+    queue = current_app.extensions.get("library_write_queue")
+    if queue is None:
+        queue = current_app.extensions.setdefault(
+            "library_write_queue",
+            WriteQueue(current_app._get_current_object()),
+        )
+    return queue
+
+
+# Run an edit through the group commit, or on its own if that's disabled
+def run_edit(apply, *args):
+    edit = Edit(apply, args)
+    if not current_app.config["GROUP_COMMIT"]:
+        commit([edit])
+        release([edit])
+        return edit.wait()
+    get_queue().submit(edit)
+    return edit.wait()
+
+
+def find_or_add_user(user_name):
+    user = db.session.scalar(select(User).where(User.username == user_name))
+    if user is None:
+        user = User(username=user_name)
+        db.session.add(user)
+        db.session.flush()
+    return user
+
+
+def apply_add(
+    user_name,
+    composer,
+    openopus_id,
+    title,
+    subtitle,
+    genre,
+    popular,
+    recommended,
+):
+    user = find_or_add_user(user_name)
+    composer_record = Composer.named(composer, openopus_id)
+    music_piece = db.session.scalar(
+        select(MusicPiece).where(
+            MusicPiece.natural_key
+            == piece_key(composer_record.name, title, subtitle)
+        )
+    )
+    if music_piece is None:
+        music_piece = MusicPiece(
+            composer_record=composer_record,
+            title=title,
+            subtitle=subtitle,
+            genre=genre,
+            popular=popular,
+            recommended=recommended,
+        )
+        db.session.add(music_piece)
+        db.session.flush()
+
+    if libraries.contains(user.id, music_piece.id):
+        print(
+            f"Music piece '{title}' by '{composer}' is already in the library."
+        )
+        return None
+
+    store = libraries.store_for(user.id)
+    store.add(UserLibrary(user_id=user.id, music_piece_id=music_piece.id))
+    store.flush()
+    aggregates.record_saves(user.id, [music_piece.id])
+    return user.id
+
+
+def apply_remove(user_id, piece_id):
+    store = libraries.store_for(user_id)
+    entry = store.get(UserLibrary, (user_id, piece_id))
+    if entry is None:
+        return None
+
+    aggregates.record_removals(user_id, [piece_id])
+    store.delete(entry)
+    store.flush()
+
+    # Delete the piece if no library holds it any more
+    if not libraries.held(piece_id):
+        piece = db.session.get(MusicPiece, piece_id)
+        if piece is not None:
+            db.session.delete(piece)
+    return user_id
+
+
+# Add a piece to a user's library, creating the user, composer and piece
+# as needed. Returns once the change is committed.
+def add_piece(
+    user_name,
+    composer,
+    title,
+    subtitle=None,
+    genre=None,
+    popular=False,
+    recommended=False,
+    openopus_id=None,
+):
+    return run_edit(
+        apply_add,
+        user_name,
+        composer,
+        openopus_id,
+        title,
+        subtitle,
+        genre,
+        popular,
+        recommended,
+    )
+
+
+# Remove a piece from a user's library. Returns once the change is committed.
+def remove_piece(user_id, piece_id):
+    return run_edit(apply_remove, user_id, piece_id)
+
+
+def write_metrics():
+    queue = current_app.extensions.get("library_write_queue")
+    if queue is None:
+        return {}
+    return queue.snapshot()
+
+
+def init_app(app):
+    app.config.setdefault("GROUP_COMMIT", True)
+    app.config.setdefault("GROUP_COMMIT_WINDOW", DEFAULT_WINDOW)
+    app.config.setdefault("GROUP_COMMIT_MAX", DEFAULT_MAX_BATCH)
+
+
+metrics.register("library_writes", write_metrics)
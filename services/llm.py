@@ -0,0 +1,297 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, has_request_context
+import google.generativeai as genai
+from . import llm_usage
+from .breaker import get_breaker
+
+# One place for Gemini calls. Each app holds one model client, and every
+# call is checked against the usage limits (services/llm_usage.py), waits
+# on a shared rate limiter (requests and estimated tokens per minute) and
+# goes through the "gemini" circuit breaker. Calls made for a request wait
+# at most LLM_REQUEST_MAX_WAIT seconds for the rate limiter, then raise
+# LimitExceeded so the page falls back as it would for any failed call. Calls name their call site so
+# usage can be accounted per feature.
+# generate_many() runs independent prompts concurrently under the same
+# limits. LLM_BACKEND = "fake" swaps in FakeModel, which answers instantly
+# and understands batched prompts, for tests and local runs.
+
+DEFAULT_MODEL = "gemini-pro"
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 60_000
+DEFAULT_CONCURRENCY = 4
+DEFAULT_SITE = "other"
+# Seconds a request may wait on the rate limiter, well within gunicorn's
+# worker timeout. Bulk jobs outside a request wait as long as it takes.
+DEFAULT_REQUEST_MAX_WAIT = 5
+
+# Batched prompts list their items as JSON after this line, and ask for a
+# JSON array back
+BATCH_MARKER = "Items (JSON):"
+
+
+# Sliding one-minute window over requests and estimated tokens
+class RateLimiter:
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.calls = []  # (time, tokens) in the last minute
+        self.lock = threading.Lock()
+
+    # Seconds until a call of this many tokens fits, reserving it if now
+    def reserve(self, tokens):
+        with self.lock:
+            now = time.monotonic()
+            self.calls = [call for call in self.calls if now - call[0] < 60]
+            used = sum(spent for _, spent in self.calls)
+            # A call bigger than the whole budget waits for an empty window
+            tokens = min(tokens, self.tokens_per_minute)
+            if (
+                len(self.calls) < self.requests_per_minute
+                and used + tokens <= self.tokens_per_minute
+            ):
+                self.calls.append((now, tokens))
+                return 0.0
+            return max(60 - (now - self.calls[0][0]), 0.01)
+
+    # Wait until the call fits. With max_wait, raise LimitExceeded instead
+    # of waiting longer than that many seconds.
+    def acquire(self, tokens, max_wait=None):
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while (wait := self.reserve(tokens)) > 0:
+            self.check_deadline(wait, deadline)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens, max_wait=None):
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while (wait := self.reserve(tokens)) > 0:
+            self.check_deadline(wait, deadline)
+            await asyncio.sleep(wait)
+
+    def check_deadline(self, wait, deadline):
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise llm_usage.LimitExceeded(
+                f"Gemini call refused: rate limited for {wait:.0f}s"
+            )
+
+
+# Small LRU cache whose entries expire after `ttl` seconds
+class TTLCache:
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] >= self.ttl:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+# A streamed FakeModel answer, a word at a time
+class FakeStream:
+    def __init__(self, text, latency):
+        self.text = text
+        self.latency = latency
+
+    def __iter__(self):
+        for word in self.text.split(" "):
+            time.sleep(self.latency)
+            yield FakeResponse(word + " ")
+
+
+# Stands in for genai.GenerativeModel without the network
+class FakeModel:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.prompts = []
+
+    def answer(self, prompt):
+        self.prompts.append(prompt)
+        if BATCH_MARKER in prompt:
+            items = json.loads(prompt.split(BATCH_MARKER, 1)[1])
+            return json.dumps(
+                [
+                    {
+                        "id": item["id"],
+                        "text": f"A fake description of {item['title']}.",
+                    }
+                    for item in items
+                ]
+            )
+        return f"A fake response to: {prompt[:60]}"
+
+    def generate_content(self, prompt, stream=False):
+        if stream:
+            return FakeStream(self.answer(prompt), self.latency)
+        time.sleep(self.latency)
+        return FakeResponse(self.answer(prompt))
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self.answer(prompt))
+
+
+# The app's model client, created on first use
+def get_model():
+    model = current_app.extensions.get("llm_model")
+    if model is None:
+        config = current_app.config
+        if config.get("LLM_BACKEND") == "fake":
+            model = FakeModel()
+        else:
+            model = genai.GenerativeModel(
+                config.get("LLM_MODEL", DEFAULT_MODEL)
+            )
+        current_app.extensions["llm_model"] = model
+    return model
+
+
+def get_limiter():
+    limiter = current_app.extensions.get("llm_limiter")
+    if limiter is None:
+        config = current_app.config
+        limiter = RateLimiter(
+            config.get("LLM_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE),
+            config.get("LLM_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE),
+        )
+        current_app.extensions["llm_limiter"] = limiter
+    return limiter
+
+
+# How long the current call may wait on the rate limiter, None for as long
+# as it takes
+def max_wait():
+    if not has_request_context():
+        return None
+    return current_app.config.get(
+        "LLM_REQUEST_MAX_WAIT", DEFAULT_REQUEST_MAX_WAIT
+    )
+
+
+# Send one prompt and return the response text
+def generate(prompt, site=DEFAULT_SITE):
+    tokens = llm_usage.estimate_tokens(prompt)
+    user = llm_usage.admit(site, tokens)
+    get_limiter().acquire(tokens, max_wait())
+    with llm_usage.timed(site, user, prompt) as call:
+        call.response = get_breaker("gemini").call(
+            get_model().generate_content, prompt
+        )
+    return call.response.text
+
+
+async def generate_async(prompt, site=DEFAULT_SITE):
+    tokens = llm_usage.estimate_tokens(prompt)
+    user = llm_usage.admit(site, tokens)
+    await get_limiter().acquire_async(tokens, max_wait())
+    with llm_usage.timed(site, user, prompt) as call:
+        call.response = await get_breaker("gemini").call_async(
+            get_model().generate_content_async, prompt
+        )
+    return call.response.text
+
+
+# Send one prompt and yield the response text as it arrives. The call is
+# recorded, and counted as a success by the breaker, once the stream
+# completes; a stream failing part way counts as a failure.
+def stream(prompt, site=DEFAULT_SITE):
+    tokens = llm_usage.estimate_tokens(prompt)
+    user = llm_usage.admit(site, tokens)
+    get_limiter().acquire(tokens, max_wait())
+    breaker = get_breaker("gemini")
+    with llm_usage.timed(
+        site, user, prompt
+    ) as call, breaker.guard() as timing:
+        response = get_model().generate_content(prompt, stream=True)
+        for chunk in response:
+            timing.first_chunk()
+            yield chunk.text
+        call.response = response
+
+
+# Whether pages stream Gemini output as it arrives (STREAM_LLM)
+def streaming():
+    return current_app.config.get("STREAM_LLM", False)
+
+
+# Pass a stream through, ending it with `message` if it fails part way, as
+# a page being streamed can no longer show an error page
+def guarded(chunks, message=""):
+    try:
+        yield from chunks
+    except Exception as e:
+        print(f"Error streaming from Gemini: {e}")
+        if message:
+            yield message.format(error=e)
+
+
+# Send independent prompts concurrently. Returns a list in prompt order
+# holding each response text, or the exception its call raised.
+def generate_many(prompts, concurrency=None, site=DEFAULT_SITE):
+    app = current_app._get_current_object()
+    concurrency = concurrency or app.config.get(
+        "LLM_CONCURRENCY", DEFAULT_CONCURRENCY
+    )
+
+    def run(prompt):
+        with app.app_context():
+            try:
+                return generate(prompt, site)
+            except Exception as e:
+                return e
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(run, prompts))
+
+
+# A prompt asking for one answer per item, as a JSON array of
+# {"id": ..., "text": ...} objects
+def batch_prompt(instructions, items):
+    return (
+        f"{instructions}\n"
+        "Reply with only a JSON array containing one object per item, "
+        'each with the item\'s "id" and your answer as "text".\n'
+        f"{BATCH_MARKER}\n{json.dumps(items, ensure_ascii=False)}"
+    )
+
+
+# Answers by id from a batched response, ignoring anything malformed
+def parse_batch(text):
+    text = text.strip()
+    # Models sometimes wrap JSON in a Markdown code fence
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        answers = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(answers, list):
+        return {}
+    return {
+        answer["id"]: answer["text"]
+        for answer in answers
+        if isinstance(answer, dict)
+        and "id" in answer
+        and isinstance(answer.get("text"), str)
+    }
@@ -0,0 +1,362 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from flask import current_app, has_request_context
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as upsert
+from sqlalchemy.exc import SQLAlchemyError
+from database import db
+from middleware import admission
+from models.llmusage import LlmUsage
+from . import metrics
+
+# Accounting for Gemini calls. Every call is recorded against its call
+# site (e.g. "weather_mood") with its token counts and latency, and cache
+# hits that saved a call are counted alongside. Before a call, admit()
+# enforces a per-client request rate and daily token budget, and a global
+# daily token budget, raising LimitExceeded instead of calling.
+#
+# Counts are kept per app for /metrics, and written to the llm_usage table
+# after a request at most every LLM_USAGE_SAVE_INTERVAL seconds (and by
+# bulk commands) so `flask llm_usage` can report across workers. They are
+# written on a connection of their own, so saving never commits what the
+# request's session holds. The global budget counts other workers' tokens
+# as of their last write.
+
+COUNTERS = (
+    "calls",
+    "errors",
+    "rejected",
+    "cache_hits",
+    "prompt_tokens",
+    "response_tokens",
+    "seconds",
+)
+LATENCY_WINDOW = 500  # recent calls per site used for percentiles
+DEFAULT_USER_REQUESTS_PER_MINUTE = 10
+DEFAULT_SAVE_INTERVAL = 5
+# Estimated US dollars per 1000 tokens, for the cost columns only
+DEFAULT_PRICES = {"prompt": 0.000125, "response": 0.000375}
+
+
+# Raised instead of calling Gemini when a rate or budget limit is reached
+class LimitExceeded(Exception):
+    pass
+
+
+# Rough token count for budgeting; Gemini averages ~4 characters a token
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def zeroed():
+    return dict.fromkeys(COUNTERS, 0)
+
+
+class Ledger:
+    def __init__(self):
+        self.totals = defaultdict(zeroed)  # per site since start
+        self.pending = defaultdict(zeroed)  # per (day, site), not yet saved
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.user_calls = defaultdict(deque)  # user -> call times, last min
+        self.user_tokens = defaultdict(int)  # (day, user) -> tokens
+        self.saved_day = None
+        self.saved_tokens = 0  # every worker's tokens today, at last save
+        self.saved_at = 0.0  # monotonic time of the last save
+        self.lock = threading.Lock()
+
+    def _add(self, site, changes):
+        pending = self.pending[(today(), site)]
+        for name, value in changes.items():
+            self.totals[site][name] += value
+            pending[name] += value
+
+    def add(self, site, **changes):
+        with self.lock:
+            self._add(site, changes)
+
+    # Tokens used today by every worker, as far as this one knows
+    def _tokens_today(self):
+        day = today()
+        saved = self.saved_tokens if self.saved_day == day else 0
+        return saved + sum(
+            counts["prompt_tokens"] + counts["response_tokens"]
+            for (pending_day, _), counts in self.pending.items()
+            if pending_day == day
+        )
+
+    # Raise LimitExceeded if a call of `tokens` would break a limit,
+    # otherwise count it against the user's rate
+    def admit(self, site, user, tokens, config):
+        reason = None
+        with self.lock:
+            budget = config.get("LLM_DAILY_TOKEN_BUDGET")
+            if budget and self._tokens_today() + tokens > budget:
+                reason = "daily token budget reached"
+
+            if user is not None and reason is None:
+                now = time.monotonic()
+                calls = self.user_calls[user]
+                while calls and now - calls[0] >= 60:
+                    calls.popleft()
+                user_budget = config.get("LLM_USER_TOKENS_PER_DAY")
+                if len(calls) >= config.get(
+                    "LLM_USER_REQUESTS_PER_MINUTE",
+                    DEFAULT_USER_REQUESTS_PER_MINUTE,
+                ):
+                    reason = "too many requests"
+                elif (
+                    user_budget
+                    and self.user_tokens[(today(), user)] + tokens
+                    > user_budget
+                ):
+                    reason = "daily token budget for this user reached"
+                else:
+                    calls.append(now)
+
+            if reason is not None:
+                self._add(site, {"rejected": 1})
+        if reason is not None:
+            raise LimitExceeded(f"Gemini call refused: {reason}")
+
+    def record_call(self, site, user, prompt_tokens, response_tokens, elapsed):
+        with self.lock:
+            self._add(
+                site,
+                {
+                    "calls": 1,
+                    "prompt_tokens": prompt_tokens,
+                    "response_tokens": response_tokens,
+                    "seconds": elapsed,
+                },
+            )
+            self.latencies[site].append(elapsed)
+            if user is not None:
+                self.user_tokens[(today(), user)] += (
+                    prompt_tokens + response_tokens
+                )
+
+    def take_pending(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(zeroed)
+            self.saved_at = time.monotonic()
+            # Forget users idle for a minute and yesterday's budgets
+            day = today()
+            for user in [
+                u for u, calls in self.user_calls.items() if not calls
+            ]:
+                del self.user_calls[user]
+            for key in [key for key in self.user_tokens if key[0] != day]:
+                del self.user_tokens[key]
+        return pending
+
+    # Put back counts that couldn't be saved
+    def restore(self, pending):
+        with self.lock:
+            for key, counts in pending.items():
+                for name, value in counts.items():
+                    self.pending[key][name] += value
+
+    def set_saved_tokens(self, day, tokens):
+        with self.lock:
+            self.saved_day = day
+            self.saved_tokens = tokens
+
+    def snapshot(self, prices):
+        with self.lock:
+            sites = {
+                site: dict(counts) for site, counts in self.totals.items()
+            }
+            latencies = {
+                site: sorted(window) for site, window in self.latencies.items()
+            }
+            tokens_today = self._tokens_today()
+
+        for site, counts in sites.items():
+            counts.update(summary(counts, prices))
+            window = latencies.get(site, [])
+            for percentile in (50, 95, 99):
+                counts[f"p{percentile}_ms"] = percentile_ms(window, percentile)
+        return {"sites": sites, "tokens_today": tokens_today}
+
+
+def percentile_ms(window, percentile):
+    if not window:
+        return None
+    index = min(len(window) - 1, len(window) * percentile // 100)
+    return round(1000 * window[index])
+
+
+# Derived columns shared by /metrics and the CLI report
+def summary(counts, prices):
+    requested = counts["calls"] + counts["cache_hits"]
+    return {
+        "cache_hit_rate": (
+            round(counts["cache_hits"] / requested, 3) if requested else None
+        ),
+        "mean_ms": (
+            round(1000 * counts["seconds"] / counts["calls"])
+            if counts["calls"]
+            else None
+        ),
+        "cost_usd": round(
+            counts["prompt_tokens"] / 1000 * prices["prompt"]
+            + counts["response_tokens"] / 1000 * prices["response"],
+            4,
+        ),
+    }
+
+
+def get_ledger():
+    ledger = current_app.extensions.get("llm_usage")
+    if ledger is None:
+        ledger = current_app.extensions.setdefault("llm_usage", Ledger())
+    return ledger
+
+
+def prices():
+    return current_app.config.get("LLM_PRICES", DEFAULT_PRICES)
+
+
+# Who a call is made for: the client's address, counted the same way as
+# for admission control. Not `user_name`, which a client could change on
+# every request. Calls outside a request (bulk commands) only face the
+# global limits.
+def current_user():
+    if not has_request_context():
+        return None
+    return admission.current_user()
+
+
+# Check the limits for a call from the current user, who is returned
+def admit(site, tokens):
+    user = current_user()
+    get_ledger().admit(site, user, tokens, current_app.config)
+    return user
+
+
+def record_cache_hit(site):
+    get_ledger().add(site, cache_hits=1)
+
+
+class Call:
+    def __init__(self):
+        self.response = None
+
+
+# Time a model call, then record it with its token counts. Gemini reports
+# token counts in usage_metadata; otherwise they are estimated.
+@contextmanager
+def timed(site, user, prompt):
+    ledger = get_ledger()
+    call = Call()
+    started = time.monotonic()
+    try:
+        yield call
+    except Exception:
+        ledger.add(site, calls=1, errors=1, seconds=time.monotonic() - started)
+        raise
+
+    elapsed = time.monotonic() - started
+    usage = getattr(call.response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None)
+    response_tokens = getattr(usage, "candidates_token_count", None)
+    if not isinstance(prompt_tokens, int):
+        prompt_tokens = estimate_tokens(prompt)
+    if not isinstance(response_tokens, int):
+        response_tokens = estimate_tokens(call.response.text)
+    ledger.record_call(site, user, prompt_tokens, response_tokens, elapsed)
+
+
+# Write counts recorded since the last save to llm_usage
+def save():
+    ledger = get_ledger()
+    pending = ledger.take_pending()
+    day = today()
+    try:
+        with db.engine.begin() as connection:
+            tokens = write(connection, pending, day)
+    except SQLAlchemyError as e:
+        ledger.restore(pending)
+        print(f"Error saving LLM usage: {e}")
+        return
+    ledger.set_saved_tokens(day, tokens)
+
+
+# Add pending counts to llm_usage, returning the day's tokens from every
+# worker
+def write(connection, pending, day):
+    for (day, site), counts in pending.items():
+        statement = upsert(LlmUsage).values(day=day, site=site, **counts)
+        statement = statement.on_conflict_do_update(
+            index_elements=["day", "site"],
+            set_={
+                name: getattr(LlmUsage, name) + statement.excluded[name]
+                for name in COUNTERS
+            },
+        )
+        connection.execute(statement)
+    return connection.scalar(
+        select(
+            func.coalesce(
+                func.sum(LlmUsage.prompt_tokens + LlmUsage.response_tokens),
+                0,
+            )
+        ).where(LlmUsage.day == day)
+    )
+
+
+# Totals per call site over the last `days` days, from llm_usage
+def report(days=7):
+    save()
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime(
+        "%Y-%m-%d"
+    )
+    rows = db.session.execute(
+        select(
+            LlmUsage.site,
+            *[func.sum(getattr(LlmUsage, name)) for name in COUNTERS],
+        )
+        .where(LlmUsage.day >= since)
+        .group_by(LlmUsage.site)
+        .order_by(LlmUsage.site)
+    ).all()
+
+    sites = {}
+    for site, *values in rows:
+        counts = dict(zip(COUNTERS, values))
+        counts.update(summary(counts, prices()))
+        sites[site] = counts
+    return sites
+
+
+def init_app(app):
+    app.config.setdefault("LLM_USAGE_SAVE_INTERVAL", DEFAULT_SAVE_INTERVAL)
+
+    @app.after_request
+    def save_usage(response):
+        ledger = app.extensions.get("llm_usage")
+        if (
+            ledger is not None
+            and ledger.pending
+            and time.monotonic() - ledger.saved_at
+            >= app.config["LLM_USAGE_SAVE_INTERVAL"]
+        ):
+            save()
+        return response
+
+
+def usage_metrics():
+    ledger = current_app.extensions.get("llm_usage")
+    if ledger is None:
+        return {}
+    return ledger.snapshot(prices())
+
+
+metrics.register("llm", usage_metrics)
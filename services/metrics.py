@@ -0,0 +1,12 @@
+# Registry behind the /metrics endpoint. Each provider is a function that
+# returns a JSON-serialisable snapshot of one subsystem's state.
+
+providers = {}
+
+
+def register(name, provider):
+    providers[name] = provider
+
+
+def snapshot():
+    return {name: provider() for name, provider in providers.items()}
@@ -0,0 +1,47 @@
+from flask import current_app
+
+# Helpers shared by the sync and async views that talk to OpenOpus
+
+OPENOPUS_API_URL = "https://api.openopus.org"
+UNKNOWN_COMPOSER = "Unknown Composer"
+
+# Genres offered on the search form
+GENRES = [
+    "Keyboard",
+    "Orchestral",
+    "Chamber",
+    "Stage",
+    "Choral",
+    "Opera",
+    "Vocal",
+]
+
+
+# Build a full OpenOpus URL, so the API host can be swapped out in config
+def api_url(path):
+    base_url = current_app.config.get("OPENOPUS_API_URL", OPENOPUS_API_URL)
+    return f"{base_url}/{path}"
+
+
+def all_composers_url():
+    return api_url("composer/list/name/all.json")
+
+
+def popular_composers_url():
+    return api_url("composer/list/pop.json")
+
+
+# One request for several composers, by comma-separated ids
+def composers_url(composer_ids):
+    return api_url(f"composer/list/ids/{','.join(composer_ids)}.json")
+
+
+def works_url(composer_id):
+    return api_url(f"work/list/composer/{composer_id}/genre/all.json")
+
+
+# How a composer whose works couldn't be fetched is named on the results page
+def failed_composer_label(composer_id, composer_name):
+    if composer_name == UNKNOWN_COMPOSER:
+        return f"composer {composer_id}"
+    return composer_name
@@ -0,0 +1,232 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from scipy import sparse
+from flask import current_app
+from models.musicpiece import MusicPiece
+from . import libraries
+
+# "More like your library" recommendations from item-item similarity.
+#
+# A build reads every library into a sparse users x pieces matrix and finds
+# each piece's most similar pieces by cosine similarity over the users
+# who saved them, a block of pieces at a time with sparse matrix products.
+# The result is a neighbour table of NEIGHBORS piece ids and scores per
+# piece, saved as .npy files and memory-mapped by every worker, so a
+# recommendation only reads the rows for the pieces in one library.
+#
+# A refresh recomputes only the rows of pieces whose save count changed
+# since the last build. Rows of other pieces keep their old scores for the
+# changed pieces until the next full build.
+
+NEIGHBORS = 20
+BLOCK_SIZE = 256
+ARRAYS = ("pieces", "counts", "neighbors", "scores")
+
+table_lock = threading.Lock()
+
+
+class NeighborTable:
+    def __init__(self, pieces, counts, neighbors, scores):
+        self.pieces = pieces  # sorted piece ids, one row each
+        self.counts = counts  # saves per piece at build time
+        self.neighbors = neighbors  # piece ids, -1 where a row is short
+        self.scores = scores
+
+    # Table rows of the pieces, skipping pieces the table doesn't hold
+    def rows(self, piece_ids):
+        piece_ids = np.asarray(piece_ids, dtype=np.int64)
+        rows = np.searchsorted(self.pieces, piece_ids)
+        rows = rows[rows < len(self.pieces)]
+        return rows[np.isin(self.pieces[rows], piece_ids)]
+
+    # Pieces most similar to a whole library, as (piece_id, score) pairs.
+    # A candidate's score is the sum of its similarity to each piece.
+    def recommend(self, piece_ids, k=10):
+        rows = self.rows(piece_ids)
+        if not len(rows):
+            return []
+        candidates = np.asarray(self.neighbors[rows]).ravel()
+        weights = np.asarray(self.scores[rows]).ravel()
+        keep = (candidates >= 0) & ~np.isin(candidates, piece_ids)
+        ids, inverse = np.unique(candidates[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=weights[keep])
+        top = np.argsort(-totals, kind="stable")[:k]
+        return list(zip(ids[top].tolist(), totals[top].tolist()))
+
+
+# Sorted piece ids and the users x pieces matrix of who saved what
+def library_matrix(user_ids, piece_ids):
+    pieces, columns = np.unique(piece_ids, return_inverse=True)
+    users, rows = np.unique(user_ids, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+        shape=(len(users), len(pieces)),
+    )
+    return pieces, matrix
+
+
+# Top-k neighbours, by cosine similarity, of the pieces at `columns`.
+# `items` is pieces x users and `matrix` users x pieces, both CSR.
+def neighbor_rows(items, matrix, norms, pieces, columns, k):
+    block = items[columns] @ matrix
+    neighbors = np.full((len(columns), k), -1, dtype=np.int64)
+    similarity = np.zeros((len(columns), k), dtype=np.float32)
+
+    for row, column in enumerate(columns):
+        start, end = block.indptr[row], block.indptr[row + 1]
+        others = block.indices[start:end]
+        scores = block.data[start:end] / (norms[column] * norms[others])
+        # A piece isn't its own neighbour
+        scores[others == column] = 0
+        # Partition out the k best before sorting just those
+        top = np.arange(len(scores))
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[scores[top] > 0]
+        neighbors[row, : len(top)] = pieces[others[top]]
+        similarity[row, : len(top)] = scores[top]
+    return neighbors, similarity
+
+
+# Build a neighbour table from parallel arrays of user and piece ids,
+# recomputing only the rows of changed pieces if a previous table is given
+def build_table(user_ids, piece_ids, k=NEIGHBORS, previous=None):
+    pieces, matrix = library_matrix(user_ids, piece_ids)
+    items = matrix.T.tocsr()
+    counts = np.diff(items.indptr).astype(np.int64)
+    norms = np.sqrt(counts).astype(np.float32)
+    neighbors = np.full((len(pieces), k), -1, dtype=np.int64)
+    scores = np.zeros((len(pieces), k), dtype=np.float32)
+
+    dirty = np.arange(len(pieces))
+    if previous is not None and previous.neighbors.shape[1] == k:
+        rows = np.searchsorted(previous.pieces, pieces)
+        rows = np.minimum(rows, max(len(previous.pieces) - 1, 0))
+        known = (
+            previous.pieces[rows] == pieces
+            if len(previous.pieces)
+            else np.zeros(len(pieces), dtype=bool)
+        )
+        unchanged = known.copy()
+        unchanged[known] = previous.counts[rows[known]] == counts[known]
+        neighbors[unchanged] = previous.neighbors[rows[unchanged]]
+        scores[unchanged] = previous.scores[rows[unchanged]]
+        # Pieces no longer saved by anyone drop out of kept rows
+        gone = (neighbors >= 0) & ~np.isin(neighbors, pieces)
+        neighbors[gone] = -1
+        scores[gone] = 0
+        dirty = np.flatnonzero(~unchanged)
+
+    for start in range(0, len(dirty), BLOCK_SIZE):
+        columns = dirty[start : start + BLOCK_SIZE]
+        neighbors[columns], scores[columns] = neighbor_rows(
+            items, matrix, norms, pieces, columns, k
+        )
+    return NeighborTable(pieces, counts, neighbors, scores), len(dirty)
+
+
+def table_path():
+    return current_app.config.get(
+        "RECOMMENDER_PATH",
+        os.path.join(current_app.instance_path, "recommender"),
+    )
+
+
+# The build meta.json points at, or None before the first save
+def current_build(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as file:
+            return json.load(file)["build"]
+    except FileNotFoundError:
+        return None
+
+
+# Write a table to a new directory, then point meta.json at it
+def save(table, path):
+    name = f"build-{time.time_ns()}"
+    os.makedirs(os.path.join(path, name))
+    for array in ARRAYS:
+        np.save(
+            os.path.join(path, name, f"{array}.npy"), getattr(table, array)
+        )
+
+    previous = current_build(path)
+    meta = os.path.join(path, "meta.json")
+    with open(meta + ".tmp", "w") as file:
+        json.dump({"build": name, "pieces": len(table.pieces)}, file)
+    os.replace(meta + ".tmp", meta)
+
+    # A worker may have just read the old meta.json and not yet mapped the
+    # previous build, so that one is only removed by the next save. Workers
+    # still mapping an older build keep their open files.
+    for entry in os.listdir(path):
+        if entry.startswith("build-") and entry not in (name, previous):
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+
+def read_table(path, build):
+    arrays = [
+        np.load(os.path.join(path, build, f"{array}.npy"), mmap_mode="r")
+        for array in ARRAYS
+    ]
+    return NeighborTable(*arrays)
+
+
+# The latest saved table, memory-mapped and reloaded when a new build lands
+def get_table():
+    path = table_path()
+    build = current_build(path)
+    if build is None:
+        return None
+
+    with table_lock:
+        cached = current_app.extensions.get("recommender")
+        if cached is None or cached[0] != build:
+            cached = (build, read_table(path, build))
+            current_app.extensions["recommender"] = cached
+    return cached[1]
+
+
+def library_links():
+    links = list(libraries.entries())
+    links = np.array(links, dtype=np.int64).reshape(-1, 2)
+    return links[:, 0], links[:, 1]
+
+
+# Rebuild the saved table from user_library, incrementally unless `full`
+def refresh(full=False, k=NEIGHBORS):
+    started = time.perf_counter()
+    previous = None if full else get_table()
+    user_ids, piece_ids = library_links()
+    table, recomputed = build_table(user_ids, piece_ids, k, previous)
+    save(table, table_path())
+    return {
+        "pieces": len(table.pieces),
+        "recomputed": recomputed,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+# Pieces recommended for a user's library, best first
+def recommend_for(user_id, k=10):
+    table = get_table()
+    if table is None:
+        return []
+    library = libraries.piece_ids(user_id)
+    scored = table.recommend(library, k)
+    pieces = {
+        piece.id: piece
+        for piece in MusicPiece.query.filter(
+            MusicPiece.id.in_([piece_id for piece_id, _ in scored])
+        )
+    }
+    return [
+        (pieces[piece_id], score)
+        for piece_id, score in scored
+        if piece_id in pieces
+    ]
@@ -0,0 +1,347 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlencode
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from database import db
+from models.musicpiece import MusicPiece, piece_key
+from models.recording import Recording
+from . import libraries, metrics, shares, upstream
+
+# The YouTube video for each piece, so play buttons open a recording instead
+# of a YouTube search. Pages only read the recordings table (one query per
+# page); library pieces it doesn't know, or knew too long ago, are queued
+# and resolved in the background, a batch at a time, with the searches in a
+# batch sent together and their results written in one statement. Searches
+# that find nothing are stored too, so they aren't repeated on every page
+# view, and retried after RECORDING_NEGATIVE_TTL. Without a YOUTUBE_API_KEY
+# recordings are left alone and pages link to searches.
+
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+BATCH_SIZE = 20
+CONCURRENCY = 4
+
+# Seconds before a found video, or a search that found nothing, is
+# looked up again
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 60 * 60
+
+search_pool = ThreadPoolExecutor(
+    max_workers=CONCURRENCY, thread_name_prefix="recordings-search"
+)
+worker_pool = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="recordings"
+)
+
+
+class ResolveQueue:
+    def __init__(self):
+        self.pending = {}
+        # Keys taken by the worker whose results aren't stored yet
+        self.resolving = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.future = None
+        self.counts = {
+            "queued": 0,
+            "found": 0,
+            "not_found": 0,
+            "errors": 0,
+        }
+
+    # Queue (key, composer, title, subtitle) tuples. Returns True if a
+    # worker needs starting.
+    def add(self, pieces):
+        with self.lock:
+            for piece in pieces:
+                if (
+                    piece[0] not in self.pending
+                    and piece[0] not in self.resolving
+                ):
+                    self.pending[piece[0]] = piece
+                    self.counts["queued"] += 1
+            if not self.pending or self.running:
+                return False
+            self.running = True
+            return True
+
+    # Up to size queued pieces, or None once the queue is empty, which
+    # also marks the worker as finished
+    def take(self, size):
+        with self.lock:
+            if not self.pending:
+                self.running = False
+                return None
+            keys = list(islice(self.pending, size))
+            self.resolving.update(keys)
+            return [self.pending.pop(key) for key in keys]
+
+    def finish(self, keys):
+        with self.lock:
+            self.resolving.difference_update(keys)
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.resolving.clear()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+
+def get_queue():
+    return current_app.extensions.setdefault(
+        "recordings_queue", ResolveQueue()
+    )
+
+
+def enabled():
+    return bool(current_app.config.get("YOUTUBE_API_KEY"))
+
+
+def search_url(composer, title, subtitle):
+    base_url = current_app.config.get("YOUTUBE_API_URL", YOUTUBE_API_URL)
+    query = " ".join(part for part in (composer, title, subtitle) if part)
+    parameters = {
+        "part": "id",
+        "type": "video",
+        "maxResults": 1,
+        "videoEmbeddable": "true",
+        "q": query,
+        "key": current_app.config["YOUTUBE_API_KEY"],
+    }
+    return f"{base_url}/search?{urlencode(parameters)}"
+
+
+def watch_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+def youtube_search_url(composer, title, subtitle=None):
+    query = " ".join(part for part in (composer, title, subtitle) if part)
+    parameters = urlencode({"search_query": query})
+    return f"https://www.youtube.com/results?{parameters}"
+
+
+# Link for a play button: the resolved video, or a search until there is one
+def youtube_url(video_id, composer, title, subtitle=None):
+    if video_id:
+        return watch_url(video_id)
+    return youtube_search_url(composer, title, subtitle)
+
+
+# The id of the first video a search finds, or None if it finds nothing
+def search(composer, title, subtitle):
+    response = upstream.get("youtube", search_url(composer, title, subtitle))
+    response.raise_for_status()
+    items = response.json().get("items", [])
+    return items[0]["id"]["videoId"] if items else None
+
+
+# search() for the search pool's threads, which have no app context
+def search_in(app, composer, title, subtitle):
+    with app.app_context():
+        return search(composer, title, subtitle)
+
+
+def store(found):
+    if not found:
+        return
+    now = time.time()
+    statement = insert(Recording).values(
+        [
+            {"natural_key": key, "video_id": video_id, "resolved_at": now}
+            for key, video_id in found.items()
+        ]
+    )
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[Recording.natural_key],
+            set_={
+                "video_id": statement.excluded.video_id,
+                "resolved_at": statement.excluded.resolved_at,
+            },
+        )
+    )
+    db.session.commit()
+
+    # Shared snapshots of libraries holding these pieces link to searches
+    piece_ids = db.session.scalars(
+        select(MusicPiece.id).where(MusicPiece.natural_key.in_(list(found)))
+    )
+    shares.mark_stale(sorted(libraries.holders(piece_ids)))
+
+
+# Search for a batch of pieces together and store what was found. Failed
+# searches aren't stored, so they are tried again on a later view.
+def resolve_batch(pieces):
+    queue = get_queue()
+    app = current_app._get_current_object()
+    futures = [
+        (key, search_pool.submit(search_in, app, composer, title, subtitle))
+        for key, composer, title, subtitle in pieces
+    ]
+    found = {}
+    for key, future in futures:
+        try:
+            found[key] = future.result()
+        except (*upstream.ERRORS, KeyError) as e:
+            print(f"Error resolving recording for piece {key}: {e}")
+            queue.count("errors")
+            continue
+        queue.count("found" if found[key] else "not_found")
+    store(found)
+    return found
+
+
+# Resolve library pieces a batch at a time, in the foreground
+def resolve(pieces, batch_size=BATCH_SIZE):
+    found = {}
+    pieces = iter(pieces)
+    while batch := list(islice(pieces, batch_size)):
+        found.update(
+            resolve_batch(
+                [
+                    (
+                        piece.natural_key,
+                        piece.composer,
+                        piece.title,
+                        piece.subtitle,
+                    )
+                    for piece in batch
+                ]
+            )
+        )
+    return found
+
+
+def work(app):
+    with app.app_context():
+        queue = get_queue()
+        try:
+            while batch := queue.take(BATCH_SIZE):
+                resolve_batch(batch)
+                queue.finish(piece[0] for piece in batch)
+        except Exception:
+            # Let a later view start a new worker
+            queue.stop()
+            raise
+        finally:
+            db.session.remove()
+
+
+# Queue pieces for resolution, starting the background worker if needed
+def enqueue(pieces):
+    if not pieces:
+        return
+    queue = get_queue()
+    if queue.add(pieces):
+        app = current_app._get_current_object()
+        queue.future = worker_pool.submit(work, app)
+
+
+# Wait for queued pieces to be resolved, e.g. in tests and the CLI
+def wait():
+    future = get_queue().future
+    if future is not None:
+        future.result()
+
+
+def stale(recording, now):
+    if recording.video_id:
+        ttl = current_app.config.get("RECORDING_TTL", DEFAULT_TTL)
+    else:
+        ttl = current_app.config.get(
+            "RECORDING_NEGATIVE_TTL", DEFAULT_NEGATIVE_TTL
+        )
+    return now - recording.resolved_at >= ttl
+
+
+# Video ids of (composer, title, subtitle) pieces by piece_key(), from one
+# query. With queue set, pieces not yet resolved, or due to be looked up
+# again, are queued; stale videos are still returned until they are
+# replaced.
+def video_ids(pieces, queue=True):
+    if not enabled():
+        return {}
+    pieces = {piece_key(*piece): piece for piece in pieces}
+    if not pieces:
+        return {}
+
+    recordings = db.session.scalars(
+        select(Recording).where(Recording.natural_key.in_(pieces))
+    ).all()
+    now = time.time()
+    known = {recording.natural_key: recording for recording in recordings}
+    if queue:
+        enqueue(
+            [
+                (key, *piece)
+                for key, piece in pieces.items()
+                if key not in known or stale(known[key], now)
+            ]
+        )
+    return {
+        recording.natural_key: recording.video_id
+        for recording in recordings
+        if recording.video_id
+    }
+
+
+# Video ids for library pieces, by piece id
+def for_pieces(pieces):
+    ids = video_ids(
+        (piece.composer, piece.title, piece.subtitle) for piece in pieces
+    )
+    return {
+        piece.id: ids[piece.natural_key]
+        for piece in pieces
+        if piece.natural_key in ids
+    }
+
+
+# Add each results page row's video id, or None. Results are only looked
+# up: searching for every work anyone browses would spend the API quota
+# meant for library pieces.
+def attach(rows):
+    ids = video_ids(
+        (
+            (row["composer_name"], row["title"], row["subtitle"])
+            for row in rows
+        ),
+        queue=False,
+    )
+    for row in rows:
+        row["video_id"] = ids.get(
+            piece_key(row["composer_name"], row["title"], row["subtitle"])
+        )
+    return rows
+
+
+# Library pieces without a recording, for `flask resolve_recordings`
+def unresolved_pieces(limit=None):
+    query = (
+        select(MusicPiece)
+        .outerjoin(Recording, Recording.natural_key == MusicPiece.natural_key)
+        .where(Recording.natural_key.is_(None))
+        .order_by(MusicPiece.id)
+        .limit(limit)
+    )
+    return db.session.scalars(query).all()
+
+
+def init_app(app):
+    app.add_template_global(youtube_url)
+
+
+def recording_metrics():
+    queue = get_queue()
+    with queue.lock:
+        return {**queue.counts, "pending": len(queue.pending)}
+
+
+metrics.register("recordings", recording_metrics)
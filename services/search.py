@@ -0,0 +1,176 @@
+from flask import render_template, request
+from sqlalchemy import select
+from database import db
+from models.musicpiece import piece_key
+from models.user import User
+from . import (
+    catalogue,
+    composer_names,
+    libraries,
+    openopus,
+    recordings,
+    upstream,
+)
+
+# Search results, filtered and paged on the server. A search is a list of
+# (composer_id, composer_name, works) for the selected composers, built
+# from the works catalogue, so a page can be recomputed cheaply from the
+# search parameters alone and the browser only ever holds one page. Works
+# the searching user has already saved are marked from a cached set of
+# their library's natural keys, so marking a page costs no queries per
+# work.
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+FILTERS = ("all", "popular", "recommended")
+
+
+# Look up the selected composers' works, noting any that can't be fetched
+def collect(composer_ids, genres):
+    names = composer_names.resolve(composer_ids)
+    results = []
+    failed_composers = []
+
+    # A composer that can't be fetched is reported, not fatal
+    for composer_id in composer_ids:
+        composer_name = names[composer_id]
+        try:
+            works = catalogue.works_for(composer_id, genres)
+        except upstream.ERRORS as e:
+            print(f"Error fetching works for composer {composer_id}: {e}")
+            failed_composers.append(
+                openopus.failed_composer_label(composer_id, composer_name)
+            )
+            continue
+        results.append((composer_id, composer_name, works))
+
+    return results, failed_composers
+
+
+# Like collect(), but from the catalogue and known composer names alone,
+# for when the app is too busy to call OpenOpus. Composers that aren't in
+# the catalogue are reported as failed.
+def collect_indexed(composer_ids, genres):
+    resolved, _ = composer_names.lookup(composer_ids)
+    names = composer_names.complete(composer_ids, resolved)
+    results = []
+    failed_composers = []
+    for composer_id in composer_ids:
+        works = catalogue.indexed_works(composer_id, genres)
+        if works is None:
+            failed_composers.append(
+                openopus.failed_composer_label(composer_id, names[composer_id])
+            )
+            continue
+        results.append((composer_id, names[composer_id], works))
+    return results, failed_composers
+
+
+# Sorted names of the composers with at least one matching work
+def composers_in(results):
+    return sorted(set(name for _, name, works in results if works))
+
+
+def total_works(results):
+    return sum(len(works) for _, _, works in results)
+
+
+# Shape a catalogue work for the results page
+def result_row(work, composer_id, composer_name):
+    return {
+        "title": work.title,
+        "genre": work.genre,
+        "subtitle": work.subtitle,
+        "popular": work.popular,
+        "recommended": work.recommended,
+        "composer_name": composer_name,
+        "composer_id": composer_id,
+    }
+
+
+def matches(results, filter, composer, title):
+    title = title.casefold()
+    for composer_id, composer_name, works in results:
+        if composer != "all" and composer_name != composer:
+            continue
+        for work in works:
+            if filter == "popular" and not work.popular:
+                continue
+            if filter == "recommended" and not work.recommended:
+                continue
+            if title and title not in work.title.casefold():
+                continue
+            yield work, composer_id, composer_name
+
+
+# Natural keys of the pieces in the named user's library, empty for a
+# user who hasn't saved anything yet
+def saved_keys(user_name):
+    if not user_name:
+        return frozenset()
+    user_id = db.session.scalar(
+        select(User.id).where(User.username == user_name)
+    )
+    return frozenset() if user_id is None else libraries.natural_keys(user_id)
+
+
+# One page of the works matching the filters, plus the total count. Each
+# work is marked as saved if its natural key is in `saved`.
+def page(
+    results,
+    filter="all",
+    composer="all",
+    title="",
+    offset=0,
+    limit=PAGE_SIZE,
+    saved=frozenset(),
+):
+    total = 0
+    rows = []
+    for work, composer_id, composer_name in matches(
+        results, filter, composer, title
+    ):
+        if offset <= total < offset + limit:
+            rows.append(result_row(work, composer_id, composer_name))
+        total += 1
+    for row in rows:
+        row["saved"] = (
+            piece_key(row["composer_name"], row["title"], row["subtitle"])
+            in saved
+        )
+    recordings.attach(rows)
+    return {"total": total, "offset": offset, "limit": limit, "works": rows}
+
+
+# Read and validate the paging and filter parameters of a request
+def page_args(args):
+    filter = args.get("filter", "all")
+    try:
+        offset = max(0, int(args.get("offset", 0)))
+        limit = min(MAX_PAGE_SIZE, max(1, int(args.get("limit", PAGE_SIZE))))
+    except ValueError:
+        offset, limit = 0, PAGE_SIZE
+    return {
+        "filter": filter if filter in FILTERS else "all",
+        "composer": args.get("composer") or "all",
+        "title": args.get("q", ""),
+        "offset": offset,
+        "limit": limit,
+    }
+
+
+# Render the results page with the first page of works. Further pages and
+# filtering are fetched from /search/works by the page's script.
+def render_results(name, results, failed_composers):
+    return render_template(
+        "results.html",
+        name=name,
+        page=page(results, saved=saved_keys(name)),
+        total_works=total_works(results),
+        composers=composers_in(results),
+        failed_composers=failed_composers,
+        query={
+            "composer_id": request.form.getlist("composer_id"),
+            "genres": request.form.getlist("genres"),
+        },
+    )
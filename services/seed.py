@@ -0,0 +1,165 @@
+import math
+import random
+import time
+from itertools import accumulate
+from sqlalchemy import bindparam, func, insert, select
+from database import db
+from models.musicpiece import MusicPiece, piece_key
+from models.user import User
+from models.userlibrary import UserLibrary
+from . import composers, invalidation, libraries, openopus
+
+# Synthetic users, pieces and libraries for benchmarking the library
+# routes at scale. Piece popularity follows a Zipf distribution, so a few
+# pieces are in most libraries and most pieces are in few, and library
+# sizes are log-normal: most users save a handful of pieces and a long
+# tail save thousands. Rows go in with bulk inserts of BATCH_SIZE rows.
+
+BATCH_SIZE = 10_000
+
+COMPOSERS = [
+    "Johann Sebastian Bach",
+    "Wolfgang Amadeus Mozart",
+    "Ludwig van Beethoven",
+    "Frédéric Chopin",
+    "Johannes Brahms",
+    "Pyotr Ilyich Tchaikovsky",
+    "Claude Debussy",
+    "Franz Schubert",
+    "Antonín Dvořák",
+    "George Frideric Handel",
+    "Felix Mendelssohn",
+    "Robert Schumann",
+    "Gustav Mahler",
+    "Sergei Rachmaninoff",
+    "Joseph Haydn",
+    "Antonio Vivaldi",
+]
+
+PIECE_COLUMNS = [
+    "id",
+    "composer_id",
+    "title",
+    "subtitle",
+    "genre",
+    "popular",
+    "recommended",
+    "natural_key",
+]
+
+FORMS = ["Sonata", "Symphony", "Concerto", "Nocturne", "Quartet", "Mass"]
+
+
+def next_id(column):
+    return (db.session.scalar(select(func.max(column))) or 0) + 1
+
+
+# Insert rows of values in `columns` order with the driver's executemany,
+# compiling the statement once and skipping SQLAlchemy's per-row parameter
+# processing, which otherwise takes most of the time
+def bulk_insert(model, columns, rows, session=None):
+    connection = (session or db.session).connection()
+    compiled = (
+        insert(model.__table__)
+        .values({column: bindparam(column) for column in columns})
+        .compile(dialect=connection.dialect)
+    )
+    if compiled.positional:
+        if list(compiled.positiontup) != columns:
+            order = [columns.index(name) for name in compiled.positiontup]
+            rows = [tuple(row[i] for i in order) for row in rows]
+    else:
+        rows = [dict(zip(columns, row)) for row in rows]
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.exec_driver_sql(
+            str(compiled), rows[start : start + BATCH_SIZE]
+        )
+
+
+# Library links, a batch at a time, for users first_user..first_user+users
+def library_links(rng, users, first_user, piece_ids, cum_weights, mean):
+    sigma = 1.0
+    mu = math.log(mean) - sigma**2 / 2
+    batch = []
+    for user_id in range(first_user, first_user + users):
+        size = min(
+            len(piece_ids), max(1, round(rng.lognormvariate(mu, sigma)))
+        )
+        saved = set()
+        # Popular pieces get drawn repeatedly, so draw again for the rest
+        for _ in range(3):
+            saved.update(
+                rng.choices(
+                    piece_ids, cum_weights=cum_weights, k=size - len(saved)
+                )
+            )
+            if len(saved) >= size:
+                break
+        batch.extend((user_id, piece_id) for piece_id in saved)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Add synthetic data alongside whatever the database already holds
+def seed(users, pieces, links, skew=1.1, seed=0):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    first_user = next_id(User.id)
+    first_piece = next_id(MusicPiece.id)
+
+    bulk_insert(
+        User,
+        ["id", "username"],
+        [
+            (user_id, f"user{user_id}")
+            for user_id in range(first_user, first_user + users)
+        ],
+    )
+
+    popular = max(1, pieces // 20)
+    composer_ids = composers.ids_for(COMPOSERS)
+    rows = []
+    for rank in range(pieces):
+        composer = COMPOSERS[rank % len(COMPOSERS)]
+        title = f"{FORMS[rank % len(FORMS)]} No. {rank // 96 + 1}"
+        subtitle = f"Op. {first_piece + rank}"
+        rows.append(
+            (
+                first_piece + rank,
+                composer_ids[composer],
+                title,
+                subtitle,
+                openopus.GENRES[rank % len(openopus.GENRES)],
+                rank < popular,
+                rank % 7 == 0,
+                piece_key(composer, title, subtitle),
+            )
+        )
+    bulk_insert(MusicPiece, PIECE_COLUMNS, rows)
+
+    # The piece at rank r is saved in proportion to 1 / (r + 1) ** skew
+    piece_ids = range(first_piece, first_piece + pieces)
+    cum_weights = list(
+        accumulate(1 / (rank + 1) ** skew for rank in range(pieces))
+    )
+    added = 0
+    for batch in library_links(
+        rng, users, first_user, piece_ids, cum_weights, links / users
+    ):
+        for store, rows in libraries.partition(batch):
+            bulk_insert(
+                UserLibrary, ["user_id", "music_piece_id"], rows, store
+            )
+        added += len(batch)
+    libraries.commit()
+    invalidation.publish([("library", None)])
+
+    return {
+        "users": users,
+        "pieces": pieces,
+        "links": added,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,240 @@
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+from flask import (
+    abort,
+    current_app,
+    has_request_context,
+    render_template,
+    request,
+    send_from_directory,
+    url_for,
+)
+from database import db
+from middleware import assets, compression
+from models.user import User
+from . import invalidation, libraries, metrics, recordings
+
+# Public, read-only snapshots of user libraries for share links. A share
+# link carries the user's id signed with the app's secret, so it can be
+# checked without the database. Each library's page is rendered to
+# SHARE_PATH (with .br/.gz copies) on the first visit after it changes,
+# and later visits just send that file: traffic to a shared library does
+# no database work. Changing a library, or finding a recording for one of
+# its pieces, only deletes its snapshot, so edits don't wait on rendering
+# and compressing it. Library changes, and snapshots marked stale for
+# other reasons, are in the change log, so a render that overlapped one in
+# any worker is redone rather than putting back the page from before the
+# change. A link whose snapshot is missing (a new link, a
+# changed library, or after a deploy cleared them) is rendered on the
+# next visit.
+
+SHARE_MAX_AGE = 60
+# Renders of a snapshot before giving up on one not marked stale meanwhile
+RENDER_ATTEMPTS = 3
+TOKEN_PATTERN = re.compile(r"^(\d+)-([0-9a-f]{16})$")
+
+counts_lock = threading.Lock()
+
+
+# Snapshots served and rendered by this app
+def count(name):
+    with counts_lock:
+        counts = current_app.extensions.setdefault(
+            "share_counts", {"served": 0, "rendered": 0}
+        )
+        counts[name] += 1
+
+
+# The change log's version when a user's snapshot last went stale
+def generation(user_id):
+    return invalidation.version(("library", "share"), user_id)
+
+
+def share_path():
+    return current_app.config.get(
+        "SHARE_PATH", os.path.join(current_app.instance_path, "shares")
+    )
+
+
+# SECRET_KEY, or a random secret kept with the snapshots if none is set
+def secret():
+    key = current_app.config.get("SECRET_KEY")
+    if key:
+        return key.encode() if isinstance(key, str) else key
+
+    key = current_app.extensions.get("share_secret")
+    if key is None:
+        path = os.path.join(share_path(), ".secret")
+        if not os.path.exists(path):
+            os.makedirs(share_path(), exist_ok=True)
+            write_atomic(path, secrets.token_hex(32).encode())
+        with open(path, "rb") as file:
+            key = current_app.extensions["share_secret"] = file.read()
+    return key
+
+
+def signature(user_id):
+    digest = hmac.new(secret(), f"share:{user_id}".encode(), hashlib.sha256)
+    return digest.hexdigest()[:16]
+
+
+def token(user_id):
+    return f"{user_id}-{signature(user_id)}"
+
+
+# The user id in a share token, or None if the token isn't genuine
+def user_id_for(share_token):
+    match = TOKEN_PATTERN.match(share_token)
+    if match is None:
+        return None
+    user_id = int(match.group(1))
+    if not hmac.compare_digest(match.group(2), signature(user_id)):
+        return None
+    return user_id
+
+
+def share_url(user_id):
+    return url_for(
+        "library.shared_library", share_token=token(user_id), _external=True
+    )
+
+
+def write_atomic(path, data):
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+
+def render(user):
+    pieces = libraries.pieces(user.id)
+    return render_template(
+        "library_share.html",
+        user_name=user.username,
+        pieces=pieces,
+        videos=recordings.for_pieces(pieces),
+    )
+
+
+# Render a user's snapshot and its compressed copies. A snapshot marked
+# stale while it was rendered (say, a recording for one of its pieces was
+# found meanwhile, by any worker) is rendered again. The version is read
+# again only once the files are written: marking stale publishes before it
+# deletes, so a change not seen by then deletes these files after. Returns
+# False if the user doesn't exist.
+def refresh(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        return False
+
+    for _ in range(RENDER_ATTEMPTS):
+        rendered = generation(user_id)
+        write(user)
+        if generation(user_id) == rendered:
+            return True
+    # Still changing: leave it to the next visit
+    remove(user_id)
+    return True
+
+
+def write(user):
+    share_token = token(user.id)
+    if has_request_context():
+        html = render(user)
+    else:
+        # Rendering uses url_for, which needs a request outside of one
+        path = f"/library/share/{share_token}"
+        with current_app.test_request_context(path):
+            html = render(user)
+
+    data = html.encode("utf-8")
+    os.makedirs(share_path(), exist_ok=True)
+    base = os.path.join(share_path(), f"{share_token}.html")
+    # Snapshots are rewritten after every library edit, so they get the
+    # quicker levels used for responses, not the static files' maximum
+    for encoding, suffix in assets.ENCODINGS:
+        if encoding == "br" and compression.brotli is None:
+            continue
+        write_atomic(base + suffix, compression.compress(data, encoding))
+    write_atomic(base, data)
+    count("rendered")
+
+
+# Delete users' snapshots, so they are rendered again on their next visit.
+# Pass published=True if their library changes were just published, which
+# already tells renders in other workers.
+def mark_stale(user_ids, published=False):
+    user_ids = list(user_ids)
+    if not published:
+        invalidation.publish([("share", user_id) for user_id in user_ids])
+    for user_id in user_ids:
+        remove(user_id)
+
+
+def remove(user_id):
+    base = os.path.join(share_path(), f"{token(user_id)}.html")
+    # The page first, so a stale page stops being served soonest
+    for suffix in ("", *(suffix for _, suffix in assets.ENCODINGS)):
+        try:
+            os.remove(base + suffix)
+        except FileNotFoundError:
+            pass
+
+
+# Delete every snapshot, e.g. after the static assets they link to change
+def clear():
+    path = share_path()
+    if not os.path.isdir(path):
+        return
+    for name in os.listdir(path):
+        if name.endswith((".html", ".html.br", ".html.gz")):
+            os.remove(os.path.join(path, name))
+
+
+# The response for a share link, from its snapshot
+def serve(share_token):
+    user_id = user_id_for(share_token)
+    if user_id is None:
+        abort(404)
+
+    filename = f"{share_token}.html"
+    if not os.path.exists(os.path.join(share_path(), filename)):
+        if not refresh(user_id):
+            abort(404)
+
+    encoding = next(
+        (
+            (encoding, suffix)
+            for encoding, suffix in assets.ENCODINGS
+            if request.accept_encodings[encoding]
+            and os.path.exists(os.path.join(share_path(), filename + suffix))
+        ),
+        None,
+    )
+    if encoding is None:
+        response = send_from_directory(share_path(), filename)
+    else:
+        response = send_from_directory(
+            share_path(), filename + encoding[1], mimetype="text/html"
+        )
+        response.headers["Content-Encoding"] = encoding[0]
+
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get(
+        "SHARE_MAX_AGE", SHARE_MAX_AGE
+    )
+    count("served")
+    return response
+
+
+def share_metrics():
+    with counts_lock:
+        return dict(current_app.extensions.get("share_counts", {}))
+
+
+metrics.register("shares", share_metrics)
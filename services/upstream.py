@@ -0,0 +1,110 @@
+import asyncio
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
+import requests
+from flask import current_app
+from .breaker import CircuitOpenError, get_breaker
+
+# GET requests to upstream APIs, guarded by the upstream's circuit breaker.
+# Every request has a timeout, and a second (hedged) request can be sent
+# when the first one is slower than usual; whichever answers first wins.
+
+# Connect and read timeouts, in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Errors that mean an upstream call didn't produce a usable response
+ERRORS = (requests.RequestException, ValueError)
+ASYNC_ERRORS = (httpx.HTTPError, CircuitOpenError, ValueError)
+
+hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+
+def timeout():
+    return current_app.config.get("UPSTREAM_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+# Seconds to wait before hedging, or None to never hedge. "auto" hedges
+# once a request outlives the upstream's recent 95th percentile latency.
+def hedge_delay(breaker):
+    setting = current_app.config.get("UPSTREAM_HEDGE_AFTER")
+    if setting == "auto":
+        return breaker.latency_percentile(0.95)
+    return setting
+
+
+def get(upstream, url):
+    breaker = get_breaker(upstream)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit for {upstream} is open")
+
+    started = time.monotonic()
+    try:
+        response = fetch(breaker, url, timeout(), hedge_delay(breaker))
+    except Exception:
+        breaker.record(True, time.monotonic() - started)
+        raise
+    breaker.record(response.status_code >= 500, time.monotonic() - started)
+    return response
+
+
+def fetch(breaker, url, request_timeout, delay):
+    if delay is None:
+        return requests.get(url, timeout=request_timeout)
+
+    first = hedge_pool.submit(requests.get, url, timeout=request_timeout)
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result()
+
+    breaker.count_hedge()
+    second = hedge_pool.submit(requests.get, url, timeout=request_timeout)
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+    return first.result()  # Both failed, so raise the first error
+
+
+# Async counterpart of get(), for the async routes
+async def get_async(client, upstream, url):
+    breaker = get_breaker(upstream)
+    if not breaker.allow():
+        raise CircuitOpenError(f"Circuit for {upstream} is open")
+
+    started = time.monotonic()
+    try:
+        response = await fetch_async(
+            client, breaker, url, hedge_delay(breaker)
+        )
+    except Exception:
+        breaker.record(True, time.monotonic() - started)
+        raise
+    breaker.record(response.status_code >= 500, time.monotonic() - started)
+    return response
+
+
+async def fetch_async(client, breaker, url, delay):
+    if delay is None:
+        return await client.get(url)
+
+    first = asyncio.ensure_future(client.get(url))
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    breaker.count_hedge()
+    second = asyncio.ensure_future(client.get(url))
+    pending = {first, second}
+    while pending:
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result()
+    return first.result()  # Both failed, so raise the first error
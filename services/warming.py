@@ -0,0 +1,242 @@
+import fcntl
+import os
+import threading
+import time
+from flask import current_app
+from database import db
+from . import (
+    aggregates,
+    catalogue,
+    composer_names,
+    libraries,
+    metrics,
+    openopus,
+    upstream,
+)
+from .breaker import CircuitOpenError
+
+# Keeps the works of the composers people search for in the catalogue, so
+# their searches don't wait on OpenOpus after a deploy or once the works
+# expire. A pass picks the composers most often found in libraries, then
+# OpenOpus's popular composers, and fetches those that aren't indexed or
+# will expire within CATALOGUE_WARM_AHEAD seconds: at most
+# CATALOGUE_WARM_BUDGET of them, at most CATALOGUE_WARM_RATE a second.
+# Each composer's works cover every genre, so popular genres are warmed
+# along with them.
+#
+# `flask warm_catalogue` runs one pass and saves the catalogue. With
+# CATALOGUE_WARM_INTERVAL set, each worker also starts a background thread
+# that wakes that often, but only the worker holding a lock on the
+# catalogue's lock file warms and saves it, so the budget and rate limit
+# OpenOpus load across every worker. The others just load the catalogue
+# whenever it has been saved since, and take over the lock if that worker
+# exits.
+
+DEFAULT_BUDGET = 50
+DEFAULT_RATE = 2.0
+DEFAULT_AHEAD = 60 * 60
+
+
+class Warmer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        # Modification time of the saved catalogue last loaded
+        self.loaded = None
+        # The locked lock file, while this process is the one warming
+        self.lock_file = None
+        self.counts = {"passes": 0, "warmed": 0, "errors": 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+
+def get_warmer():
+    return current_app.extensions.setdefault("catalogue_warmer", Warmer())
+
+
+def popular_composer_ids():
+    response = upstream.get("openopus", openopus.popular_composers_url())
+    response.raise_for_status()
+    composers = response.json().get("composers", [])
+    composer_names.remember(composers)
+    return [str(composer["id"]) for composer in composers]
+
+
+# OpenOpus ids of the composers most saved in libraries, most saved first.
+# Composers added without an OpenOpus id have no works to warm.
+def library_composer_ids(limit):
+    return [
+        str(composer.openopus_id)
+        for composer, _ in aggregates.top_composers(limit)
+        if composer.openopus_id is not None
+    ]
+
+
+# Whether a composer's works are missing or expire within `ahead` seconds
+def due(composer_id, ahead):
+    entry = catalogue.get_index().composers.get(composer_id)
+    return (
+        entry is None
+        or time.time() - entry.fetched_at > catalogue.ttl() - ahead
+    )
+
+
+# The composers to warm, most searched first, at most `budget` of them
+def plan(budget, ahead):
+    candidates = library_composer_ids(budget)
+    try:
+        candidates += popular_composer_ids()
+    except upstream.ERRORS as e:
+        print(f"Error listing popular composers to warm: {e}")
+    return [
+        composer_id
+        for composer_id in dict.fromkeys(candidates)
+        if due(composer_id, ahead)
+    ][:budget]
+
+
+# Load the saved catalogue if it has been saved since it was last loaded,
+# by the warming worker or `flask warm_catalogue`
+def load_saved():
+    warmer = get_warmer()
+    path = catalogue.catalogue_path()
+    if not os.path.exists(path):
+        return
+    modified = os.path.getmtime(path)
+    if warmer.loaded != modified:
+        catalogue.load(path)
+        warmer.loaded = modified
+
+
+# Fetch the planned composers' works, pacing the requests. Returns the
+# composers warmed. Stops early if OpenOpus's circuit opens or the warmer
+# is stopped.
+def warm(budget=None, rate=None, ahead=None):
+    config = current_app.config
+    budget = config["CATALOGUE_WARM_BUDGET"] if budget is None else budget
+    rate = config["CATALOGUE_WARM_RATE"] if rate is None else rate
+    ahead = config["CATALOGUE_WARM_AHEAD"] if ahead is None else ahead
+    warmer = get_warmer()
+
+    warmed = []
+    for position, composer_id in enumerate(plan(budget, ahead)):
+        if position and warmer.stopping.wait(1 / rate):
+            break
+        try:
+            catalogue.refresh_composer(composer_id)
+        except CircuitOpenError as e:
+            print(f"Stopped warming the catalogue: {e}")
+            warmer.count("errors")
+            break
+        except upstream.ERRORS as e:
+            print(f"Error warming works for composer {composer_id}: {e}")
+            warmer.count("errors")
+            continue
+        warmed.append(composer_id)
+    warmer.count("passes")
+    warmer.count("warmed", len(warmed))
+    return warmed
+
+
+# Whether this process is the one warming the catalogue, taking the lock
+# if no other process holds it. The lock goes with the process, so
+# another worker takes over if this one exits.
+def hold_lock():
+    warmer = get_warmer()
+    if warmer.lock_file is not None:
+        return True
+    path = catalogue.catalogue_path() + ".lock"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    warmer.lock_file = lock_file
+    return True
+
+
+def release_lock():
+    warmer = get_warmer()
+    if warmer.lock_file is not None:
+        warmer.lock_file.close()
+        warmer.lock_file = None
+
+
+# Save the catalogue for the other workers, without loading it back here
+def save():
+    catalogue.save()
+    get_warmer().loaded = os.path.getmtime(catalogue.catalogue_path())
+
+
+def run(app):
+    with app.app_context():
+        warmer = get_warmer()
+        interval = app.config["CATALOGUE_WARM_INTERVAL"]
+        try:
+            while not warmer.stopping.is_set():
+                try:
+                    load_saved()
+                    if hold_lock():
+                        warm()
+                        save()
+                except Exception as e:
+                    # Try again next time rather than stop warming
+                    print(f"Error warming the catalogue: {e}")
+                    warmer.count("errors")
+                finally:
+                    libraries.remove()
+                    db.session.remove()
+                warmer.stopping.wait(interval)
+        finally:
+            release_lock()
+
+
+# Start this process's warming thread, if CATALOGUE_WARM_INTERVAL is set.
+# Call it in each worker: a thread started before forking doesn't run in
+# the workers, and every worker loads the saved catalogue.
+def start(app):
+    if not app.config.get("CATALOGUE_WARM_INTERVAL"):
+        return
+    with app.app_context():
+        warmer = get_warmer()
+    with warmer.lock:
+        if warmer.thread is not None and warmer.thread.is_alive():
+            return
+        warmer.stopping.clear()
+        warmer.thread = threading.Thread(
+            target=run, args=(app,), name="catalogue-warming", daemon=True
+        )
+        warmer.thread.start()
+
+
+def stop(app, timeout=None):
+    with app.app_context():
+        warmer = get_warmer()
+    warmer.stopping.set()
+    if warmer.thread is not None:
+        warmer.thread.join(timeout)
+
+
+def init_app(app):
+    app.config.setdefault("CATALOGUE_WARM_BUDGET", DEFAULT_BUDGET)
+    app.config.setdefault("CATALOGUE_WARM_RATE", DEFAULT_RATE)
+    app.config.setdefault("CATALOGUE_WARM_AHEAD", DEFAULT_AHEAD)
+    app.config.setdefault("CATALOGUE_WARM_INTERVAL", 0)
+
+
+def warming_metrics():
+    warmer = get_warmer()
+    with warmer.lock:
+        return {
+            **warmer.counts,
+            "running": warmer.thread is not None and warmer.thread.is_alive(),
+            "warming": warmer.lock_file is not None,
+        }
+
+
+metrics.register("warming", warming_metrics)
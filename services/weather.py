@@ -0,0 +1,105 @@
+from flask import current_app
+from . import llm, llm_usage
+
+# Helpers shared by the sync and async weather-mood views. Suggestions are
+# cached by prompt for SUGGESTION_TTL seconds, so visitors who see the same
+# weather share one Gemini call. The latest weather and suggestion are also
+# kept, to serve when the page is too busy to call WeatherAPI or Gemini.
+
+WEATHER_API_URL = "http://api.weatherapi.com/v1"
+DEFAULT_SUGGESTION_TTL = 30 * 60
+SITE = "weather_mood"
+
+
+def current_weather_url(location="London"):
+    base_url = current_app.config.get("WEATHER_API_URL", WEATHER_API_URL)
+    return (
+        f"{base_url}/current.json"
+        f"?key={current_app.config['WEATHER_API_KEY']}&q={location}&aqi=no"
+    )
+
+
+# Build the Gemini prompt for a weather-based music suggestion
+def suggestion_prompt(weather_data, composers):
+    weather_current = weather_data.get("current", {})
+    weather_condition = weather_current.get("condition", {})
+    weather_desc = weather_condition.get("text", "")
+    temp = weather_current.get("temp_c", 0)
+
+    composer_names = [composer.get("complete_name") for composer in composers]
+
+    return (
+        f"Given that it's {weather_desc} and {temp}°C in London today, "
+        "suggest a classical music piece that would complement this weather. "
+        f"Consider selecting from works by these composers: {', '.join(composer_names)}. "
+        "Explain briefly why this piece fits the current weather and mood. Keep your response concise but engaging."
+    )
+
+
+def suggestion_cache():
+    cache = current_app.extensions.get("suggestion_cache")
+    if cache is None:
+        cache = llm.TTLCache(
+            current_app.config.get("SUGGESTION_TTL", DEFAULT_SUGGESTION_TTL)
+        )
+        current_app.extensions["suggestion_cache"] = cache
+    return cache
+
+
+def remember(weather_data, suggestion):
+    current_app.extensions["latest_weather_mood"] = {
+        "weather": weather_data,
+        "suggestion": suggestion,
+    }
+
+
+# The weather and suggestion last shown, or None for both
+def latest():
+    return current_app.extensions.get(
+        "latest_weather_mood", {"weather": None, "suggestion": None}
+    )
+
+
+# Gemini's music suggestion for the weather, from the cache if possible
+def suggest(weather_data, composers):
+    prompt = suggestion_prompt(weather_data, composers)
+    suggestion = suggestion_cache().get(prompt)
+    if suggestion is None:
+        suggestion = llm.generate(prompt, SITE)
+        suggestion_cache().put(prompt, suggestion)
+    else:
+        llm_usage.record_cache_hit(SITE)
+    remember(weather_data, suggestion)
+    return suggestion
+
+
+async def suggest_async(weather_data, composers):
+    prompt = suggestion_prompt(weather_data, composers)
+    suggestion = suggestion_cache().get(prompt)
+    if suggestion is None:
+        suggestion = await llm.generate_async(prompt, SITE)
+        suggestion_cache().put(prompt, suggestion)
+    else:
+        llm_usage.record_cache_hit(SITE)
+    remember(weather_data, suggestion)
+    return suggestion
+
+
+# The suggestion as it streams from Gemini, or from the cache. Only a
+# completed stream is cached.
+def stream_suggestion(weather_data, composers):
+    prompt = suggestion_prompt(weather_data, composers)
+    suggestion = suggestion_cache().get(prompt)
+    if suggestion is not None:
+        llm_usage.record_cache_hit(SITE)
+        remember(weather_data, suggestion)
+        yield suggestion
+        return
+
+    chunks = []
+    for chunk in llm.stream(prompt, SITE):
+        chunks.append(chunk)
+        yield chunk
+    suggestion = "".join(chunks)
+    suggestion_cache().put(prompt, suggestion)
+    remember(weather_data, suggestion)
@@ -0,0 +1,212 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import pytest
+from unittest.mock import patch
+from app import create_app
+from Blueprint.library import BUSY_DESCRIPTION
+from database import db
+from middleware import admission
+from middleware.admission import RouteGroup
+from models.musicpiece import MusicPiece
+from services import catalogue, composer_names, descriptions, llm, weather
+
+WEATHER = {
+    "location": {"name": "London"},
+    "current": {"condition": {"text": "Rain"}, "temp_c": 9},
+}
+
+
+# Every expensive route is over budget, so each request is degraded
+@pytest.fixture(params=[False, True], ids=["sync", "async"])
+def app(request):
+    test_app = create_app(testing=True, async_mode=request.param)
+    test_app.config.update(
+        {
+            "LLM_BACKEND": "fake",
+            "ADMISSION_LIMITS": {"weather": 0, "search": 0, "piece": 0},
+            "ADMISSION_QUEUE_TIMEOUT": 0,
+        }
+    )
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Upstream calls would mean a degraded request still did the slow work
+@pytest.fixture
+def no_upstream():
+    with patch(
+        "services.upstream.get", side_effect=AssertionError("upstream")
+    ), patch(
+        "services.upstream.get_async", side_effect=AssertionError("upstream")
+    ):
+        yield
+
+
+def test_group_admits_up_to_its_limit():
+    group = RouteGroup(limit=1, queue_depth=1, per_user=1)
+
+    assert group.acquire("alice", timeout=0)
+    assert not group.acquire("bob", timeout=0)
+    group.release("alice")
+    assert group.acquire("bob", timeout=0)
+
+    assert group.snapshot() == {
+        "limit": 1,
+        "active": 1,
+        "waiting": 0,
+        "admitted": 2,
+        "queued": 1,
+        "degraded": 1,
+        "user_limited": 0,
+    }
+
+
+def test_full_queue_is_shed_without_waiting():
+    group = RouteGroup(limit=1, queue_depth=0, per_user=1)
+    group.acquire("alice", timeout=0)
+
+    # A queue would make this wait a minute
+    assert not group.acquire("bob", timeout=60)
+    assert group.snapshot()["queued"] == 0
+
+
+def test_one_user_cannot_take_every_slot():
+    group = RouteGroup(limit=3, queue_depth=3, per_user=1)
+
+    assert group.acquire("heavy", timeout=0)
+    assert not group.acquire("heavy", timeout=60)
+    assert group.acquire("light", timeout=0)
+    assert group.snapshot()["user_limited"] == 1
+
+
+def test_queued_request_gets_a_released_slot():
+    group = RouteGroup(limit=1, queue_depth=1, per_user=1)
+    group.acquire("alice", timeout=0)
+    admitted = []
+    waiter = threading.Thread(
+        target=lambda: admitted.append(group.acquire("bob", timeout=5))
+    )
+    waiter.start()
+
+    while group.snapshot()["waiting"] == 0:
+        pass
+    group.release("alice")
+    waiter.join()
+
+    assert admitted == [True]
+
+
+def test_busy_piece_page_skips_gemini(client):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": "Bach",
+            "title": "Goldberg Variations",
+            "genre": "Keyboard",
+        },
+    )
+    piece = MusicPiece.query.one()
+
+    body = client.get(f"/library/{piece.id}?user_name=alice").get_data()
+    assert BUSY_DESCRIPTION.encode() in body
+    assert llm.get_model().prompts == []
+
+    # A description that's already stored is still shown
+    descriptions.store({piece.id: "A stored description"})
+    body = client.get(f"/library/{piece.id}?user_name=alice").get_data()
+    assert b"A stored description" in body
+
+
+def test_busy_weather_page_shows_the_last_suggestion(client, no_upstream):
+    weather.remember(WEATHER, "Chopin's Raindrop Prelude")
+
+    body = client.get("/weather-mood").get_data()
+
+    assert b"Rain" in body
+    assert b"Chopin's Raindrop Prelude" in body
+
+
+def test_busy_search_uses_the_catalogue(client, no_upstream):
+    catalogue.get_index().add(
+        "1", [catalogue.Work("Sonata", "", "Keyboard", True, False)]
+    )
+    composer_names.remember([{"id": "1", "complete_name": "Mozart"}])
+
+    body = client.post(
+        "/search",
+        data={
+            "name": "alice",
+            "composer_id": ["1", "2"],
+            "genres": ["Keyboard"],
+        },
+    ).get_data()
+
+    assert b"Sonata" in body
+    assert b"composer 2" in body
+
+
+def test_cheap_routes_are_not_limited(client):
+    assert client.get("/").status_code == 200
+    assert client.get("/library/?user_name=alice").status_code == 200
+
+
+def test_limiter_state_is_in_metrics(client, no_upstream):
+    client.get("/weather-mood")
+
+    report = client.get("/metrics").get_json()["admission"]
+
+    assert report["weather"]["degraded"] == 1
+    assert report["weather"]["limit"] == 0
+    assert report["search"]["admitted"] == 0
+
+
+def test_clients_are_told_apart_by_address(app):
+    with app.test_request_context(
+        "/search?user_name=mallory",
+        headers={"X-Forwarded-For": "10.0.0.9"},
+        environ_base={"REMOTE_ADDR": "192.0.2.1"},
+    ):
+        assert admission.current_user() == "192.0.2.1"
+
+
+def test_deleting_a_piece_is_not_limited(client):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": "Bach",
+            "title": "Goldberg Variations",
+            "genre": "Keyboard",
+        },
+    )
+    piece = MusicPiece.query.one()
+
+    client.post(
+        f"/library/{piece.id}",
+        data={"user_name": "alice", "submit_button": "delete"},
+    )
+
+    report = client.get("/metrics").get_json()["admission"]
+    assert report["piece"]["degraded"] == 0
+
+
+# Behind an untrusted proxy every client shares one address
+def test_one_address_may_use_every_slot_by_default():
+    app = create_app(testing=True)
+    app.config["ADMISSION_LIMITS"] = {"search": 3}
+    with app.app_context():
+        group = admission.groups()["search"]
+
+    assert all(group.acquire("10.0.0.1", timeout=0) for _ in range(3))
@@ -0,0 +1,161 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+import pytest
+from unittest.mock import patch
+from app import create_app
+from database import db
+from models.librarystats import (
+    ComposerStats,
+    GenreStats,
+    PieceCooccurrence,
+    PieceStats,
+)
+from models.musicpiece import MusicPiece
+from services import aggregates
+
+PIECES = [
+    ("Bach", "Mass in B minor", "Choral"),
+    ("Bach", "Goldberg Variations", "Keyboard"),
+    ("Chopin", "Nocturne", "Keyboard"),
+    ("Mozart", "Requiem", "Choral"),
+]
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add(client, user_name, index):
+    composer, title, genre = PIECES[index]
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": user_name,
+            "composer_name": composer,
+            "title": title,
+            "genre": genre,
+        },
+    )
+
+
+def remove(client, user_name, index):
+    piece = MusicPiece.query.filter_by(title=PIECES[index][1]).one()
+    client.post(
+        f"/library/{piece.id}",
+        data={"user_name": user_name, "submit_button": "delete"},
+    )
+
+
+# Every aggregate, as plain values, for comparing with a rebuild
+def snapshot():
+    return {
+        "pieces": {
+            (row.music_piece.title, row.saves)
+            for row in PieceStats.query.all()
+        },
+        "composers": {
+            (row.composer.name, row.saves) for row in ComposerStats.query.all()
+        },
+        "genres": {(row.genre, row.saves) for row in GenreStats.query.all()},
+        "pairs": {
+            (row.music_piece_id, row.other_piece_id, row.users)
+            for row in PieceCooccurrence.query.all()
+        },
+    }
+
+
+def assert_matches_rebuild():
+    incremental = snapshot()
+    aggregates.rebuild()
+    assert incremental == snapshot()
+
+
+def test_saves_update_counts(client):
+    add(client, "alice", 0)
+    add(client, "alice", 1)
+    add(client, "bob", 0)
+    add(client, "bob", 0)
+
+    response = client.get("/library/stats").json
+    assert response["pieces"][0]["title"] == "Mass in B minor"
+    assert response["pieces"][0]["saves"] == 2
+    assert response["composers"] == [{"composer": "Bach", "saves": 3}]
+    assert {"genre": "Keyboard", "saves": 1} in response["genres"]
+    assert_matches_rebuild()
+
+
+def test_also_saved(client):
+    add(client, "alice", 0)
+    add(client, "alice", 1)
+    add(client, "bob", 0)
+    add(client, "bob", 1)
+    add(client, "bob", 2)
+
+    mass = MusicPiece.query.filter_by(title="Mass in B minor").one()
+    also = client.get(f"/library/{mass.id}/also_saved").json
+    assert [(piece["title"], piece["users"]) for piece in also] == [
+        ("Goldberg Variations", 2),
+        ("Nocturne", 1),
+    ]
+
+    with patch("Blueprint.library.generate_piece_description") as describe:
+        describe.return_value = "A mass."
+        page = client.get(f"/library/{mass.id}?user_name=alice")
+    assert b"Saved in:</strong> 2 libraries" in page.data
+    assert b"Goldberg Variations by Bach" in page.data
+
+
+def test_removals_update_counts(client):
+    for index in range(3):
+        add(client, "alice", index)
+        add(client, "bob", index)
+    remove(client, "alice", 1)
+    remove(client, "bob", 1)
+
+    titles = {row.music_piece.title for row in PieceStats.query.all()}
+    assert "Goldberg Variations" not in titles
+    assert_matches_rebuild()
+
+
+# Test that libraries over the limit drop out of co-occurrence and back in
+def test_cooccurrence_library_limit(app, client):
+    app.config["COOCCURRENCE_LIBRARY_LIMIT"] = 2
+    add(client, "alice", 0)
+    add(client, "alice", 1)
+    add(client, "bob", 0)
+    add(client, "bob", 1)
+    assert PieceCooccurrence.query.count() == 2
+
+    add(client, "alice", 2)
+    assert {row.users for row in PieceCooccurrence.query.all()} == {1}
+    assert_matches_rebuild()
+
+    remove(client, "alice", 2)
+    assert {row.users for row in PieceCooccurrence.query.all()} == {2}
+    assert_matches_rebuild()
+
+
+def test_imports_update_counts(client):
+    add(client, "alice", 0)
+    csv = "composer,title,genre\nBach,Mass in B minor,Choral\n"
+    csv += "Mozart,Requiem,Choral\n"
+    client.post(
+        "/library/import",
+        data={"user_name": "bob", "file": (io.BytesIO(csv.encode()), "a.csv")},
+    )
+    assert ("Choral", 3) in snapshot()["genres"]
+    assert_matches_rebuild()
@@ -0,0 +1,97 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gzip
+import shutil
+import brotli
+import pytest
+from flask import url_for
+from app import create_app
+from middleware import assets
+
+STATIC = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "src",
+    "static",
+)
+
+
+# An app serving a copy of the static folder with built assets
+@pytest.fixture
+def app(tmp_path):
+    static_folder = tmp_path / "static"
+    shutil.copytree(
+        STATIC, static_folder, ignore=shutil.ignore_patterns("build")
+    )
+    test_app = create_app(testing=True)
+    test_app.static_folder = str(static_folder)
+    assets.build(test_app.static_folder)
+    assets.load(test_app)
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def styles_url(app):
+    with app.test_request_context():
+        return url_for("static", filename="css/styles.css")
+
+
+def test_url_for_links_fingerprinted_copy(app, client):
+    url = styles_url(app)
+    assert url.startswith("/static/build/css/styles.")
+    assert url.endswith(".css")
+
+    # Pages link the fingerprinted copy too
+    response = client.get("/")
+    assert url.encode() in response.data
+
+
+def test_fingerprint_changes_with_content(app):
+    before = styles_url(app)
+    with open(os.path.join(app.static_folder, "css", "styles.css"), "a") as f:
+        f.write("\n/* changed */\n")
+    assets.build(app.static_folder)
+    assets.load(app)
+    assert styles_url(app) != before
+
+
+def test_fingerprinted_assets_are_immutable(app, client):
+    response = client.get(styles_url(app))
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == assets.ONE_YEAR
+    assert response.mimetype == "text/css"
+
+
+def test_precompressed_copies_are_served(app, client):
+    url = styles_url(app)
+    plain = client.get(url).data
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.mimetype == "text/css"
+    assert brotli.decompress(response.data) == plain
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain
+
+
+def test_images_are_not_precompressed(app, client):
+    with app.test_request_context():
+        url = url_for("static", filename="images/violin.png")
+    response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+    assert "Content-Encoding" not in response.headers
+    assert response.cache_control.immutable
+
+
+# Test that files outside the manifest are served as before
+def test_unfingerprinted_files_are_not_cached_forever(client):
+    response = client.get("/static/css/styles.css")
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
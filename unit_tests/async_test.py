@@ -0,0 +1,106 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+import async_routes
+from unittest.mock import AsyncMock, Mock, patch
+from app import create_app
+from database import db
+
+# Canned upstream responses, keyed by URL
+UPSTREAM = {
+    "https://api.openopus.org/composer/list/name/all.json": {
+        "composers": [{"id": 1, "name": "Mozart", "epoch": "Classical"}]
+    },
+    "https://api.openopus.org/composer/list/pop.json": {
+        "composers": [{"complete_name": "Mozart"}]
+    },
+    "https://api.openopus.org/composer/list/ids/1.json": {
+        "composers": [{"complete_name": "Wolfgang Amadeus Mozart"}]
+    },
+    "https://api.openopus.org/work/list/composer/1/genre/all.json": {
+        "works": [
+            {
+                "title": "Symphony No. 40",
+                "genre": "Orchestral",
+                "subtitle": "Great",
+                "popular": "1",
+                "recommended": "1",
+            },
+            {"title": "Requiem", "genre": "Choral"},
+        ]
+    },
+    "http://api.weatherapi.com/v1/current.json?key=test_key&q=London&aqi=no": {
+        "location": {"name": "London"},
+        "current": {"condition": {"text": "Sunny"}, "temp_c": 20},
+    },
+}
+
+
+def upstream(request):
+    url = str(request.url)
+    if url not in UPSTREAM:
+        return httpx.Response(500)
+    return httpx.Response(200, json=UPSTREAM[url])
+
+
+# Create async mode app with the HTTP client routed to the canned responses
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(
+        async_routes,
+        "http_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(upstream)),
+    )
+    test_app = create_app(testing=True, async_mode=True)
+    # Results pages look up the searching user's library
+    with test_app.app_context():
+        db.create_all()
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_async_form_route(client):
+    response = client.get("/form")
+    assert response.status_code == 200
+    assert b"Mozart" in response.data
+    assert b"Orchestral" in response.data
+
+
+def test_async_search_filters_works(client):
+    form_data = {
+        "composer_id": ["1"],
+        "name": "Mozart",
+        "genres": ["Orchestral"],
+    }
+    response = client.post("/search", data=form_data)
+    assert response.status_code == 200
+    assert b"Symphony No. 40" in response.data
+    assert b"Wolfgang Amadeus Mozart" in response.data
+    assert b"Requiem" not in response.data
+
+
+def test_async_search_validation(client):
+    response = client.post("/search", data={"genres": ["Orchestral"]})
+    assert b"No composer selected" in response.data
+
+
+def test_async_weather_mood(client):
+    with patch("google.generativeai.GenerativeModel") as mock_genai:
+        mock_model = Mock()
+        mock_model.generate_content_async = AsyncMock(
+            return_value=Mock(text="Test music suggestion")
+        )
+        mock_genai.return_value = mock_model
+
+        response = client.get("/weather-mood")
+        assert response.status_code == 200
+        assert b"Sunny" in response.data
+        assert b"Test music suggestion" in response.data
@@ -0,0 +1,165 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import itertools
+import time
+import pytest
+import requests_mock
+from unittest.mock import Mock
+from app import create_app
+from database import db
+from services import upstream
+from services.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+WORKS_URL = "https://api.openopus.org/work/list/composer/{}/genre/all.json"
+COMPOSER_URL = "https://api.openopus.org/composer/list/ids/{}.json"
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    test_app.config["BREAKER_SETTINGS"] = {"window": 4, "min_calls": 2}
+    # Results pages look up the searching user's library
+    with test_app.app_context():
+        db.create_all()
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_breaker_opens_on_failures_and_recovers():
+    breaker = CircuitBreaker("test", min_calls=2, reset_timeout=0.05)
+    breaker.record(True, 0.01)
+    breaker.record(True, 0.01)
+    assert breaker.state == OPEN
+    assert breaker.allow() is False
+
+    # After the cool-down only one trial call is let through
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is False
+
+    breaker.record(False, 0.01)
+    assert breaker.state == CLOSED
+
+
+def test_breaker_opens_on_slow_calls():
+    breaker = CircuitBreaker("test", min_calls=2, slow_call_seconds=0.5)
+    breaker.record(False, 1.0)
+    breaker.record(False, 1.0)
+    assert breaker.state == OPEN
+
+
+def test_breaker_call_raises_when_open():
+    breaker = CircuitBreaker("test", min_calls=1)
+    with pytest.raises(ValueError):
+        breaker.call(int, "not a number")
+    with pytest.raises(CircuitOpenError):
+        breaker.call(int, "1")
+
+
+# Test that one failing composer still renders the other's works
+def test_guarded_stream_counts_once_read(monkeypatch):
+    breaker = CircuitBreaker("test", min_calls=1, slow_call_seconds=0.5)
+    clock = itertools.count()
+    monkeypatch.setattr(time, "monotonic", lambda: next(clock) * 0.1)
+
+    def chunks():
+        with breaker.guard() as timing:
+            for chunk in range(20):
+                timing.first_chunk()
+                yield chunk
+
+    stream = chunks()
+    next(stream)
+    # Nothing is recorded while the stream is being read
+    assert breaker.snapshot()["window_calls"] == 0
+
+    # A long stream whose first chunk came quickly isn't a slow call
+    list(stream)
+    assert breaker.snapshot()["window_calls"] == 1
+    assert breaker.state == CLOSED
+
+
+def test_search_renders_partial_results(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            COMPOSER_URL.format("1,2"),
+            json={
+                "composers": [
+                    {"id": "1", "complete_name": "Wolfgang Amadeus Mozart"},
+                    {"id": "2", "complete_name": "Johann Sebastian Bach"},
+                ]
+            },
+        )
+        mock.get(
+            WORKS_URL.format(1),
+            json={"works": [{"title": "Requiem", "genre": "Choral"}]},
+        )
+        mock.get(WORKS_URL.format(2), status_code=503)
+
+        form_data = {
+            "composer_id": ["1", "2"],
+            "name": "tester",
+            "genres": ["Choral"],
+        }
+        response = client.post("/search", data=form_data)
+        assert response.status_code == 200
+        assert b"Requiem" in response.data
+        assert b"incomplete: Johann Sebastian Bach" in response.data
+
+
+# Test that an open circuit stops calls reaching the upstream at all
+def test_open_circuit_skips_upstream(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(COMPOSER_URL.format(1), status_code=500)
+        mock.get(WORKS_URL.format(1), status_code=500)
+
+        form_data = {"composer_id": ["1"], "name": "t", "genres": ["Choral"]}
+        client.post("/search", data=form_data)
+        calls_before = mock.call_count
+
+        response = client.post("/search", data=form_data)
+        assert response.status_code == 200
+        assert b"incomplete: composer 1" in response.data
+        assert mock.call_count == calls_before
+
+        report = client.get("/metrics").get_json()
+        assert report["breakers"]["openopus"]["state"] == OPEN
+        assert report["breakers"]["openopus"]["rejected"] >= 2
+
+
+# Test that a slow first request is hedged by a faster second one.
+# requests_mock serialises requests, so stub requests.get directly.
+def test_hedged_request_returns_faster_response(app, monkeypatch):
+    app.config["UPSTREAM_HEDGE_AFTER"] = 0.05
+    calls = itertools.count()
+
+    def slow_first(url, timeout):
+        if next(calls) == 0:
+            time.sleep(0.5)
+        return Mock(status_code=200)
+
+    monkeypatch.setattr(upstream.requests, "get", slow_first)
+
+    with app.app_context():
+        started = time.monotonic()
+        response = upstream.get("example", "https://example.com/slow")
+        assert response.status_code == 200
+        assert time.monotonic() - started < 0.4
+        assert next(calls) == 2
+
+        report = app.test_client().get("/metrics").get_json()
+        assert report["breakers"]["example"]["hedged"] == 1
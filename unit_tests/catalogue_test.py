@@ -0,0 +1,127 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import requests_mock
+from app import create_app
+from database import db
+from cli import refresh_catalogue
+from services import catalogue
+
+WORKS_URL = "https://api.openopus.org/work/list/composer/{}/genre/all.json"
+IDS_URL = "https://api.openopus.org/composer/list/ids/{}.json"
+POP_URL = "https://api.openopus.org/composer/list/pop.json"
+
+WORKS = [
+    {"title": "Sonata No. 1", "genre": "Keyboard", "popular": "1"},
+    {"title": "Symphony No. 1", "genre": "Orchestral", "subtitle": ""},
+    {"title": "Sonata No. 2", "genre": "Keyboard", "recommended": "1"},
+    {"title": "Mass", "genre": "Choral"},
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config["CATALOGUE_PATH"] = str(tmp_path / "catalogue.json")
+    # Results pages look up the searching user's library
+    with test_app.app_context():
+        db.create_all()
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_genre_lookup_keeps_upstream_order():
+    index = catalogue.WorksIndex()
+    entry = index.add("1", map(catalogue.compact_work, WORKS))
+
+    titles = [
+        work.title for work in entry.in_genres(["Orchestral", "Keyboard"])
+    ]
+    assert titles == ["Sonata No. 1", "Symphony No. 1", "Sonata No. 2"]
+    assert entry.in_genres(["Opera"]) == []
+    assert entry.works[0].popular is True
+    assert entry.works[2].recommended is True
+
+
+def test_work_strings_are_interned():
+    first = catalogue.compact_work({"title": "".join(["Re", "quiem"])})
+    second = catalogue.compact_work({"title": "".join(["Req", "uiem"])})
+    assert first.title is second.title
+
+
+def test_missing_work_fields_are_empty():
+    work = catalogue.compact_work(
+        {"title": None, "subtitle": None, "genre": None}
+    )
+    assert (work.title, work.subtitle, work.genre) == ("", "", "")
+
+
+# Test that a composer's works are fetched once and then served locally
+def test_search_is_served_from_index(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(IDS_URL.format(1), json={"composers": [{"id": "1"}]})
+        works = mock.get(WORKS_URL.format(1), json={"works": WORKS})
+        form_data = {
+            "composer_id": ["1"],
+            "name": "tester",
+            "genres": ["Keyboard"],
+        }
+
+        client.post("/search", data=form_data)
+        form_data["genres"] = ["Choral"]
+        response = client.post("/search", data=form_data)
+
+        assert b"Mass" in response.data
+        assert b"Sonata No. 1" not in response.data
+        assert works.call_count == 1
+
+
+def test_expired_composers_are_refetched(app):
+    app.config["CATALOGUE_TTL"] = -1
+    with requests_mock.Mocker() as mock, app.app_context():
+        works = mock.get(WORKS_URL.format(1), json={"works": WORKS})
+        catalogue.works_for("1", ["Keyboard"])
+        catalogue.works_for("1", ["Keyboard"])
+        assert works.call_count == 2
+
+
+def test_refresh_command_saves_catalogue(app):
+    with requests_mock.Mocker() as mock:
+        mock.get(POP_URL, json={"composers": [{"id": 1}, {"id": 2}]})
+        mock.get(WORKS_URL.format(1), json={"works": WORKS})
+        mock.get(WORKS_URL.format(2), status_code=500)
+
+        result = app.test_cli_runner().invoke(refresh_catalogue)
+
+    assert result.exit_code == 0
+    assert "Composer 1: 4 works" in result.output
+    assert "Composer 2: failed" in result.output
+    assert "MB per million works" in result.output
+
+    # A fresh app picks the saved works up without touching OpenOpus
+    fresh_app = create_app(testing=True)
+    fresh_app.config["CATALOGUE_PATH"] = app.config["CATALOGUE_PATH"]
+    with fresh_app.app_context():
+        assert catalogue.load() == 1
+        works = catalogue.works_for("1", ["Choral"])
+        assert [work.title for work in works] == ["Mass"]
+        stats = catalogue.get_index().stats(include_memory=True)
+        assert stats["works"] == 4
+        assert stats["mb_per_million_works"] > 0
+
+
+def test_load_keeps_works_fetched_since_saving(app):
+    with app.app_context():
+        catalogue.get_index().add("1", map(catalogue.compact_work, WORKS), 1)
+        catalogue.save()
+        catalogue.get_index().add("1", [])
+
+        catalogue.load()
+        assert catalogue.get_index().composers["1"].works == ()
@@ -0,0 +1,98 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import requests_mock
+from app import create_app
+from database import db
+
+IDS_URL = "https://api.openopus.org/composer/list/ids/{}.json"
+WORKS_URL = "https://api.openopus.org/work/list/composer/{}/genre/all.json"
+ALL_URL = "https://api.openopus.org/composer/list/name/all.json"
+
+COMPOSERS = [
+    {"id": "1", "name": "Mozart", "complete_name": "Wolfgang Amadeus Mozart"},
+    {"id": "2", "name": "Bach", "complete_name": "Johann Sebastian Bach"},
+    {"id": "3", "name": "Chopin", "complete_name": "Frédéric Chopin"},
+]
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    # Results pages look up the searching user's library
+    with test_app.app_context():
+        db.create_all()
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def mock_works(mock):
+    for composer in COMPOSERS:
+        mock.get(
+            WORKS_URL.format(composer["id"]),
+            json={"works": [{"title": "Sonata", "genre": "Keyboard"}]},
+        )
+
+
+def search(client):
+    form_data = {
+        "composer_id": ["1", "2", "3"],
+        "name": "tester",
+        "genres": ["Keyboard"],
+    }
+    return client.post("/search", data=form_data)
+
+
+def name_lookups(mock):
+    return [
+        request
+        for request in mock.request_history
+        if "/composer/list/ids/" in request.url
+    ]
+
+
+# Test that all composer names are fetched in one request, then cached
+def test_names_are_batched_and_cached(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(IDS_URL.format("1,2,3"), json={"composers": COMPOSERS})
+        mock_works(mock)
+
+        response = search(client)
+        assert b"Johann Sebastian Bach" in response.data
+        assert "Frédéric Chopin" in response.get_data(as_text=True)
+        assert len(name_lookups(mock)) == 1
+
+        search(client)
+        assert len(name_lookups(mock)) == 1
+
+
+# Test that names from the search form's composer list are reused
+def test_names_come_from_form_catalogue(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(ALL_URL, json={"composers": COMPOSERS})
+        mock_works(mock)
+
+        client.get("/form")
+        response = search(client)
+        assert b"Wolfgang Amadeus Mozart" in response.data
+        assert name_lookups(mock) == []
+
+
+# Test that only the ids still unknown are requested
+def test_only_missing_names_are_fetched(client):
+    with requests_mock.Mocker() as mock:
+        mock.get(ALL_URL, json={"composers": COMPOSERS[:2]})
+        mock.get(IDS_URL.format("3"), json={"composers": COMPOSERS[2:]})
+        mock_works(mock)
+
+        client.get("/form")
+        response = search(client)
+        assert "Frédéric Chopin" in response.get_data(as_text=True)
+        assert len(name_lookups(mock)) == 1
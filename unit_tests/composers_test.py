@@ -0,0 +1,187 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import inspect, text
+from app import create_app
+from cli import migrate_composers
+from database import db
+from models.composer import Composer
+from models.librarystats import ComposerStats, GenreStats, PieceStats
+from models.musicpiece import MusicPiece, piece_key
+from models.userlibrary import UserLibrary
+
+# music_pieces as it was before the composers table
+OLD_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(80))",
+    "CREATE TABLE music_pieces (id INTEGER PRIMARY KEY, "
+    "composer VARCHAR(80) NOT NULL, title VARCHAR(80) NOT NULL, "
+    "subtitle VARCHAR(80), genre VARCHAR(80) NOT NULL, "
+    "popular BOOLEAN NOT NULL, recommended BOOLEAN NOT NULL, "
+    "CONSTRAINT unique_music_piece UNIQUE (composer, title, subtitle))",
+    "CREATE TABLE user_library (user_id INTEGER REFERENCES users(id), "
+    "music_piece_id INTEGER REFERENCES music_pieces(id), "
+    "PRIMARY KEY (user_id, music_piece_id))",
+    "INSERT INTO users VALUES (1, 'alice'), (2, 'bob')",
+    "INSERT INTO music_pieces VALUES "
+    "(1, 'Bach', 'Mass in B minor', NULL, 'Choral', 1, 0), "
+    "(2, 'Bach', 'Goldberg Variations', '', 'Keyboard', 0, 1), "
+    "(3, 'Chopin', 'Nocturne', 'Op. 9', 'Keyboard', 1, 1), "
+    "(4, 'Bach', 'Mass in B minor', '', 'Choral', 1, 0)",
+    "INSERT INTO user_library VALUES (1, 1), (1, 4), (2, 4), (2, 3)",
+]
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    with test_app.app_context():
+        yield test_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    db.create_all()
+    return app.test_client()
+
+
+def add(client, composer, title, subtitle="", composer_id=None):
+    data = {
+        "user_name": "alice",
+        "composer_name": composer,
+        "title": title,
+        "subtitle": subtitle,
+        "genre": "Keyboard",
+    }
+    if composer_id is not None:
+        data["composer_id"] = composer_id
+    client.post("/library/add_piece", data=data)
+
+
+def test_pieces_share_composer_rows(client):
+    add(client, "Bach", "Goldberg Variations", composer_id=87)
+    add(client, "Bach", "Mass in B minor")
+    add(client, "Chopin", "Nocturne")
+
+    bach = Composer.query.filter_by(name="Bach").one()
+    assert bach.openopus_id == 87
+    assert Composer.query.count() == 2
+    assert {piece.composer_id for piece in MusicPiece.query} == {
+        bach.id,
+        Composer.query.filter_by(name="Chopin").one().id,
+    }
+    # Pieces can still be queried by composer name
+    assert MusicPiece.query.filter_by(composer="Bach").count() == 2
+
+
+def test_pieces_are_deduplicated_by_natural_key(client):
+    add(client, "Bach", "Goldberg Variations")
+    add(client, "Bach", "Goldberg Variations")
+
+    piece = MusicPiece.query.one()
+    assert piece.natural_key == piece_key("Bach", "Goldberg Variations", None)
+    assert UserLibrary.query.count() == 1
+
+
+def test_composer_name_sets_the_composer(client):
+    db.session.add_all(
+        [
+            MusicPiece(
+                composer="Mozart",
+                title=title,
+                genre="Choral",
+                popular=False,
+                recommended=False,
+            )
+            for title in ("Requiem", "Great Mass")
+        ]
+    )
+    db.session.commit()
+
+    assert Composer.query.count() == 1
+    assert [piece.composer for piece in MusicPiece.query] == ["Mozart"] * 2
+
+
+def test_migration(app):
+    for statement in OLD_SCHEMA:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(migrate_composers)
+
+    assert result.exit_code == 0
+    assert "Migrated 3 pieces by 2 composers, merging 1" in result.output
+    columns = {
+        column["name"]
+        for column in inspect(db.engine).get_columns("music_pieces")
+    }
+    assert "composer" not in columns
+    assert {"composer_id", "natural_key"} <= columns
+
+    db.session.expire_all()
+    assert [(piece.id, piece.composer) for piece in MusicPiece.query] == [
+        (1, "Bach"),
+        (2, "Bach"),
+        (3, "Chopin"),
+    ]
+    # Piece 4 duplicated piece 1, so its saves moved there
+    assert sorted(
+        (entry.user_id, entry.music_piece_id) for entry in UserLibrary.query
+    ) == [(1, 1), (2, 1), (2, 3)]
+    bach = Composer.query.filter_by(name="Bach").one()
+    assert db.session.get(ComposerStats, bach.id).saves == 2
+
+    result = app.test_cli_runner().invoke(migrate_composers)
+    assert "already uses the composers table" in result.output
+
+
+def test_migration_without_duplicates_fills_the_totals(app):
+    statements = OLD_SCHEMA[:4] + [
+        "INSERT INTO music_pieces VALUES "
+        "(1, 'Bach', 'Mass in B minor', NULL, 'Choral', 1, 0), "
+        "(2, 'Chopin', 'Nocturne', 'Op. 9', 'Keyboard', 1, 1)",
+        "INSERT INTO user_library VALUES (1, 1), (2, 1), (2, 2)",
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    app.test_cli_runner().invoke(migrate_composers)
+
+    assert db.session.get(PieceStats, 1).saves == 2
+    assert db.session.get(GenreStats, "Keyboard").saves == 1
+
+
+def test_name_keyed_composer_stats_are_rebuilt(client):
+    add(client, "Bach", "Goldberg Variations")
+    add(client, "Bach", "Mass in B minor")
+    db.session.execute(text("DROP TABLE composer_stats"))
+    db.session.execute(
+        text(
+            "CREATE TABLE composer_stats "
+            "(composer VARCHAR(80) PRIMARY KEY, saves INTEGER NOT NULL)"
+        )
+    )
+    db.session.commit()
+
+    result = client.application.test_cli_runner().invoke(migrate_composers)
+
+    assert "Rebuilt composer totals by composer id" in result.output
+    bach = Composer.query.filter_by(name="Bach").one()
+    assert db.session.get(ComposerStats, bach.id).saves == 2
+
+
+def test_pending_composers_are_found_by_name(app):
+    db.create_all()
+    first = Composer.named("Bach")
+    assert Composer.named("Bach") is first
+
+    db.session.rollback()
+    second = Composer.named("Bach")
+    assert second is not first
+    db.session.commit()
+    assert Composer.query.count() == 1
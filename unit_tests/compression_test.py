@@ -0,0 +1,97 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gzip
+import brotli
+import pytest
+import requests_mock
+from app import create_app
+from middleware.compression import minify_html
+
+ALL_URL = "https://api.openopus.org/composer/list/name/all.json"
+
+COMPOSERS = [
+    {"id": str(i), "name": f"Composer {i}", "complete_name": f"Composer {i}"}
+    for i in range(200)
+]
+
+
+@pytest.fixture
+def app():
+    return create_app(testing=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def get_form(client, **headers):
+    with requests_mock.Mocker() as mock:
+        mock.get(ALL_URL, json={"composers": COMPOSERS})
+        return client.get("/form", headers=headers)
+
+
+def test_uncompressed_without_accept_encoding(client):
+    response = get_form(client)
+    assert "Content-Encoding" not in response.headers
+    assert b"Composer 199" in response.data
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_brotli_preferred_over_gzip(client):
+    plain = get_form(client).data
+    response = get_form(client, **{"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(response.data) == plain
+    assert len(response.data) < len(plain)
+
+
+def test_gzip_when_brotli_not_accepted(client):
+    plain = get_form(client).data
+    response = get_form(client, **{"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == plain
+
+
+# Test that an unchanged page is compressed once and revalidates with 304
+def test_compressed_bodies_are_cached_by_etag(app, client):
+    first = get_form(client, **{"Accept-Encoding": "br"})
+    etag = first.headers["ETag"]
+    assert etag.endswith('-br"')
+
+    second = get_form(client, **{"Accept-Encoding": "br"})
+    assert second.data == first.data
+    cache = app.extensions["compression_cache"].snapshot()
+    assert cache["hits"] == 1 and cache["misses"] == 1
+
+    revalidated = get_form(
+        client, **{"Accept-Encoding": "br", "If-None-Match": etag}
+    )
+    assert revalidated.status_code == 304
+
+
+def test_small_responses_are_not_compressed(client):
+    # A search without composers only answers with a short message
+    response = client.post("/search", headers={"Accept-Encoding": "gzip"})
+    assert len(response.data) < 500
+    assert "Content-Encoding" not in response.headers
+
+
+def test_minify_html_keeps_pre_and_newlines():
+    html = "<ul>\n    <li>One</li>\n    <li>Two   Three</li>\n</ul>\n"
+    html += "<pre>  keep\n    this</pre>"
+    assert minify_html(html) == (
+        "<ul>\n<li>One</li>\n<li>Two Three</li>\n</ul>\n"
+        "<pre>  keep\n    this</pre>"
+    )
+
+
+def test_minified_pages_are_smaller(app, client):
+    plain = get_form(client).data
+    app.config["MINIFY_HTML"] = True
+    minified = get_form(client).data
+    assert len(minified) < len(plain)
+    assert b"Composer 199" in minified
@@ -0,0 +1,175 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from unittest.mock import patch
+from app import create_app
+from cli import describe_pieces
+from database import db
+from models.musicpiece import MusicPiece
+from models.piecedescription import PieceDescription
+from services import descriptions, llm, weather
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    test_app.config["LLM_BACKEND"] = "fake"
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+def add_pieces(count):
+    pieces = [
+        MusicPiece(
+            title=f"Piece {i}",
+            composer="Bach",
+            genre="Keyboard",
+            popular=False,
+            recommended=False,
+        )
+        for i in range(count)
+    ]
+    db.session.add_all(pieces)
+    db.session.commit()
+    return pieces
+
+
+def test_parse_batch():
+    text = '```json\n[{"id": 1, "text": "One"}, {"id": 2}, "junk"]\n```'
+    assert llm.parse_batch(text) == {1: "One"}
+    assert llm.parse_batch("not json") == {}
+    assert llm.parse_batch('{"id": 1, "text": "One"}') == {}
+
+
+def test_backfill_batches_prompts(app):
+    pieces = add_pieces(25)
+
+    counts = descriptions.backfill(pieces, batch_size=10)
+
+    assert counts == {"batched": 25, "single": 0, "failed": 0}
+    # Three batched prompts instead of twenty-five
+    assert len(llm.get_model().prompts) == 3
+    assert db.session.query(PieceDescription).count() == 25
+    assert (
+        descriptions.stored(pieces[0].id) == "A fake description of Piece 0."
+    )
+    assert descriptions.undescribed_pieces() == []
+
+
+def test_backfill_falls_back_to_single_prompts(app):
+    pieces = add_pieces(4)
+    model = llm.get_model()
+    answer = model.answer
+
+    # The batch answer leaves out the last piece
+    def drop_last(prompt):
+        text = answer(prompt)
+        if llm.BATCH_MARKER in prompt:
+            return text.rsplit(",", 2)[0] + "]"
+        return text
+
+    with patch.object(model, "answer", side_effect=drop_last):
+        counts = descriptions.backfill(pieces, batch_size=4)
+
+    assert counts == {"batched": 3, "single": 1, "failed": 0}
+    assert descriptions.stored(pieces[3].id).startswith("A fake response")
+
+
+def test_backfill_counts_failures(app):
+    pieces = add_pieces(2)
+    model = llm.get_model()
+
+    with patch.object(
+        model, "generate_content", side_effect=RuntimeError("quota")
+    ):
+        counts = descriptions.backfill(pieces)
+
+    assert counts == {"batched": 0, "single": 0, "failed": 2}
+    assert descriptions.undescribed_pieces() == pieces
+
+
+def test_describe_stores_description(app):
+    piece = add_pieces(1)[0]
+
+    first = descriptions.describe(piece)
+    second = descriptions.describe(piece)
+
+    assert first == second
+    assert len(llm.get_model().prompts) == 1
+
+
+def test_weather_suggestion_is_cached(app):
+    weather_data = {"current": {"condition": {"text": "Rain"}, "temp_c": 9}}
+
+    with app.test_request_context():
+        first = weather.suggest(weather_data, [])
+        second = weather.suggest(weather_data, [])
+
+    assert first == second
+    assert len(llm.get_model().prompts) == 1
+
+
+def test_rate_limiter_waits_for_budget():
+    limiter = llm.RateLimiter(requests_per_minute=2, tokens_per_minute=100)
+
+    assert limiter.reserve(10) == 0
+    assert limiter.reserve(80) == 0
+    # Over the token budget, then over the request budget
+    assert limiter.reserve(20) > 0
+    assert limiter.reserve(1) > 0
+
+
+def test_piece_page_gives_up_on_a_long_rate_limit(app):
+    app.config.update(
+        {"LLM_REQUESTS_PER_MINUTE": 1, "LLM_REQUEST_MAX_WAIT": 0.1}
+    )
+    client = app.test_client()
+    for title in ("Goldberg Variations", "Mass in B minor"):
+        client.post(
+            "/library/add_piece",
+            data={
+                "user_name": "alice",
+                "composer_name": "Bach",
+                "title": title,
+                "genre": "Keyboard",
+            },
+        )
+    piece, other = MusicPiece.query.order_by(MusicPiece.id).all()
+    client.get(f"/library/{piece.id}?user_name=alice")
+
+    body = client.get(f"/library/{other.id}?user_name=alice").get_data(
+        as_text=True
+    )
+
+    assert "Unable to generate description" in body
+    assert "rate limited" in body
+    assert descriptions.stored(other.id) is None
+
+
+def test_ttl_cache_expires():
+    cache = llm.TTLCache(ttl=0, max_entries=2)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+    cache = llm.TTLCache(ttl=60, max_entries=2)
+    for key in "abc":
+        cache.put(key, key)
+    assert cache.get("a") is None
+    assert cache.get("c") == "c"
+
+
+def test_describe_pieces_command(app):
+    add_pieces(5)
+
+    result = app.test_cli_runner().invoke(
+        describe_pieces, ["--batch-size", "2", "--limit", "3"]
+    )
+
+    assert result.exit_code == 0
+    assert "Described 3 of 3 pieces (3 batched" in result.output
+    assert len(descriptions.undescribed_pieces()) == 2
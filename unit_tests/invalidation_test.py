@@ -0,0 +1,162 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import pytest
+from sqlalchemy import inspect
+from app import create_app
+from database import db
+from services import invalidation
+
+
+# Two apps sharing a change log, standing in for two worker processes
+@pytest.fixture
+def workers(tmp_path):
+    apps = []
+    for _ in range(2):
+        app = create_app(testing=True)
+        app.config.update(
+            {
+                "CHANGE_LOG_URI": f"sqlite:///{tmp_path / 'changes.db'}",
+                "CHANGE_POLL_INTERVAL": 0,
+                "SHARE_PATH": str(tmp_path / "shares"),
+            }
+        )
+        apps.append(app)
+    return apps
+
+
+def cached(app, key, value):
+    with app.app_context():
+        cache = invalidation.cache("library_pieces", "library")
+        return cache.get(key, lambda: value)
+
+
+def publish(app, *changes):
+    with app.app_context():
+        invalidation.publish(changes)
+
+
+def test_changes_reach_other_workers(workers):
+    first, second = workers
+    assert cached(second, 7, "old") == "old"
+    assert cached(second, 8, "old") == "old"
+
+    publish(first, ("library", 7))
+    second.test_client().get("/")
+
+    assert cached(second, 7, "new") == "new"
+    assert cached(second, 8, "new") == "old"
+    with second.app_context():
+        report = invalidation.invalidation_metrics()
+    assert report["applied"] == 1
+    assert report["caches"]["library_pieces"]["evictions"] == 1
+
+
+def test_poll_interval_limits_reads(workers):
+    first, second = workers
+    second.config["CHANGE_POLL_INTERVAL"] = 60
+    assert cached(second, 7, "old") == "old"
+
+    publish(first, ("library", 7))
+    second.test_client().get("/")
+    assert cached(second, 7, "new") == "old"
+
+    with second.app_context():
+        invalidation.poll(force=True)
+    assert cached(second, 7, "new") == "new"
+
+
+def test_worker_that_falls_behind_clears_its_caches(workers):
+    first, second = workers
+    first.config["CHANGE_LOG_SIZE"] = 2
+    assert cached(second, 7, "old") == "old"
+
+    publish(first, *(("library", key) for key in range(100, 105)))
+    second.test_client().get("/")
+
+    assert cached(second, 7, "new") == "new"
+    with second.app_context():
+        assert invalidation.invalidation_metrics()["resets"] == 1
+
+
+def test_value_loaded_during_a_change_is_not_kept():
+    cache = invalidation.Cache()
+
+    def load_while_changing():
+        cache.evict("7")
+        return "old"
+
+    assert cache.get(7, load_while_changing) == "old"
+    assert cache.get(7, lambda: "new") == "new"
+
+
+def test_library_edits_evict_cached_pieces(tmp_path):
+    app = create_app(testing=True)
+    app.config["SHARE_PATH"] = str(tmp_path)
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+        for title in ("Mass in B minor", "Goldberg Variations"):
+            client.post(
+                "/library/add_piece",
+                data={
+                    "user_name": "alice",
+                    "composer_name": "Bach",
+                    "title": title,
+                    "genre": "Keyboard",
+                },
+            )
+            page = client.get("/library/?user_name=alice")
+            assert title.encode() in page.data
+
+        # Nothing was cached for alice before the first add
+        report = invalidation.invalidation_metrics()
+        assert report["published"] == 2
+        assert report["caches"]["library_pieces"]["evictions"] == 1
+        db.drop_all()
+
+
+def test_change_log_table_stays_out_of_the_main_database():
+    app = create_app(testing=True)
+    with app.app_context():
+        db.create_all()
+        assert "changes" not in inspect(db.engine).get_table_names()
+        invalidation.publish([("library", 1)])
+        assert invalidation.get_log().version == 1
+        db.drop_all()
+
+
+def test_log_opened_at_once_by_many_threads(tmp_path):
+    apps = []
+    for _ in range(4):
+        app = create_app(testing=True)
+        app.config["CHANGE_LOG_URI"] = f"sqlite:///{tmp_path / 'changes.db'}"
+        apps.append(app)
+    start = threading.Barrier(len(apps) * 4)
+    errors = []
+
+    def open_log(app):
+        with app.app_context():
+            start.wait()
+            try:
+                invalidation.get_log()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [
+        threading.Thread(target=open_log, args=(app,))
+        for app in apps
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for app in apps:
+        with app.app_context():
+            assert invalidation.get_log() is invalidation.get_log()
@@ -0,0 +1,193 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import func, select
+from app import create_app
+from cli import reshard
+from database import db
+from models.librarystats import PieceStats
+from models.musicpiece import MusicPiece
+from models.user import User
+from models.userlibrary import UserLibrary
+from services import aggregates, libraries
+
+PIECES = [
+    ("Bach", "Mass in B minor", "Choral"),
+    ("Bach", "Goldberg Variations", "Keyboard"),
+    ("Chopin", "Nocturne", "Keyboard"),
+    ("Mozart", "Requiem", "Choral"),
+]
+
+USERS = ["alice", "bob", "carol", "dave", "erin", "frank"]
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config.update(
+        {
+            "SHARE_PATH": str(tmp_path),
+            "LIBRARY_SHARDS": 3,
+            "LIBRARY_SHARD_URI": "sqlite://",
+        }
+    )
+    with test_app.app_context():
+        db.create_all()
+        libraries.create_all()
+        yield test_app
+        libraries.drop_all()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add(client, user_name, index):
+    composer, title, genre = PIECES[index]
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": user_name,
+            "composer_name": composer,
+            "title": title,
+            "genre": genre,
+        },
+    )
+
+
+def fill(client):
+    for number, user_name in enumerate(USERS):
+        for index in range(number % len(PIECES) + 1):
+            add(client, user_name, index)
+
+
+def user_id(user_name):
+    return User.query.filter_by(username=user_name).one().id
+
+
+def entries_in(session):
+    return session.scalar(select(func.count()).select_from(UserLibrary))
+
+
+def stats(client):
+    report = client.get("/library/stats?limit=100").json
+    return {
+        "pieces": {(row["title"], row["saves"]) for row in report["pieces"]},
+        "composers": {tuple(row.values()) for row in report["composers"]},
+        "genres": {tuple(row.values()) for row in report["genres"]},
+    }
+
+
+def test_libraries_are_kept_on_their_users_shard(client):
+    fill(client)
+
+    # Only the catalogue is in the main database
+    assert entries_in(db.session) == 0
+    assert MusicPiece.query.count() == len(PIECES)
+    for user_name in USERS:
+        shard = libraries.shard_for(user_id(user_name))
+        store = libraries.stores()[shard]
+        assert store.scalar(
+            select(func.count()).where(
+                UserLibrary.user_id == user_id(user_name)
+            )
+        ) == len(libraries.piece_ids(user_id(user_name)))
+    assert sum(entries_in(store) for store in libraries.stores()) == 13
+    assert len({libraries.shard_for(user_id(name)) for name in USERS}) > 1
+
+    page = client.get("/library/?user_name=bob")
+    assert b"Mass in B minor" in page.data
+    assert b"Goldberg Variations" in page.data
+    assert b"Nocturne" not in page.data
+
+    export = client.get("/library/export?user_name=bob&format=json").json
+    assert [row["title"] for row in export] == [
+        "Mass in B minor",
+        "Goldberg Variations",
+    ]
+
+
+def test_totals_are_summed_over_shards(client):
+    fill(client)
+
+    assert stats(client) == {
+        "pieces": {
+            ("Mass in B minor", 6),
+            ("Goldberg Variations", 4),
+            ("Nocturne", 2),
+            ("Requiem", 1),
+        },
+        "composers": {("Bach", 10), ("Chopin", 2), ("Mozart", 1)},
+        "genres": {("Choral", 7), ("Keyboard", 6)},
+    }
+    mass = MusicPiece.query.filter_by(title="Mass in B minor").one()
+    also = client.get(f"/library/{mass.id}/also_saved").json
+    assert [(piece["title"], piece["users"]) for piece in also] == [
+        ("Goldberg Variations", 4),
+        ("Nocturne", 2),
+        ("Requiem", 1),
+    ]
+
+    before = stats(client)
+    aggregates.rebuild()
+    assert stats(client) == before
+
+
+def test_piece_is_kept_while_any_shard_holds_it(client):
+    for number in range(len(USERS)):
+        add(client, USERS[number], 0)
+    shards = {}
+    for user_name in USERS:
+        shards.setdefault(libraries.shard_for(user_id(user_name)), user_name)
+    first, second = list(shards.values())[:2]
+    piece_id = MusicPiece.query.one().id
+    holders = [name for name in USERS if name not in (first, second)]
+
+    for user_name in holders + [first]:
+        client.post(
+            f"/library/{piece_id}",
+            data={"user_name": user_name, "submit_button": "delete"},
+        )
+    assert db.session.get(MusicPiece, piece_id) is not None
+    assert aggregates.piece_saves(piece_id) == 1
+
+    client.post(
+        f"/library/{piece_id}",
+        data={"user_name": second, "submit_button": "delete"},
+    )
+    assert db.session.get(MusicPiece, piece_id) is None
+    assert aggregates.piece_saves(piece_id) == 0
+    assert not any(
+        store.query(PieceStats).count() for store in libraries.stores()
+    )
+
+
+def test_reshard_moves_libraries_and_aggregates(app, client):
+    app.config["LIBRARY_SHARDS"] = 1
+    fill(client)
+    before = stats(client)
+    bob = libraries.piece_ids(user_id("bob"))
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(reshard, ["4"])
+    assert "Copied 13 library entries into 4 store(s)" in result.output
+    app.config["LIBRARY_SHARDS"] = 4
+    assert stats(client) == before
+    assert libraries.piece_ids(user_id("bob")) == bob
+    assert sum(entries_in(store) for store in libraries.stores()) == 13
+
+    # Edits land in the new layout, and back in one database they're kept
+    add(client, "bob", 3)
+    assert libraries.reshard(1) == {"entries": 14, "shards": 1}
+    aggregates.rebuild(libraries.stores(1))
+    app.config["LIBRARY_SHARDS"] = 1
+    assert entries_in(db.session) == 14
+    assert ("Requiem", 2) in stats(client)["pieces"]
+
+    with pytest.raises(ValueError):
+        libraries.reshard(1)
@@ -0,0 +1,158 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import io
+import json
+import pytest
+from app import create_app
+from cli import export_library, import_library
+from database import db
+from models.musicpiece import MusicPiece
+from models.userlibrary import UserLibrary
+from services import invalidation, library_io
+
+CSV = (
+    "composer,title,subtitle,genre,popular,recommended\n"
+    "Bach,Mass in B minor,BWV 232,Choral,true,true\n"
+    "Chopin,Nocturne,Op. 9 No. 2,Keyboard,1,0\n"
+    "Chopin,Nocturne,Op. 9 No. 2,Keyboard,1,0\n"
+    ",Missing composer,,Keyboard,0,0\n"
+    "Mozart,Requiem,,Choral,false,true\n"
+)
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def upload(client, text, filename="library.csv", user_name="tester"):
+    data = {
+        "user_name": user_name,
+        "file": (io.BytesIO(text.encode()), filename),
+    }
+    return client.post("/library/import", data=data)
+
+
+def test_import_adds_pieces_and_links(client):
+    response = upload(client, CSV)
+    assert response.status_code == 200
+    assert response.json == {
+        "rows": 5,
+        "skipped": 1,
+        "pieces_added": 3,
+        "links_added": 3,
+    }
+    assert MusicPiece.query.count() == 3
+    assert UserLibrary.query.count() == 3
+
+    requiem = MusicPiece.query.filter_by(title="Requiem").one()
+    assert requiem.recommended and not requiem.popular
+
+
+# Test that importing again, or for another user, reuses existing pieces
+def test_import_is_idempotent_and_shares_pieces(client):
+    upload(client, CSV)
+    again = upload(client, CSV)
+    assert again.json["pieces_added"] == 0
+    assert again.json["links_added"] == 0
+
+    other = upload(client, CSV, user_name="other")
+    assert other.json["pieces_added"] == 0
+    assert other.json["links_added"] == 3
+    assert MusicPiece.query.count() == 3
+
+
+def test_import_reuses_pieces_added_from_results(client):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "tester",
+            "composer_name": "Mozart",
+            "title": "Requiem",
+            "genre": "Choral",
+        },
+    )
+    response = upload(client, CSV)
+    assert response.json["pieces_added"] == 2
+    assert MusicPiece.query.count() == 3
+
+
+def test_export_round_trips_csv_and_json(client):
+    upload(client, CSV)
+
+    exported = client.get("/library/export?user_name=tester")
+    assert exported.mimetype == "text/csv"
+    assert "tester-library.csv" in exported.headers["Content-Disposition"]
+    lines = exported.get_data(as_text=True).splitlines()
+    assert lines[0] == "composer,title,subtitle,genre,popular,recommended"
+    assert len(lines) == 4
+
+    exported = client.get("/library/export?user_name=tester&format=json")
+    pieces = json.loads(exported.data)
+    assert {piece["title"] for piece in pieces} == {
+        "Mass in B minor",
+        "Nocturne",
+        "Requiem",
+    }
+
+    # Importing an export into another library gives the same pieces
+    response = upload(client, exported.get_data(as_text=True), "lib.json", "b")
+    assert response.json["links_added"] == 3
+    assert response.json["pieces_added"] == 0
+
+
+def test_export_of_unknown_user_is_empty(client):
+    exported = client.get("/library/export?user_name=nobody&format=json")
+    assert json.loads(exported.data) == []
+
+
+def test_bad_uploads_are_rejected(client):
+    assert upload(client, "{not json", "library.json").status_code == 400
+    assert upload(client, '{"title": "x"}', "library.json").status_code == 400
+    response = client.post("/library/import", data={"user_name": "tester"})
+    assert response.status_code == 400
+
+
+def test_cli_import_and_export(app, tmp_path):
+    source = tmp_path / "library.csv"
+    source.write_text(CSV)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(
+        import_library, ["tester", str(source), "--chunk-size", "2"]
+    )
+    assert result.exit_code == 0
+    assert "3 new pieces" in result.output
+
+    target = tmp_path / "export.json"
+    result = runner.invoke(export_library, ["tester", str(target)])
+    assert result.exit_code == 0
+    assert len(json.loads(target.read_text())) == 3
+
+
+def test_failed_import_announces_committed_chunks(client):
+    upload(client, CSV)
+    published = invalidation.invalidation_metrics()["published"]
+
+    def rows():
+        yield {"composer": "Bach", "title": "Partita", "genre": "Keyboard"}
+        raise ValueError("bad row")
+
+    with pytest.raises(ValueError):
+        library_io.import_library("tester", rows(), chunk_size=1)
+
+    assert UserLibrary.query.count() == 4
+    report = invalidation.invalidation_metrics()
+    assert report["published"] == published + 1
@@ -0,0 +1,130 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import pytest
+from app import create_app
+from database import db
+from models.musicpiece import MusicPiece
+from models.user import User
+from models.userlibrary import UserLibrary
+from services import library_writes
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config.update(
+        {"SHARE_PATH": str(tmp_path), "GROUP_COMMIT_WINDOW": 0.05}
+    )
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def saved(user_name):
+    user = User.query.filter_by(username=user_name).one()
+    return sorted(entry.music_piece.title for entry in user.library)
+
+
+def test_concurrent_edits_share_a_transaction(app):
+    started = threading.Barrier(8)
+
+    def add(number):
+        with app.app_context():
+            started.wait()
+            library_writes.add_piece(
+                "alice", "Bach", f"Invention No. {number}", genre="Keyboard"
+            )
+
+    threads = [
+        threading.Thread(target=add, args=(number,)) for number in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(saved("alice")) == 8
+    report = library_writes.write_metrics()
+    assert report["edits"] == 8
+    assert report["batches"] < 8
+    assert report["largest_batch"] > 1
+
+
+def test_library_shows_an_edit_as_soon_as_it_redirects(client):
+    response = client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": "Bach",
+            "title": "Goldberg Variations",
+            "genre": "Keyboard",
+        },
+        follow_redirects=True,
+    )
+    assert b"Goldberg Variations" in response.data
+
+    piece = MusicPiece.query.one()
+    response = client.post(
+        f"/library/{piece.id}",
+        data={"user_name": "alice", "submit_button": "delete"},
+        follow_redirects=True,
+    )
+    assert b"Goldberg Variations" not in response.data
+
+
+def test_failed_edit_does_not_undo_the_others(app):
+    def broken():
+        raise ValueError("bad edit")
+
+    batch = [
+        library_writes.Edit(
+            library_writes.apply_add,
+            ("alice", "Bach", None, "Partita", "", "Keyboard", False, False),
+        ),
+        library_writes.Edit(broken, ()),
+        library_writes.Edit(
+            library_writes.apply_add,
+            ("bob", "Chopin", None, "Nocturne", "", "Keyboard", False, False),
+        ),
+    ]
+    library_writes.commit(batch)
+    library_writes.release(batch)
+
+    assert saved("alice") == ["Partita"]
+    assert saved("bob") == ["Nocturne"]
+    with pytest.raises(ValueError):
+        batch[1].wait()
+
+
+def test_removing_the_last_save_deletes_the_piece(app):
+    library_writes.add_piece("alice", "Bach", "Partita", genre="Keyboard")
+    library_writes.add_piece("bob", "Bach", "Partita", genre="Keyboard")
+    library_writes.add_piece("bob", "Chopin", "Nocturne", genre="Keyboard")
+    bob = User.query.filter_by(username="bob").one()
+    partita, nocturne = MusicPiece.query.order_by(MusicPiece.id)
+
+    library_writes.remove_piece(bob.id, partita.id)
+    library_writes.remove_piece(bob.id, nocturne.id)
+
+    db.session.expire_all()
+    assert [piece.title for piece in MusicPiece.query] == ["Partita"]
+    assert UserLibrary.query.count() == 1
+
+
+def test_edits_commit_inline_without_group_commit(app):
+    app.config["GROUP_COMMIT"] = False
+
+    library_writes.add_piece("alice", "Bach", "Partita", genre="Keyboard")
+
+    assert saved("alice") == ["Partita"]
+    assert library_writes.write_metrics() == {}
@@ -0,0 +1,229 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from unittest.mock import MagicMock, patch
+from app import create_app
+from cli import llm_usage_report
+from database import db
+from models.llmusage import LlmUsage
+from models.musicpiece import MusicPiece
+from services import descriptions, llm, llm_usage, weather
+
+WEATHER = {
+    "location": {"name": "London"},
+    "current": {"condition": {"text": "Rain"}, "temp_c": 9},
+}
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    test_app.config["LLM_BACKEND"] = "fake"
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_piece():
+    piece = MusicPiece(
+        title="Goldberg Variations",
+        composer="Bach",
+        genre="Keyboard",
+        popular=True,
+        recommended=False,
+    )
+    db.session.add(piece)
+    db.session.commit()
+    return piece
+
+
+def test_calls_are_recorded_per_site(app):
+    llm.generate("Hello there", "greeting")
+    llm.generate("Hello again", "greeting")
+
+    site = llm_usage.usage_metrics()["sites"]["greeting"]
+    assert site["calls"] == 2
+    assert site["errors"] == 0
+    assert site["prompt_tokens"] == 2 * llm_usage.estimate_tokens(
+        "Hello there"
+    )
+    assert site["response_tokens"] > 0
+    assert site["p50_ms"] is not None
+    assert site["cost_usd"] >= 0
+
+
+def test_reported_token_counts_are_used(app):
+    response = MagicMock(text="Hi")
+    response.usage_metadata.prompt_token_count = 7
+    response.usage_metadata.candidates_token_count = 3
+
+    with patch.object(
+        llm.get_model(), "generate_content", return_value=response
+    ):
+        llm.generate("Hello", "greeting")
+
+    site = llm_usage.usage_metrics()["sites"]["greeting"]
+    assert (site["prompt_tokens"], site["response_tokens"]) == (7, 3)
+
+
+def test_errors_are_recorded(app):
+    with patch.object(
+        llm.get_model(), "generate_content", side_effect=RuntimeError("quota")
+    ):
+        with pytest.raises(RuntimeError):
+            llm.generate("Hello", "greeting")
+
+    site = llm_usage.usage_metrics()["sites"]["greeting"]
+    assert (site["calls"], site["errors"]) == (1, 1)
+
+
+def test_cache_hits_are_recorded(app):
+    with app.test_request_context():
+        weather.suggest(WEATHER, [])
+        weather.suggest(WEATHER, [])
+    piece = add_piece()
+    descriptions.describe(piece)
+    descriptions.describe(piece)
+
+    sites = llm_usage.usage_metrics()["sites"]
+    assert sites["weather_mood"]["cache_hits"] == 1
+    assert sites["weather_mood"]["cache_hit_rate"] == 0.5
+    assert sites["piece_description"]["cache_hits"] == 1
+
+
+def test_user_request_rate_is_limited(app):
+    app.config["LLM_USER_REQUESTS_PER_MINUTE"] = 2
+
+    with app.test_request_context(
+        "/?user_name=alice", environ_base={"REMOTE_ADDR": "192.0.2.1"}
+    ):
+        llm.generate("One", "greeting")
+        llm.generate("Two", "greeting")
+        with pytest.raises(llm_usage.LimitExceeded):
+            llm.generate("Three", "greeting")
+
+    # A new user_name from the same client doesn't get a new allowance
+    with app.test_request_context(
+        "/?user_name=mallory", environ_base={"REMOTE_ADDR": "192.0.2.1"}
+    ):
+        with pytest.raises(llm_usage.LimitExceeded):
+            llm.generate("Three", "greeting")
+
+    # Other clients, and bulk jobs outside a request, are unaffected
+    with app.test_request_context(
+        "/?user_name=bob", environ_base={"REMOTE_ADDR": "192.0.2.2"}
+    ):
+        llm.generate("One", "greeting")
+    llm.generate("Four", "greeting")
+
+    site = llm_usage.usage_metrics()["sites"]["greeting"]
+    assert (site["calls"], site["rejected"]) == (4, 2)
+
+
+def test_user_token_budget_is_limited(app):
+    app.config["LLM_USER_TOKENS_PER_DAY"] = 30
+
+    with app.test_request_context(
+        "/?user_name=alice", environ_base={"REMOTE_ADDR": "192.0.2.1"}
+    ):
+        llm.generate("x" * 40, "greeting")
+        with pytest.raises(llm_usage.LimitExceeded):
+            llm.generate("x" * 40, "greeting")
+
+
+def test_global_token_budget_counts_saved_usage(app):
+    db.session.add(
+        LlmUsage(
+            day=llm_usage.today(),
+            site="other_worker",
+            calls=1,
+            prompt_tokens=90,
+            response_tokens=0,
+        )
+    )
+    db.session.commit()
+    app.config["LLM_DAILY_TOKEN_BUDGET"] = 100
+
+    llm_usage.save()
+    with pytest.raises(llm_usage.LimitExceeded):
+        llm.generate("x" * 80, "greeting")
+
+
+def test_usage_is_saved_after_requests(client):
+    with patch(
+        "services.upstream.get",
+        side_effect=[MagicMock(status_code=200, json=lambda: WEATHER)]
+        + [MagicMock(status_code=500)],
+    ):
+        client.get("/weather-mood")
+
+    row = db.session.get(LlmUsage, (llm_usage.today(), "weather_mood"))
+    assert row.calls == 1
+    assert row.prompt_tokens > 0
+    assert not llm_usage.get_ledger().pending
+
+
+def test_saving_leaves_the_request_session_alone(app):
+    db.session.add(
+        MusicPiece(
+            title="Goldberg Variations",
+            composer="Bach",
+            genre="Keyboard",
+            popular=True,
+            recommended=False,
+        )
+    )
+    llm.generate("Hello", "greeting")
+
+    llm_usage.save()
+    db.session.rollback()
+
+    assert MusicPiece.query.count() == 0
+    assert db.session.get(LlmUsage, (llm_usage.today(), "greeting")).calls == 1
+
+
+def test_saves_after_requests_are_spaced(app, client):
+    app.config["LLM_USAGE_SAVE_INTERVAL"] = 60
+    llm_usage.save()
+    llm.generate("Hello", "greeting")
+
+    client.get("/")
+    assert llm_usage.get_ledger().pending
+
+
+def test_library_page_survives_rejection(app, client):
+    app.config["LLM_DAILY_TOKEN_BUDGET"] = 1
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": "Bach",
+            "title": "Goldberg Variations",
+            "genre": "Keyboard",
+        },
+    )
+    piece = MusicPiece.query.one()
+
+    response = client.get(f"/library/{piece.id}?user_name=alice")
+
+    assert response.status_code == 200
+    assert b"Gemini call refused" in response.data
+
+
+def test_llm_usage_command(app):
+    llm.generate("Hello", "greeting")
+
+    result = app.test_cli_runner().invoke(llm_usage_report, ["--days", "1"])
+
+    assert result.exit_code == 0
+    assert "greeting" in result.output
+    assert db.session.get(LlmUsage, (llm_usage.today(), "greeting")).calls == 1
@@ -0,0 +1,97 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tracemalloc
+import pytest
+from app import create_app
+from cli import memory_report
+from middleware import memory
+
+kept = []
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config.update(
+        {
+            "MEMORY_PROFILE": True,
+            "MEMORY_REPORT_PATH": str(tmp_path),
+            "MEMORY_REPORT_INTERVAL": 0,
+            "MEMORY_SAMPLE_EVERY": 1,
+            "MEMORY_LEAK_STREAK": 3,
+        }
+    )
+
+    @test_app.route("/leaky")
+    def leaky():
+        kept.append(bytearray(100_000))
+        return "kept"
+
+    @test_app.route("/spiky")
+    def spiky():
+        scratch = bytearray(5_000_000)
+        return str(len(scratch))
+
+    yield test_app
+    kept.clear()
+    tracemalloc.stop()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def routes(app):
+    with app.app_context():
+        return memory.report()["routes"]
+
+
+def test_peak_and_retained_memory_per_route(app, client):
+    for _ in range(3):
+        client.get("/spiky")
+
+    spiky = routes(app)["spiky"]
+    assert spiky["requests"] == 3
+    assert spiky["peak_max"] >= 5_000_000
+    assert spiky["retained_total"] < 1_000_000
+    assert not spiky["growing"]
+
+
+def test_growing_route_and_call_site_are_flagged(app, client):
+    for _ in range(3):
+        client.get("/leaky")
+        client.get("/spiky")
+
+    report = routes(app)
+    leaky = report["leaky"]
+    assert leaky["growing"]
+    assert leaky["retained_total"] >= 300_000
+    site = leaky["top_sites"][0]["site"]
+    assert site.startswith(os.path.join("unit_tests", "memory_test.py"))
+    assert site in leaky["growing_sites"]
+    assert not report["spiky"]["growing"]
+
+
+def test_report_command_reads_worker_reports(app, client):
+    client.get("/leaky")
+
+    result = app.test_cli_runner().invoke(memory_report)
+    assert f"Worker {os.getpid()}" in result.output
+    assert "leaky" in result.output
+    assert "Memory kept by leaky" in result.output
+
+
+def test_off_by_default(tmp_path):
+    tracemalloc.stop()
+    app = create_app(testing=True)
+    app.config["MEMORY_REPORT_PATH"] = str(tmp_path)
+    app.test_client().get("/")
+
+    assert not tracemalloc.is_tracing()
+    with app.app_context():
+        assert memory.memory_metrics() == {}
+    assert not os.listdir(tmp_path)
@@ -6,12 +6,16 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import pytest
 import requests_mock
 from app import create_app
+from database import db
 
 
 # Create test Flask app instance with in-memory SQLite database
 @pytest.fixture
 def app():
     test_app = create_app(testing=True)
+    # Results pages look up the searching user's library
+    with test_app.app_context():
+        db.create_all()
     return test_app
 
 
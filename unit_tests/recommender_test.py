@@ -0,0 +1,136 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+from app import create_app
+from cli import build_recommendations
+from database import db
+from models.musicpiece import MusicPiece
+from models.user import User
+from models.userlibrary import UserLibrary
+from services import recommender
+
+# user -> pieces. Pieces 1 and 2 are always saved together, 3 goes with 2
+LIBRARIES = {
+    1: [1, 2],
+    2: [1, 2, 3],
+    3: [1, 2],
+    4: [3, 4],
+}
+
+
+def links(libraries):
+    pairs = [
+        (user, piece) for user, pieces in libraries.items() for piece in pieces
+    ]
+    pairs = np.array(pairs, dtype=np.int64)
+    return pairs[:, 0], pairs[:, 1]
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config["RECOMMENDER_PATH"] = str(tmp_path / "recommender")
+    with test_app.app_context():
+        db.create_all()
+        for user_id, pieces in LIBRARIES.items():
+            db.session.add(User(id=user_id, username=f"user{user_id}"))
+            for piece_id in pieces:
+                if not db.session.get(MusicPiece, piece_id):
+                    db.session.add(
+                        MusicPiece(
+                            id=piece_id,
+                            composer="Bach",
+                            title=f"Piece {piece_id}",
+                            genre="Keyboard",
+                            popular=False,
+                            recommended=False,
+                        )
+                    )
+                db.session.add(
+                    UserLibrary(user_id=user_id, music_piece_id=piece_id)
+                )
+        db.session.commit()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_neighbors_are_ranked_by_cosine_similarity():
+    table, recomputed = recommender.build_table(*links(LIBRARIES), k=3)
+    assert recomputed == 4
+    assert table.pieces.tolist() == [1, 2, 3, 4]
+    # Piece 1 was saved by users 1-3, piece 2 by users 1-3, piece 3 by 2, 4
+    assert table.neighbors[0].tolist() == [2, 3, -1]
+    assert table.scores[0][0] == pytest.approx(1.0)
+    assert table.scores[0][1] == pytest.approx(1 / np.sqrt(3 * 2))
+
+
+def test_recommend_sums_similarity_over_library():
+    table, _ = recommender.build_table(*links(LIBRARIES), k=3)
+    assert [piece for piece, _ in table.recommend([1, 2])] == [3]
+    assert [piece for piece, _ in table.recommend([3])] == [4, 1, 2]
+    assert table.recommend([99]) == []
+
+
+# Test that a refresh only recomputes pieces whose saves changed
+def test_incremental_refresh_matches_full_build():
+    table, _ = recommender.build_table(*links(LIBRARIES), k=3)
+    changed = {**LIBRARIES, 5: [4, 5]}
+    refreshed, recomputed = recommender.build_table(
+        *links(changed), k=3, previous=table
+    )
+    assert recomputed == 2
+    full, _ = recommender.build_table(*links(changed), k=3)
+    assert refreshed.neighbors[:, 0].tolist() == full.neighbors[:, 0].tolist()
+
+
+def test_recommendations_route_uses_saved_table(app, client):
+    assert client.get("/library/recommendations?user_name=user4").json == []
+
+    result = app.test_cli_runner().invoke(build_recommendations, ["--full"])
+    assert result.exit_code == 0
+    assert "Recomputed 4 of 4 pieces" in result.output
+
+    response = client.get("/library/recommendations?user_name=user4")
+    assert [piece["title"] for piece in response.json] == [
+        "Piece 1",
+        "Piece 2",
+    ]
+    page = client.get("/library/?user_name=user4")
+    assert b"More like your library" in page.data
+
+    # Nothing changed, so a refresh recomputes nothing
+    result = app.test_cli_runner().invoke(build_recommendations)
+    assert "Recomputed 0 of 4 pieces" in result.output
+
+
+def test_previous_build_is_kept_until_the_next_save(tmp_path):
+    table, _ = recommender.build_table(*links(LIBRARIES), k=3)
+    path = str(tmp_path)
+    builds = []
+    for _ in range(3):
+        recommender.save(table, path)
+        builds.append(recommender.current_build(path))
+
+    # A worker that read meta.json before the last save can still load
+    # the build it named
+    assert (
+        sorted(
+            entry for entry in os.listdir(path) if entry.startswith("build-")
+        )
+        == builds[1:]
+    )
+    assert recommender.read_table(path, builds[1]).pieces.tolist() == [
+        1,
+        2,
+        3,
+        4,
+    ]
@@ -0,0 +1,211 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import requests_mock
+from app import create_app
+from cli import resolve_recordings
+from database import db
+from models.musicpiece import MusicPiece, piece_key
+from models.recording import Recording
+from models.user import User
+from services import recordings, shares
+
+# A local stand-in for the YouTube Data API's search endpoint
+SEARCH_URL = "http://youtube.test/v3/search"
+
+VIDEOS = {"Bach Goldberg Variations": "goldberg123"}
+
+
+def search(request, context):
+    video_id = VIDEOS.get(request.qs["q"][0].title())
+    if video_id is None:
+        return {"items": []}
+    return {"items": [{"id": {"kind": "youtube#video", "videoId": video_id}}]}
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config.update(
+        {
+            "SHARE_PATH": str(tmp_path),
+            "YOUTUBE_API_KEY": "test_key",
+            "YOUTUBE_API_URL": "http://youtube.test/v3",
+        }
+    )
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def youtube():
+    with requests_mock.Mocker() as mock:
+        mock.get(SEARCH_URL, json=search)
+        yield mock
+
+
+@pytest.fixture
+def client(app, youtube):
+    return app.test_client()
+
+
+def add(client, composer, title):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": composer,
+            "title": title,
+            "genre": "Keyboard",
+        },
+    )
+    recordings.wait()
+
+
+def library_page(client):
+    response = client.get("/library/?user_name=alice")
+    recordings.wait()
+    return response.get_data(as_text=True)
+
+
+def test_unresolved_pieces_are_queued_not_searched_inline(app, youtube):
+    pieces = [("Bach", "Goldberg Variations", "")]
+
+    assert recordings.video_ids(pieces) == {}
+    recordings.wait()
+
+    key = piece_key(*pieces[0])
+    assert recordings.video_ids(pieces) == {key: "goldberg123"}
+    assert youtube.call_count == 1
+
+
+def test_library_links_to_resolved_recordings(client, youtube):
+    add(client, "Bach", "Goldberg Variations")
+
+    library_page(client)
+    body = library_page(client)
+
+    assert "https://www.youtube.com/watch?v=goldberg123" in body
+    assert "Play on YouTube" in body
+    assert youtube.call_count == 1
+
+
+def test_searches_that_find_nothing_are_cached(app, client, youtube):
+    add(client, "Bach", "Goldberg Variations")
+    add(client, "Nobody", "Unknown Work")
+
+    library_page(client)
+    body = library_page(client)
+    library_page(client)
+
+    assert youtube.call_count == 2
+    assert "search_query=Nobody+Unknown+Work" in body
+    assert (
+        db.session.get(
+            Recording, piece_key("Nobody", "Unknown Work", None)
+        ).video_id
+        is None
+    )
+
+    # They are tried again once the negative TTL has passed
+    app.config["RECORDING_NEGATIVE_TTL"] = 0
+    library_page(client)
+    assert youtube.call_count == 3
+
+
+def test_failed_searches_are_not_cached(client, youtube):
+    youtube.get(SEARCH_URL, status_code=500)
+    add(client, "Bach", "Goldberg Variations")
+
+    library_page(client)
+    library_page(client)
+
+    # Searched again on the next view
+    assert Recording.query.count() == 0
+    assert recordings.recording_metrics()["errors"] == 2
+
+
+def test_shared_snapshots_pick_up_resolved_recordings(client):
+    add(client, "Bach", "Goldberg Variations")
+    user = User.query.filter_by(username="alice").one()
+    with client.application.test_request_context():
+        link = shares.share_url(user.id).removeprefix("http://localhost")
+
+    # The first render queues the piece, and finding its recording marks
+    # the snapshot stale
+    client.get(link)
+    recordings.wait()
+
+    assert b"watch?v=goldberg123" in client.get(link).data
+
+
+def test_pieces_are_resolved_in_batches(app, youtube):
+    pieces = [("Bach", f"Invention No. {i}", "") for i in range(45)]
+
+    recordings.video_ids(pieces)
+    recordings.video_ids(pieces)
+    recordings.wait()
+
+    # Each piece is searched for once, however often it was queued
+    assert youtube.call_count == 45
+    assert Recording.query.count() == 45
+    assert recordings.recording_metrics()["not_found"] == 45
+
+
+def test_results_rows_only_read_stored_videos(app, youtube):
+    rows = [
+        {
+            "composer_name": "Bach",
+            "title": "Goldberg Variations",
+            "subtitle": "",
+        }
+    ]
+    recordings.attach(rows)
+    recordings.wait()
+
+    assert rows[0]["video_id"] is None
+    assert youtube.call_count == 0
+
+    recordings.video_ids([("Bach", "Goldberg Variations", "")])
+    recordings.wait()
+    assert recordings.attach(rows)[0]["video_id"] == "goldberg123"
+
+
+def test_nothing_is_resolved_without_an_api_key(app, client, youtube):
+    app.config["YOUTUBE_API_KEY"] = None
+    add(client, "Bach", "Goldberg Variations")
+
+    body = library_page(client)
+
+    assert "search_query=Bach" in body
+    assert youtube.call_count == 0
+
+
+def test_resolve_recordings_command(app, youtube):
+    db.session.add_all(
+        [
+            MusicPiece(
+                composer=composer,
+                title=title,
+                genre="Keyboard",
+                popular=False,
+                recommended=False,
+            )
+            for composer, title in (
+                ("Bach", "Goldberg Variations"),
+                ("Nobody", "Unknown Work"),
+            )
+        ]
+    )
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(resolve_recordings)
+
+    assert "Found videos for 1 of 2 pieces (0 failed)" in result.output
+    assert recordings.unresolved_pieces() == []
@@ -0,0 +1,150 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import requests_mock
+from app import create_app
+from database import db
+from services import invalidation, search
+
+IDS_URL = "https://api.openopus.org/composer/list/ids/{}.json"
+WORKS_URL = "https://api.openopus.org/work/list/composer/{}/genre/all.json"
+
+COMPOSERS = [
+    {"id": "1", "complete_name": "Wolfgang Amadeus Mozart"},
+    {"id": "2", "complete_name": "Johann Sebastian Bach"},
+]
+
+
+def works(prefix, count):
+    return [
+        {
+            "title": f"{prefix} No. {i}",
+            "genre": "Keyboard",
+            "popular": "1" if i % 10 == 0 else "0",
+            "recommended": "1" if i % 4 == 0 else "0",
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config["SHARE_PATH"] = str(tmp_path)
+    # Results pages look up the searching user's library
+    with test_app.app_context():
+        db.create_all()
+    return test_app
+
+
+@pytest.fixture
+def client(app):
+    with requests_mock.Mocker() as mock:
+        mock.get(IDS_URL.format("1,2"), json={"composers": COMPOSERS})
+        mock.get(WORKS_URL.format(1), json={"works": works("Sonata", 100)})
+        mock.get(WORKS_URL.format(2), json={"works": works("Partita", 20)})
+        yield app.test_client()
+
+
+QUERY = {"composer_id": ["1", "2"], "genres": ["Keyboard"]}
+
+
+# Test that the results page only carries the first page of works
+def test_results_page_renders_first_page(client):
+    response = client.post("/search", data=dict(QUERY, name="tester"))
+    assert response.status_code == 200
+    assert response.data.count(b'class="work-item"') == search.PAGE_SIZE
+    assert b"of 120 works" in response.data
+    assert b"Johann Sebastian Bach" in response.data
+
+
+def test_works_endpoint_pages(client):
+    page = client.get(
+        "/search/works", query_string=dict(QUERY, offset=90, limit=20)
+    ).get_json()
+    assert page["total"] == 120
+    assert len(page["works"]) == 20
+    assert page["works"][0]["title"] == "Sonata No. 90"
+    assert page["works"][10]["composer_name"] == "Johann Sebastian Bach"
+
+
+def test_works_endpoint_filters(client):
+    popular = client.get(
+        "/search/works", query_string=dict(QUERY, filter="popular")
+    ).get_json()
+    assert popular["total"] == 12
+    assert all(work["popular"] for work in popular["works"])
+
+    bach = client.get(
+        "/search/works",
+        query_string=dict(
+            QUERY, composer="Johann Sebastian Bach", filter="recommended"
+        ),
+    ).get_json()
+    assert bach["total"] == 5
+
+    titled = client.get(
+        "/search/works", query_string=dict(QUERY, q="partita no. 1")
+    ).get_json()
+    assert [work["title"] for work in titled["works"]] == [
+        "Partita No. 1",
+    ] + [f"Partita No. {i}" for i in range(10, 20)]
+
+
+def test_page_args_are_validated():
+    args = search.page_args(
+        {"filter": "bogus", "offset": "-5", "limit": "100000"}
+    )
+    assert args["filter"] == "all"
+    assert args["offset"] == 0
+    assert args["limit"] == search.MAX_PAGE_SIZE
+    assert search.page_args({"limit": "x"})["limit"] == search.PAGE_SIZE
+
+
+def save(client, composer_name, title):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "tester",
+            "composer_name": composer_name,
+            "title": title,
+            "genre": "Keyboard",
+        },
+    )
+
+
+def saved_titles(client, **query):
+    page = client.get(
+        "/search/works",
+        query_string={**QUERY, "user_name": "tester", "limit": 200, **query},
+    ).get_json()
+    return [work["title"] for work in page["works"] if work["saved"]]
+
+
+def test_saved_works_are_marked(app, client):
+    save(client, "Wolfgang Amadeus Mozart", "Sonata No. 3")
+    save(client, "Johann Sebastian Bach", "Partita No. 7")
+    # Same title, other composer
+    save(client, "Johann Sebastian Bach", "Sonata No. 5")
+
+    response = client.post("/search", data=dict(QUERY, name="tester"))
+    assert response.data.count(b'class="badge saved"') == 1
+    assert saved_titles(client) == ["Sonata No. 3", "Partita No. 7"]
+    assert saved_titles(client, user_name="someone else") == []
+
+    # The page fetched after the results page reuses the cached keys
+    with app.app_context():
+        keys = invalidation.invalidation_metrics()["caches"]["library_keys"]
+    assert keys["misses"] == 1
+    assert keys["hits"] == 1
+
+
+def test_saving_a_work_updates_the_marks(client):
+    save(client, "Wolfgang Amadeus Mozart", "Sonata No. 3")
+    assert saved_titles(client) == ["Sonata No. 3"]
+
+    save(client, "Wolfgang Amadeus Mozart", "Sonata No. 4")
+    assert saved_titles(client) == ["Sonata No. 3", "Sonata No. 4"]
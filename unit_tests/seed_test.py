@@ -0,0 +1,62 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import func
+from app import create_app
+from cli import populate, seed
+from database import db
+from models.musicpiece import MusicPiece
+from models.user import User
+from models.userlibrary import UserLibrary
+
+
+@pytest.fixture
+def app():
+    test_app = create_app(testing=True)
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+def run_seed(app, *args):
+    return app.test_cli_runner().invoke(seed, list(args))
+
+
+def test_seed_creates_rows(app):
+    result = run_seed(
+        app, "--users", "200", "--pieces", "500", "--links", "4000"
+    )
+    assert result.exit_code == 0
+    assert User.query.count() == 200
+    assert MusicPiece.query.count() == 500
+    links = UserLibrary.query.count()
+    assert 2000 < links < 6000
+    assert f"{links} library entries" in result.output
+
+
+# Test that popular pieces are in many libraries and most pieces in few
+def test_piece_popularity_is_skewed(app):
+    run_seed(app, "--users", "500", "--pieces", "1000", "--links", "10000")
+    counts = [
+        count
+        for _, count in db.session.query(
+            UserLibrary.music_piece_id, func.count()
+        )
+        .group_by(UserLibrary.music_piece_id)
+        .order_by(func.count().desc())
+    ]
+    assert counts[0] > 100
+    assert counts[len(counts) // 2] < 10
+
+
+# Test that seeding adds to existing data instead of clashing with it
+def test_seed_adds_to_existing_data(app):
+    app.test_cli_runner().invoke(populate)
+    run_seed(app, "--users", "10", "--pieces", "20", "--links", "50")
+    run_seed(app, "--users", "10", "--pieces", "20", "--links", "50")
+    assert User.query.count() == 20
+    assert MusicPiece.query.count() == 42
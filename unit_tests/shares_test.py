@@ -0,0 +1,169 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gzip
+import pytest
+from unittest.mock import patch
+from app import create_app
+from database import db
+from models.user import User
+from services import invalidation, shares
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config.update({"SHARE_PATH": str(tmp_path)})
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add(client, title):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": "Bach",
+            "title": title,
+            "genre": "Keyboard",
+        },
+    )
+
+
+def share_link(client):
+    user = User.query.filter_by(username="alice").one()
+    with client.application.test_request_context():
+        return shares.share_url(user.id).removeprefix("http://localhost")
+
+
+def test_library_page_links_to_its_snapshot(client):
+    add(client, "Goldberg Variations")
+
+    body = client.get("/library/?user_name=alice").get_data(as_text=True)
+
+    assert share_link(client) in body
+
+
+def test_snapshot_follows_library_changes(client):
+    add(client, "Goldberg Variations")
+    link = share_link(client)
+    assert b"Goldberg Variations" in client.get(link).data
+
+    add(client, "Mass in B minor")
+    assert b"Mass in B minor" in client.get(link).data
+
+    client.post(
+        "/library/1",
+        data={"user_name": "alice", "submit_button": "delete"},
+    )
+    body = client.get(link).data
+    assert b"Goldberg Variations" not in body
+    assert b"Mass in B minor" in body
+
+
+def test_edits_only_mark_the_snapshot_stale(client, tmp_path):
+    add(client, "Goldberg Variations")
+    link = share_link(client)
+    client.get(link)
+    path = tmp_path / f"{link.rsplit('/', 1)[1]}.html"
+    assert path.exists()
+
+    add(client, "Mass in B minor")
+
+    assert not path.exists()
+    assert not list(tmp_path.glob("*.html*"))
+    assert shares.share_metrics()["rendered"] == 1
+
+
+def test_shared_library_does_no_database_work(client):
+    add(client, "Goldberg Variations")
+    link = share_link(client)
+
+    with patch.object(
+        db.session, "execute", side_effect=AssertionError("database used")
+    ):
+        response = client.get(link)
+
+    assert response.status_code == 200
+    assert b"alice's Library" in response.data
+    assert b"Goldberg Variations" in response.data
+    assert response.cache_control.public
+    assert "Accept-Encoding" in response.vary
+
+
+def test_shared_library_is_precompressed(client):
+    add(client, "Goldberg Variations")
+
+    response = client.get(
+        share_link(client), headers={"Accept-Encoding": "gzip"}
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert b"Goldberg Variations" in gzip.decompress(response.data)
+
+
+def test_missing_snapshot_is_rendered_on_first_visit(client):
+    add(client, "Goldberg Variations")
+    link = share_link(client)
+    client.get(link)
+    shares.clear()
+
+    response = client.get(link)
+
+    assert response.status_code == 200
+    assert b"Goldberg Variations" in response.data
+    assert shares.share_metrics()["rendered"] == 2
+
+
+def test_forged_links_are_not_found(client):
+    add(client, "Goldberg Variations")
+    link = share_link(client)
+
+    forged = link[:-1] + ("1" if link.endswith("0") else "0")
+
+    assert client.get(forged).status_code == 404
+    assert client.get("/library/share/1-not-a-token").status_code == 404
+    # A genuine token for a user that doesn't exist
+    with client.application.test_request_context():
+        assert (
+            client.get(f"/library/share/{shares.token(99)}").status_code == 404
+        )
+
+
+def test_render_overlapping_another_workers_edit_is_redone(client):
+    add(client, "Goldberg Variations")
+    link = share_link(client)
+    user = User.query.filter_by(username="alice").one()
+    render = shares.render
+    renders = []
+
+    # Another worker marks the snapshot stale mid-render, which only shows
+    # up in the shared change log
+    def render_during_edit(user):
+        renders.append(user.id)
+        if len(renders) == 1:
+            invalidation.get_log().publish([("share", str(user.id))], 100)
+        return render(user)
+
+    with patch("services.shares.render", side_effect=render_during_edit):
+        client.get(link)
+
+    assert renders == [user.id, user.id]
+
+
+def test_secret_is_read_once(app):
+    app.config["SECRET_KEY"] = None
+    key = shares.secret()
+
+    with patch("builtins.open", side_effect=AssertionError("read")):
+        assert shares.secret() == key
@@ -0,0 +1,125 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+import async_routes
+from unittest.mock import MagicMock, patch
+from app import create_app
+from database import db
+from models.musicpiece import MusicPiece
+from services import descriptions, llm, weather
+from services.breaker import get_breaker
+
+WEATHER = {
+    "location": {"name": "London"},
+    "current": {"condition": {"text": "Rain"}, "temp_c": 9},
+}
+
+
+@pytest.fixture(params=[False, True], ids=["sync", "async"])
+def app(request):
+    test_app = create_app(testing=True, async_mode=request.param)
+    test_app.config.update({"LLM_BACKEND": "fake", "STREAM_LLM": True})
+    with test_app.app_context():
+        db.create_all()
+        yield test_app
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_piece(client):
+    client.post(
+        "/library/add_piece",
+        data={
+            "user_name": "alice",
+            "composer_name": "Bach",
+            "title": "Goldberg Variations",
+            "genre": "Keyboard",
+        },
+    )
+    return MusicPiece.query.one()
+
+
+# Answer WeatherAPI in both modes; OpenOpus fails, which the page allows
+@pytest.fixture
+def weather_upstream(monkeypatch):
+    def upstream(request):
+        if "weatherapi" in str(request.url):
+            return httpx.Response(200, json=WEATHER)
+        return httpx.Response(500)
+
+    monkeypatch.setattr(
+        async_routes,
+        "http_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(upstream)),
+    )
+    with patch(
+        "services.upstream.get",
+        side_effect=[
+            MagicMock(status_code=200, json=lambda: WEATHER),
+            MagicMock(status_code=500),
+        ],
+    ):
+        yield
+
+
+def test_page_is_sent_before_the_description(client):
+    piece = add_piece(client)
+
+    response = client.get(f"/library/{piece.id}?user_name=alice")
+    chunks = iter(response.response)
+
+    assert response.is_streamed
+    # The top of the page goes out before Gemini is asked anything
+    head = b""
+    while b"Goldberg Variations" not in head:
+        head += next(chunks)
+    assert llm.get_model().prompts == []
+    body = b"".join(chunks)
+    assert b"A fake response" in body
+    assert b"Back to My Library" in body
+
+
+def test_completed_description_is_stored(client):
+    piece = add_piece(client)
+
+    client.get(f"/library/{piece.id}?user_name=alice").get_data()
+    client.get(f"/library/{piece.id}?user_name=alice").get_data()
+
+    assert descriptions.stored(piece.id).startswith("A fake response")
+    assert len(llm.get_model().prompts) == 1
+
+
+def test_failed_stream_is_not_stored(client):
+    piece = add_piece(client)
+
+    def broken(prompt, stream=False):
+        yield MagicMock(text="Partial ")
+        raise RuntimeError("connection reset")
+
+    with patch.object(llm.get_model(), "generate_content", broken):
+        body = client.get(f"/library/{piece.id}?user_name=alice").get_data()
+
+    assert b"Partial" in body
+    assert b"Unable to generate description. Error: connection reset" in body
+    assert descriptions.stored(piece.id) is None
+    assert get_breaker("gemini").snapshot()["window_failures"] == 1
+
+
+def test_weather_suggestion_is_streamed_and_cached(client, weather_upstream):
+    response = client.get("/weather-mood")
+    assert response.is_streamed
+
+    body = response.get_data()
+    assert b"Rain" in body
+    assert b"A fake response" in body
+    with client.application.test_request_context():
+        prompt = weather.suggestion_prompt(WEATHER, [])
+    assert weather.suggestion_cache().get(prompt).startswith("A fake")
@@ -0,0 +1,194 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import time
+import pytest
+import requests_mock
+from app import create_app
+from cli import warm_catalogue
+from database import db
+from services import catalogue, warming
+
+WORKS_URL = "https://api.openopus.org/work/list/composer/{}/genre/all.json"
+POP_URL = "https://api.openopus.org/composer/list/pop.json"
+
+WORKS = {"works": [{"title": "Mass", "genre": "Choral"}]}
+POPULAR = {
+    "composers": [
+        {"id": "145", "complete_name": "Ludwig van Beethoven"},
+        {"id": "196", "complete_name": "Wolfgang Amadeus Mozart"},
+    ]
+}
+LIBRARY = [
+    ("alice", "87", "Johann Sebastian Bach"),
+    ("alice", "145", "Ludwig van Beethoven"),
+    ("bob", "87", "Johann Sebastian Bach"),
+]
+
+
+@pytest.fixture
+def app(tmp_path):
+    test_app = create_app(testing=True)
+    test_app.config.update(
+        {
+            "CATALOGUE_PATH": str(tmp_path / "catalogue.json"),
+            "SHARE_PATH": str(tmp_path / "shares"),
+            "CATALOGUE_WARM_RATE": 1000,
+        }
+    )
+    with test_app.app_context():
+        db.create_all()
+        client = test_app.test_client()
+        for user_name, composer_id, composer in LIBRARY:
+            client.post(
+                "/library/add_piece",
+                data={
+                    "user_name": user_name,
+                    "composer_id": composer_id,
+                    "composer_name": composer,
+                    "title": "Mass",
+                    "genre": "Choral",
+                },
+            )
+    yield test_app
+    warming.stop(test_app)
+    with test_app.app_context():
+        db.drop_all()
+
+
+def mock_openopus(mock):
+    mock.get(POP_URL, json=POPULAR)
+    return {
+        composer_id: mock.get(WORKS_URL.format(composer_id), json=WORKS)
+        for composer_id in ("87", "145", "196")
+    }
+
+
+def test_library_composers_are_warmed_first(app):
+    with requests_mock.Mocker() as mock, app.app_context():
+        mock_openopus(mock)
+        warmed = warming.warm()
+
+    # Bach is in two libraries, Beethoven in one
+    assert warmed == ["87", "145", "196"]
+
+
+def test_composers_without_an_openopus_id_are_skipped(app):
+    with app.app_context():
+        app.test_client().post(
+            "/library/add_piece",
+            data={
+                "user_name": "carol",
+                "composer_name": "Hildegard von Bingen",
+                "title": "Ordo Virtutum",
+                "genre": "Choral",
+            },
+        )
+        assert warming.library_composer_ids(10) == ["87", "145"]
+
+
+def test_budget_and_fresh_composers(app):
+    with requests_mock.Mocker() as mock, app.app_context():
+        works = mock_openopus(mock)
+        catalogue.get_index().add("87", [])
+
+        assert warming.warm(budget=1) == ["145"]
+        assert warming.warm() == ["196"]
+        assert warming.warm() == []
+        assert works["87"].call_count == 0
+
+        # Works about to expire are fetched again
+        assert warming.warm(ahead=catalogue.ttl()) == ["87", "145", "196"]
+
+
+def test_fetches_are_paced(app):
+    with requests_mock.Mocker() as mock, app.app_context():
+        mock_openopus(mock)
+        started = time.perf_counter()
+        warming.warm(rate=20)
+
+    assert time.perf_counter() - started >= 0.1
+
+
+def test_failed_composer_is_skipped(app):
+    with requests_mock.Mocker() as mock, app.app_context():
+        mock_openopus(mock)
+        mock.get(WORKS_URL.format("145"), status_code=404)
+
+        assert warming.warm() == ["87", "196"]
+        assert warming.warming_metrics()["errors"] == 1
+
+
+def test_command_saves_the_catalogue(app):
+    with requests_mock.Mocker() as mock:
+        mock_openopus(mock)
+        result = app.test_cli_runner().invoke(warm_catalogue, ["--budget", 2])
+
+    assert "Warmed 2 composers" in result.output
+    with app.app_context():
+        catalogue.get_index().composers.clear()
+        assert catalogue.load() == 2
+
+
+def test_background_warming(app):
+    app.config["CATALOGUE_WARM_INTERVAL"] = 60
+    with requests_mock.Mocker() as mock:
+        mock_openopus(mock)
+        warming.start(app)
+        with app.app_context():
+            deadline = time.monotonic() + 5
+            while warming.warming_metrics()["passes"] < 1:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert warming.warming_metrics()["running"]
+            assert set(catalogue.get_index().composers) == {"87", "145", "196"}
+
+    warming.stop(app)
+    with app.app_context():
+        assert not warming.warming_metrics()["running"]
+
+
+def test_only_one_process_warms(app):
+    other = create_app(testing=True)
+    other.config["CATALOGUE_PATH"] = app.config["CATALOGUE_PATH"]
+    with app.app_context():
+        assert warming.hold_lock()
+    with other.app_context():
+        assert not warming.hold_lock()
+
+    with app.app_context():
+        warming.release_lock()
+    with other.app_context():
+        assert warming.hold_lock()
+        warming.release_lock()
+
+
+def test_background_warming_is_shared_through_the_saved_catalogue(app):
+    app.config["CATALOGUE_WARM_INTERVAL"] = 60
+    other = create_app(testing=True)
+    other.config.update(
+        {
+            "CATALOGUE_PATH": app.config["CATALOGUE_PATH"],
+            "CATALOGUE_WARM_INTERVAL": 0.01,
+        }
+    )
+    with requests_mock.Mocker() as mock:
+        works = mock_openopus(mock)
+        warming.start(app)
+        with app.app_context():
+            deadline = time.monotonic() + 5
+            while warming.warming_metrics()["passes"] < 1:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert warming.warming_metrics()["warming"]
+
+        warming.start(other)
+        with other.app_context():
+            while set(catalogue.get_index().composers) != {"87", "145", "196"}:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            assert warming.warming_metrics()["passes"] == 0
+        assert [work.call_count for work in works.values()] == [1, 1, 1]
+        warming.stop(other)
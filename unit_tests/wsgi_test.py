@@ -0,0 +1,36 @@
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import runpy
+import pytest
+from app import create_app
+
+
+# Load the gunicorn config the same way gunicorn does, from the file
+@pytest.fixture
+def config(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    monkeypatch.setenv("GUNICORN_THREADS", "1")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return runpy.run_path(os.path.join(root, "gunicorn.conf.py"))
+
+
+def test_gunicorn_config_from_environment(config):
+    assert config["workers"] == 3
+    assert config["threads"] == 1
+    assert config["worker_class"] == "sync"
+    assert config["preload_app"] is True
+    assert config["max_requests"] > 0
+    assert config["max_requests_jitter"] > 0
+
+
+def test_warm_up_compiles_templates_and_connects():
+    # Import lazily: wsgi builds the production app at import time
+    import wsgi
+
+    app = create_app(testing=True)
+    wsgi.warm_up(app)
+
+    assert len(app.jinja_env.cache) >= len(wsgi.TEMPLATES)
@@ -0,0 +1,47 @@
+import gc
+from app import create_app
+from database import db as database
+from services import warming
+
+# Production WSGI entry point, served by gunicorn (see gunicorn.conf.py)
+app = create_app()
+
+# Templates compiled before forking are shared by every worker
+TEMPLATES = [
+    "about.html",
+    "form.html",
+    "library.html",
+    "library_piece.html",
+    "results.html",
+    "weather_mood.html",
+]
+
+
+# Compile templates ahead of the first request
+def compile_templates(flask_app):
+    for name in TEMPLATES:
+        flask_app.jinja_env.get_template(name)
+
+
+# Prepare the preloaded app in the master before any worker is forked
+def prepare_master(flask_app):
+    compile_templates(flask_app)
+
+    # Keep long-lived objects out of the collector so forked workers don't
+    # touch (and copy) their pages on every garbage collection
+    gc.freeze()
+
+
+# Per-worker warm-up, run by gunicorn once each worker has booted
+def warm_up(flask_app):
+    compile_templates(flask_app)
+
+    with flask_app.app_context():
+        # Drop any connections inherited from the master, then open a fresh
+        # one so the first request doesn't pay for it
+        database.engine.dispose()
+        with database.engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+
+    # Keep popular composers' works fresh in this worker's catalogue
+    warming.start(flask_app)